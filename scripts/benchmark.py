@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Benchmark Script
+Measures latency and output deviation of ImgGen AI performance options
+"""
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import get_context
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Add the repo root to path; the src package uses relative imports
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.core.memory import current_rss
+from src.utils.handoff import SharedImageRegistry, attach_shared_image
+
+if TYPE_CHECKING:
+    from src.core.app import ImgGenApp
+
+DEFAULT_PROMPT = "A lighthouse on a rocky coast at dusk, detailed oil painting"
+
+def timed_generate(app: "ImgGenApp", **params) -> Tuple[float, np.ndarray]:
+    """Run one text-to-image generation and return (seconds, uint8 image array)"""
+    start = time.perf_counter()
+    result = app.generate_image(**params)
+    elapsed = time.perf_counter() - start
+    
+    if not result["success"]:
+        raise RuntimeError(result["error"])
+    
+    image = np.asarray(Image.open(result["image_path"]).convert("RGB"))
+    return elapsed, image
+
+def deviation(reference: np.ndarray, image: np.ndarray) -> Dict[str, float]:
+    """Pixel deviation of an image from a reference of the same size"""
+    diff = reference.astype(np.float32) - image.astype(np.float32)
+    mse = float(np.mean(diff ** 2))
+    psnr = float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+    return {"mean_abs_diff": float(np.mean(np.abs(diff))), "psnr": psnr}
+
+def measure(fn, *args, **kwargs) -> Tuple[Any, float, int]:
+    """Run fn and return (result, seconds, peak memory in bytes)
+
+    Peak is the CUDA allocator high-water mark on GPU, otherwise the highest
+    process RSS sampled every 10ms while fn runs.
+    """
+    import torch
+    
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        torch.cuda.synchronize()
+        return result, time.perf_counter() - start, torch.cuda.max_memory_allocated()
+    
+    peak = [current_rss()]
+    done = threading.Event()
+    
+    def sample():
+        while not done.wait(0.01):
+            peak[0] = max(peak[0], current_rss())
+    
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    return result, elapsed, max(peak[0], current_rss())
+
+def module_bytes(*modules) -> int:
+    """Parameter and buffer bytes of distinct modules"""
+    seen = {}
+    for module in modules:
+        if module is None:
+            continue
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            seen[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+    return sum(seen.values())
+
+def print_table(rows: List[Dict[str, Any]]):
+    """Print benchmark rows as an aligned table"""
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    cells = [[f"{row[c]:.3f}" if isinstance(row[c], float) else str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)))
+
+def bench_token_merging(app: "ImgGenApp", args) -> List[Dict[str, Any]]:
+    """Latency and quality deviation of token merging across ratios, merge depths and resolutions
+    
+    ``blocks`` is the number of UNet transformer blocks that actually merge tokens
+    at that depth; a row with none measures no merging at all.
+    """
+    token_merging = app.model_manager.token_merging
+    configured = token_merging.max_downsample
+    rows = []
+    try:
+        for size in args.resolutions:
+            base = dict(prompt=args.prompt, width=size, height=size, steps=args.steps, seed=args.seed)
+            
+            # Warm-up run so the first measured ratio does not pay one-off costs
+            timed_generate(app, token_merging_ratio=0.0, **{**base, "steps": 2})
+            
+            baseline_time, reference = timed_generate(app, token_merging_ratio=0.0, **base)
+            pipeline = app.pipeline.sdxl_pipeline
+            for max_downsample in args.max_downsample:
+                # The depth is baked into the patch; drop it so the next ratio re-patches
+                token_merging.remove(pipeline)
+                token_merging.max_downsample = max_downsample
+                blocks = token_merging.merging_blocks(pipeline, max_downsample)
+                for ratio in args.ratios:
+                    if ratio == 0.0:
+                        elapsed, image = baseline_time, reference
+                    else:
+                        elapsed, image = timed_generate(app, token_merging_ratio=ratio, **base)
+                    rows.append({
+                        "resolution": f"{size}x{size}",
+                        "max_downsample": max_downsample,
+                        "blocks": blocks,
+                        "ratio": ratio,
+                        "seconds": elapsed,
+                        "speedup": baseline_time / elapsed,
+                        **deviation(reference, image)
+                    })
+    finally:
+        token_merging.remove(app.pipeline.sdxl_pipeline)
+        token_merging.max_downsample = configured
+    return rows
+
+def bench_guidance_truncation(app: "ImgGenApp", args) -> List[Dict[str, Any]]:
+    """Step time and output deviation of CFG truncation across cutoffs"""
+    base = dict(prompt=args.prompt, width=args.resolution, height=args.resolution, steps=args.steps, seed=args.seed)
+    timed_generate(app, **{**base, "steps": 2})
+    
+    baseline_time, reference = timed_generate(app, **base)
+    rows = [{"mode": "full cfg", "seconds": baseline_time, "sec_per_step": baseline_time / args.steps,
+             "speedup": 1.0, **deviation(reference, reference)}]
+    
+    variants = [(f"cutoff {c}", {"cfg_cutoff": c}) for c in args.cutoffs]
+    variants += [(f"adaptive {t}", {"cfg_adaptive_threshold": t}) for t in args.thresholds]
+    for label, options in variants:
+        elapsed, image = timed_generate(app, **base, **options)
+        rows.append({
+            "mode": label,
+            "seconds": elapsed,
+            "sec_per_step": elapsed / args.steps,
+            "speedup": baseline_time / elapsed,
+            **deviation(reference, image)
+        })
+    return rows
+
+def _consume_shared(descriptor, results):
+    """Attach to a shared image from another process and report its checksum"""
+    start = time.perf_counter()
+    array, shm = attach_shared_image(descriptor)
+    checksum = int(array[::64, ::64].sum())
+    results.put((time.perf_counter() - start, checksum))
+    shm.close()
+
+def _consume_png(path, results):
+    """Re-read and decode a PNG from another process"""
+    start = time.perf_counter()
+    array = np.asarray(Image.open(path).convert("RGB"))
+    checksum = int(array[::64, ::64].sum())
+    results.put((time.perf_counter() - start, checksum))
+
+def bench_handoff(app: "ImgGenApp", args) -> List[Dict[str, Any]]:
+    """Hand-off latency of array / shared memory results against the PNG round trip"""
+    import torch
+    from src.utils.handoff import tensor_to_uint8
+    
+    ctx = get_context("spawn")
+    registry = SharedImageRegistry()
+    rows = []
+    
+    for size in args.resolutions:
+        decoded = torch.rand(1, 3, size, size)
+        timings = {"png": [], "array": [], "shared_memory": []}
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(args.repeats):
+                # PNG: encode to disk, then a consumer process re-reads and decodes it
+                start = time.perf_counter()
+                array = tensor_to_uint8(decoded)[0]
+                path = Path(tmp) / f"{i}.png"
+                Image.fromarray(array).save(path, "PNG")
+                produce = time.perf_counter() - start
+                results = ctx.Queue()
+                worker = ctx.Process(target=_consume_png, args=(str(path), results))
+                worker.start()
+                consume, _ = results.get()
+                worker.join()
+                timings["png"].append(produce + consume)
+                
+                # In-process: numpy view of the quantised tensor
+                start = time.perf_counter()
+                tensor_to_uint8(decoded)[0]
+                timings["array"].append(time.perf_counter() - start)
+                
+                # Shared memory: publish, then a consumer process maps it
+                start = time.perf_counter()
+                descriptor = registry.publish(tensor_to_uint8(decoded)[0])
+                produce = time.perf_counter() - start
+                worker = ctx.Process(target=_consume_shared, args=(descriptor, results))
+                worker.start()
+                consume, _ = results.get()
+                worker.join()
+                registry.release(descriptor["name"])
+                timings["shared_memory"].append(produce + consume)
+        
+        png = float(np.median(timings["png"]))
+        for mode, values in timings.items():
+            median = float(np.median(values))
+            rows.append({
+                "resolution": f"{size}x{size}",
+                "mode": mode,
+                "median_ms": median * 1000,
+                "speedup_vs_png": png / median
+            })
+    return rows
+
+def bench_admission(app: "ImgGenApp", args) -> List[Dict[str, Any]]:
+    """Admission decision latency under concurrent load"""
+    from concurrent.futures import ThreadPoolExecutor
+    from src.core.admission import AdmissionController
+    from src.utils.config import Config
+    
+    config = Config(args.config)
+    rows = []
+    for threads in args.threads:
+        controller = AdmissionController(config)
+        params = {"width": 1024, "height": 1024, "steps": 20}
+        
+        def worker(index: int) -> float:
+            start = time.perf_counter()
+            for i in range(args.decisions):
+                controller.admit(f"client-{(index * args.decisions + i) % args.clients}", "txt2img", params)
+            return time.perf_counter() - start
+        
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            per_thread = list(pool.map(worker, range(threads)))
+        wall = time.perf_counter() - start
+        
+        total = threads * args.decisions
+        rows.append({
+            "threads": threads,
+            "decisions": total,
+            "us_per_decision": float(np.mean(per_thread)) / args.decisions * 1e6,
+            "decisions_per_sec": total / wall
+        })
+    return rows
+
+def bench_refiner(app: "ImgGenApp", args) -> List[Dict[str, Any]]:
+    """Two-stage latent hand-off against running the refiner as a separate img2img pass"""
+    from diffusers import StableDiffusionXLImg2ImgPipeline
+    
+    manager = app.model_manager
+    pipeline = app.pipeline
+    pipeline._ensure_models_loaded("sdxl")
+    pipeline._ensure_models_loaded("refiner")
+    base, refiner = pipeline.sdxl_pipeline, pipeline.refiner_pipeline
+    split = args.denoising_end
+    common = dict(prompt=args.prompt, num_inference_steps=args.steps, guidance_scale=7.5)
+    size = dict(width=args.resolution, height=args.resolution)
+    
+    def latent_handoff():
+        latents = base(**common, **size, denoising_end=split, output_type="latent").images
+        return refiner(**common, image=latents, denoising_start=split).images[0]
+    
+    def separate_pass():
+        image = base(**common, **size).images[0]
+        return refiner(**common, image=image, strength=1 - split).images[0]
+    
+    latent_handoff()  # warm-up
+    rows = []
+    for label, fn in (("latent hand-off", latent_handoff), ("decode + img2img", separate_pass)):
+        _, seconds, peak = measure(fn)
+        rows.append({"mode": label, "seconds": seconds, "peak_gb": peak / 1024 ** 3})
+    
+    # Weight memory of the refiner with shared components against a standalone copy
+    shared_bytes = module_bytes(refiner.unet)
+    refiner_source = manager._resolve_model(app.config.get("models.sdxl_refiner"), "sdxl-refiner")
+    standalone = StableDiffusionXLImg2ImgPipeline.from_pretrained(
+        refiner_source,
+        torch_dtype=manager.profile.torch_dtype,
+        use_safetensors=True,
+        variant=manager._source_variant(refiner_source)
+    )
+    standalone_bytes = module_bytes(standalone.unet, standalone.vae, standalone.text_encoder_2)
+    del standalone
+    for row in rows:
+        row["refiner_weights_gb"] = shared_bytes / 1024 ** 3
+        row["standalone_refiner_weights_gb"] = standalone_bytes / 1024 ** 3
+    return rows
+
+def bench_progressive(app: "ImgGenApp", args) -> List[Dict[str, Any]]:
+    """End-to-end time and peak memory of progressive vs native high-resolution generation"""
+    base = dict(prompt=args.prompt, width=args.resolution, height=args.resolution, steps=args.steps, seed=args.seed)
+    timed_generate(app, **{**base, "width": 512, "height": 512, "steps": 2})
+    
+    variants = [("native", {"progressive": False})]
+    for stages in args.stages:
+        for upscaler in ("latent", "pixel"):
+            variants.append((f"{stages} stage(s), {upscaler}", {"progressive": {
+                "base_size": args.base_size, "stages": stages, "upscaler": upscaler,
+                "refine_steps": args.refine_steps, "strength": args.strength
+            }}))
+    
+    rows = []
+    native_time = None
+    for label, options in variants:
+        (_, _), seconds, peak = measure(timed_generate, app, **base, **options)
+        native_time = native_time or seconds
+        rows.append({"mode": label, "seconds": seconds, "speedup": native_time / seconds, "peak_gb": peak / 1024 ** 3})
+    return rows
+
+def bench_concurrency(app: "ImgGenApp", args) -> List[Dict[str, Any]]:
+    """CPU throughput against K concurrent workers sharing one set of weights"""
+    from src.core.executor import ConcurrentExecutor
+    
+    def params(index: int) -> Dict[str, Any]:
+        return {"prompt": args.prompt, "width": args.resolution, "height": args.resolution,
+                "num_inference_steps": args.steps, "guidance_scale": 7.5, "seed": args.seed + index}
+    
+    def load(result: Dict[str, Any]) -> np.ndarray:
+        if not result["success"]:
+            raise RuntimeError(result["error"])
+        return np.asarray(Image.open(result["image_path"]).convert("RGB"))
+    
+    # Baseline: one request at a time in-process, torch using every core
+    start = time.perf_counter()
+    baseline = [load(app.pipeline.text_to_image(params(i))) for i in range(args.requests_per_worker)]
+    seconds = time.perf_counter() - start
+    baseline_rate = args.requests_per_worker / seconds
+    rows = [{"workers": 0, "requests": args.requests_per_worker, "images_per_min": baseline_rate * 60,
+             "mean_latency_s": seconds / args.requests_per_worker, "speedup": 1.0, "max_abs_diff": 0.0}]
+    
+    for workers in args.workers:
+        executor = ConcurrentExecutor(app.pipeline, workers)
+        executor.start()
+        requests = workers * args.requests_per_worker
+        try:
+            start = time.perf_counter()
+            submitted = [(time.perf_counter(), executor.submit("txt2img", params(i))) for i in range(requests)]
+            results = [(future.result(), time.perf_counter() - queued) for queued, future in submitted]
+            seconds = time.perf_counter() - start
+        finally:
+            executor.shutdown()
+        
+        # Per-request generators make results independent of scheduling
+        images = [load(result) for result, _ in results]
+        diff = max(float(np.max(np.abs(baseline[i].astype(np.int16) - images[i].astype(np.int16))))
+                   for i in range(min(len(baseline), len(images))))
+        rows.append({
+            "workers": workers,
+            "requests": requests,
+            "images_per_min": requests / seconds * 60,
+            "mean_latency_s": float(np.mean([latency for _, latency in results])),
+            "speedup": requests / seconds / baseline_rate,
+            "max_abs_diff": diff
+        })
+    return rows
+
+def bench_logging(app: "ImgGenApp", args) -> List[Dict[str, Any]]:
+    """Per-call cost of a log statement on the calling thread, synchronous vs queued"""
+    import logging
+    from src.utils.logger import setup_logger, shutdown_logging
+    
+    def synchronous(name: str, log_file: Path, stream) -> logging.Logger:
+        # The previous setup: formatting and both writes happen on the calling thread
+        logger = logging.getLogger(name)
+        logger.handlers.clear()
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        for handler in (logging.StreamHandler(stream), logging.FileHandler(log_file)):
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
+        return logger
+    
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        console = open(Path(tmp) / "console.log", "w")
+        stdout = sys.stdout
+        configurations = {
+            "sync": lambda: synchronous("bench.sync", Path(tmp) / "sync.log", console),
+            "queue": lambda: setup_logger("bench.queue", log_file=str(Path(tmp) / "queue.log"),
+                                          max_file_size="10MB", backup_count=2),
+            "queue_json": lambda: setup_logger("bench.json", log_file=str(Path(tmp) / "json.log"),
+                                               max_file_size="10MB", backup_count=2, json_format=True)
+        }
+        
+        for name, make_logger in configurations.items():
+            sys.stdout = console  # Listener console handlers bind sys.stdout at setup
+            try:
+                logger = make_logger()
+                timings = {"generate": 1.234, "save": 0.056}
+                per_call = []
+                for i in range(args.calls):
+                    start = time.perf_counter()
+                    logger.info(f"step {i} finished", extra={"stage": "txt2img", "timings": timings})
+                    per_call.append(time.perf_counter() - start)
+                
+                drain_start = time.perf_counter()
+                if name != "sync":
+                    shutdown_logging()
+                drain = time.perf_counter() - drain_start
+            finally:
+                sys.stdout = stdout
+            
+            per_call_us = np.array(per_call) * 1e6
+            rows.append({
+                "handler": name,
+                "calls": args.calls,
+                "mean_us": float(per_call_us.mean()),
+                "p99_us": float(np.percentile(per_call_us, 99)),
+                "max_us": float(per_call_us.max()),
+                "drain_s": drain
+            })
+        console.close()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="ImgGen AI performance benchmarks")
+    parser.add_argument("--config", default="config/default.yaml", help="Configuration file")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT, help="Prompt used for every run")
+    parser.add_argument("--steps", type=int, default=20, help="Inference steps per run")
+    parser.add_argument("--seed", type=int, default=42, help="Seed shared by all runs")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    
+    tome = subparsers.add_parser("tome", help="Token merging ratios")
+    tome.add_argument("--ratios", type=float, nargs="+", default=[0.0, 0.3, 0.5, 0.7])
+    tome.add_argument("--resolutions", type=int, nargs="+", default=[768, 1024, 1536])
+    tome.add_argument("--max-downsample", type=int, nargs="+", default=[1, 2, 4], choices=[1, 2, 4, 8])
+    tome.set_defaults(func=bench_token_merging, needs_app=True)
+    
+    cfg = subparsers.add_parser("cfg", help="Classifier-free guidance truncation")
+    cfg.add_argument("--cutoffs", type=float, nargs="+", default=[0.8, 0.6, 0.4])
+    cfg.add_argument("--thresholds", type=float, nargs="*", default=[0.05, 0.1])
+    cfg.add_argument("--resolution", type=int, default=1024)
+    cfg.set_defaults(func=bench_guidance_truncation, needs_app=True)
+    
+    refiner = subparsers.add_parser("refiner", help="Base -> refiner latent hand-off vs separate img2img pass")
+    refiner.add_argument("--denoising-end", type=float, default=0.8)
+    refiner.add_argument("--resolution", type=int, default=1024)
+    refiner.set_defaults(func=bench_refiner, needs_app=True)
+    
+    hires = subparsers.add_parser("progressive", help="Progressive vs native high-resolution generation")
+    hires.add_argument("--resolution", type=int, default=2048)
+    hires.add_argument("--base-size", type=int, default=1024)
+    hires.add_argument("--stages", type=int, nargs="+", default=[1, 2])
+    hires.add_argument("--refine-steps", type=int, default=8)
+    hires.add_argument("--strength", type=float, default=0.35)
+    hires.set_defaults(func=bench_progressive, needs_app=True)
+    
+    handoff = subparsers.add_parser("handoff", help="Result hand-off latency (no model needed)")
+    handoff.add_argument("--resolutions", type=int, nargs="+", default=[512, 1024, 2048])
+    handoff.add_argument("--repeats", type=int, default=10)
+    handoff.set_defaults(func=bench_handoff, needs_app=False)
+    
+    admission = subparsers.add_parser("admission", help="Admission control decision latency (no model needed)")
+    admission.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+    admission.add_argument("--decisions", type=int, default=20000, help="Decisions per thread")
+    admission.add_argument("--clients", type=int, default=1000)
+    admission.set_defaults(func=bench_admission, needs_app=False)
+    
+    concurrency = subparsers.add_parser("concurrency", help="CPU throughput vs number of concurrent workers")
+    concurrency.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    concurrency.add_argument("--requests-per-worker", type=int, default=2)
+    concurrency.add_argument("--resolution", type=int, default=512)
+    concurrency.set_defaults(func=bench_concurrency, needs_app=True)
+    
+    logs = subparsers.add_parser("logging", help="Log call overhead, synchronous vs queue listener (no model needed)")
+    logs.add_argument("--calls", type=int, default=50000)
+    logs.set_defaults(func=bench_logging, needs_app=False)
+    
+    args = parser.parse_args()
+    
+    app = None
+    if args.needs_app:
+        # Loads torch and diffusers; the modes that need no model skip it
+        from src.core.app import ImgGenApp
+        app = ImgGenApp(config_path=args.config)
+    print_table(args.func(app, args))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
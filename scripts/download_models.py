@@ -2,78 +2,448 @@
 """
 Model Download Script
 Downloads required models for ImgGen AI
+
+Only the files the model loaders actually use are fetched (configs, tokenizers
+and one weight variant per component), in parallel, with resumable partial
+files and hash verification against a manifest. The source can be the
+Hugging Face Hub, an HTTP mirror or a local directory laid out like model_dir,
+so air-gapped nodes can be provisioned from a copy of an existing model_dir.
 """
 
+import abc
+import argparse
+import fnmatch
+import hashlib
+import json
 import os
+import re
 import sys
-from pathlib import Path
-from huggingface_hub import snapshot_download, hf_hub_download
-from tqdm import tqdm
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional, Set, Tuple
+
+import requests
 
 # Add src to path
 sys.path.append(str(Path(__file__).parent.parent / "src"))
 
 from utils.config import Config
 from utils.logger import setup_logger
+from utils.model_store import ModelStore
 
-def download_model(repo_id: str, local_dir: Path, logger):
-    """Download model from Hugging Face Hub"""
-    try:
-        logger.info(f"Downloading {repo_id}...")
-        snapshot_download(
-            repo_id=repo_id,
-            local_dir=local_dir,
-            local_dir_use_symlinks=False,
-            resume_download=True
-        )
-        logger.info(f"✓ Downloaded {repo_id}")
-        return True
-    except Exception as e:
-        logger.error(f"✗ Failed to download {repo_id}: {e}")
-        return False
+MANIFEST_NAME = "manifest.json"
+CHUNK_SIZE = 8 * 1024 * 1024
 
-def main():
-    logger = setup_logger("model_downloader")
-    config = Config()
-    
-    model_dir = Path(config.get("model_dir", "data/models"))
-    model_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Models to download
-    models = [
+# Non-weight files the diffusers loaders read
+CONFIG_PATTERNS = ["*.json", "*.txt"]
+
+# Weight (format, variant) in order of preference for each variant
+WEIGHT_PREFERENCE = {
+    "fp16": [("safetensors", "fp16"), ("safetensors", None), ("bin", "fp16"), ("bin", None)],
+    "fp32": [("safetensors", None), ("bin", None), ("safetensors", "fp16"), ("bin", "fp16")]
+}
+WEIGHT_STEMS = ("diffusion_pytorch_model", "model")
+
+# Single files, shards and shard indexes, e.g. diffusion_pytorch_model.fp16.safetensors,
+# model-00001-of-00002.safetensors, diffusion_pytorch_model.safetensors.index.fp16.json;
+# the variant sits before or after the shard number depending on the library version
+WEIGHT_NAME = re.compile(
+    r"(?P<stem>[^.-]+)(?:\.(?P<variant>fp16))?(?:-\d+-of-\d+(?:\.(?P<shard_variant>fp16))?)?"
+    r"\.(?P<format>safetensors|bin)(?:\.index(?:\.(?P<index_variant>fp16))?\.json)?"
+)
+
+def default_models(config: Config) -> List[Dict[str, str]]:
+    """Models to download, with repo ids taken from the config where set"""
+    controlnets = config.get("models.controlnet_models", {}) or {}
+    return [
         {
-            "repo_id": "stabilityai/stable-diffusion-xl-base-1.0",
-            "local_path": model_dir / "sdxl-base"
+            "repo_id": config.get("models.sdxl_model", "stabilityai/stable-diffusion-xl-base-1.0"),
+            "name": "sdxl-base"
         },
         {
-            "repo_id": "stabilityai/stable-diffusion-xl-refiner-1.0", 
-            "local_path": model_dir / "sdxl-refiner"
+            "repo_id": config.get("models.sdxl_refiner", "stabilityai/stable-diffusion-xl-refiner-1.0"),
+            "name": "sdxl-refiner"
         },
         {
-            "repo_id": "diffusers/controlnet-canny-sdxl-1.0",
-            "local_path": model_dir / "controlnet-canny"
+            "repo_id": controlnets.get("canny", "diffusers/controlnet-canny-sdxl-1.0"),
+            "name": "controlnet-canny"
         },
         {
-            "repo_id": "diffusers/controlnet-depth-sdxl-1.0",
-            "local_path": model_dir / "controlnet-depth"
+            "repo_id": controlnets.get("depth", "diffusers/controlnet-depth-sdxl-1.0"),
+            "name": "controlnet-depth"
         },
         {
-            "repo_id": "thibaud/controlnet-openpose-sdxl-1.0",
-            "local_path": model_dir / "controlnet-pose"
+            "repo_id": controlnets.get("pose", "thibaud/controlnet-openpose-sdxl-1.0"),
+            "name": "controlnet-pose"
         }
     ]
+
+# ---------------------------------------------------------------------------
+# File selection
+# ---------------------------------------------------------------------------
+
+def weight_kind(filename: str) -> Optional[Tuple[str, Optional[str]]]:
+    """(format, variant) of a weight file, shard or shard index; None for anything else"""
+    match = WEIGHT_NAME.fullmatch(PurePosixPath(filename).name)
+    if match is None or match["stem"] not in WEIGHT_STEMS:
+        return None
+    return match["format"], match["variant"] or match["shard_variant"] or match["index_variant"]
+
+def pipeline_components(model_index: Dict) -> Set[str]:
+    """Component folders a diffusers pipeline loads, from its model_index.json"""
+    return {
+        name for name, spec in model_index.items()
+        if not name.startswith("_") and isinstance(spec, list) and any(part is not None for part in spec)
+    }
+
+def select_files(files: Dict[str, Dict], variant: str, components: Optional[Set[str]] = None) -> Dict[str, Dict]:
+    """Keep configs plus one preferred weight format per component folder
+    
+    For pipeline repos ``components`` are the folders named in model_index.json;
+    anything else in the repo (alternative VAEs, single-file checkpoints) is skipped.
+    """
+    is_pipeline = "model_index.json" in files
+    selected = {}
+    weights_by_folder: Dict[str, List[str]] = {}
+    
+    for filename, meta in files.items():
+        path = PurePosixPath(filename)
+        folder = str(path.parent)
+        
+        if is_pipeline and filename != "model_index.json":
+            # Pipeline repos keep a single-file checkpoint at the top level that we never load
+            if folder == ".":
+                continue
+            if components is not None and path.parts[0] not in components:
+                continue
+        
+        if weight_kind(filename) is not None:
+            weights_by_folder.setdefault(folder, []).append(filename)
+        elif any(fnmatch.fnmatch(path.name, p) for p in CONFIG_PATTERNS):
+            selected[filename] = meta
     
-    logger.info("Starting model downloads...")
+    for folder, candidates in weights_by_folder.items():
+        # A sharded checkpoint is all of its shards plus the index naming them
+        for kind in WEIGHT_PREFERENCE[variant]:
+            matches = [f for f in candidates if weight_kind(f) == kind]
+            if matches:
+                selected.update({f: files[f] for f in matches})
+                break
     
-    success_count = 0
+    return selected
+
+# ---------------------------------------------------------------------------
+# Sources
+# ---------------------------------------------------------------------------
+
+class Source(abc.ABC):
+    """Where model files come from"""
+    
+    @abc.abstractmethod
+    def list_files(self, model: Dict[str, str]) -> Dict[str, Dict]:
+        """Map of filename -> {"size", "sha256" or "git_sha1"} for every file of a model"""
+    
+    @abc.abstractmethod
+    def open(self, model: Dict[str, str], filename: str, offset: int):
+        """Iterate over the bytes of a file starting at offset"""
+    
+    def read_json(self, model: Dict[str, str], filename: str) -> Dict:
+        """Fetch and parse a small JSON file of a model"""
+        return json.loads(b"".join(self.open(model, filename, 0)))
+
+class ManifestSource(Source):
+    """Local directory or HTTP mirror laid out like model_dir, with a manifest.json at its root"""
+    
+    def __init__(self, location: str, manifest: Optional[Dict] = None):
+        self.location = location.rstrip("/")
+        self.is_http = location.startswith(("http://", "https://"))
+        self.session = requests.Session() if self.is_http else None
+        self.manifest = manifest if manifest is not None else self._load_manifest()
+    
+    def _load_manifest(self) -> Dict:
+        if self.is_http:
+            response = self.session.get(f"{self.location}/{MANIFEST_NAME}", timeout=30)
+            response.raise_for_status()
+            return response.json()
+        with open(Path(self.location) / MANIFEST_NAME) as f:
+            return json.load(f)
+    
+    def list_files(self, model: Dict[str, str]) -> Dict[str, Dict]:
+        if model["name"] not in self.manifest:
+            raise KeyError(f"{model['name']} is not in the mirror manifest")
+        return self.manifest[model["name"]]["files"]
+    
+    def open(self, model: Dict[str, str], filename: str, offset: int):
+        if self.is_http:
+            yield from _http_stream(self.session, f"{self.location}/{model['name']}/{filename}", offset)
+            return
+        
+        with open(Path(self.location) / model["name"] / filename, "rb") as f:
+            f.seek(offset)
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+
+class HubSource(Source):
+    """Hugging Face Hub, listed through the API and downloaded over HTTP"""
+    
+    def __init__(self):
+        from huggingface_hub import HfApi, hf_hub_url
+        self.api = HfApi()
+        self.hf_hub_url = hf_hub_url
+        self.session = requests.Session()
+        token = os.environ.get("HF_TOKEN")
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+    
+    def list_files(self, model: Dict[str, str]) -> Dict[str, Dict]:
+        info = self.api.model_info(model["repo_id"], files_metadata=True)
+        files = {}
+        for sibling in info.siblings:
+            if sibling.lfs is not None:
+                files[sibling.rfilename] = {"size": sibling.lfs.size, "sha256": sibling.lfs.sha256}
+            else:
+                files[sibling.rfilename] = {"size": sibling.size, "git_sha1": sibling.blob_id}
+        return files
+    
+    def open(self, model: Dict[str, str], filename: str, offset: int):
+        yield from _http_stream(self.session, self.hf_hub_url(model["repo_id"], filename), offset)
+
+def _http_stream(session: requests.Session, url: str, offset: int):
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with session.get(url, headers=headers, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        if offset and response.status_code != 206:
+            raise IOError(f"Server ignored range request for {url}")
+        yield from response.iter_content(CHUNK_SIZE)
+
+def make_source(location: str) -> Source:
+    if location == "hf":
+        return HubSource()
+    return ManifestSource(location)
+
+# ---------------------------------------------------------------------------
+# Download and verification
+# ---------------------------------------------------------------------------
+
+def _new_hasher(meta: Dict, size: int):
+    """Hasher matching the manifest entry; git blob ids hash a header first"""
+    if "sha256" in meta:
+        return hashlib.sha256()
+    hasher = hashlib.sha1()
+    hasher.update(f"blob {size}\0".encode())
+    return hasher
+
+def _expected_digest(meta: Dict) -> Optional[str]:
+    return meta.get("sha256") or meta.get("git_sha1")
+
+def _hash_file(path: Path, hasher, limit: Optional[int] = None):
+    remaining = limit
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return hasher
+
+def verify_file(path: Path, meta: Dict) -> bool:
+    """Check a downloaded file's size and hash against its manifest entry"""
+    if not path.exists() or path.stat().st_size != meta["size"]:
+        return False
+    expected = _expected_digest(meta)
+    if expected is None:
+        return True
+    return _hash_file(path, _new_hasher(meta, meta["size"])).hexdigest() == expected
+
+class DownloadStats:
+    """Thread-safe byte and time counters for the final report"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        self.resumed = 0
+        self.skipped = 0
+        self.transfer_seconds = 0.0
+    
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+def download_file(source: Source, model: Dict[str, str], filename: str, meta: Dict,
+                  target_dir: Path, stats: DownloadStats, logger) -> bool:
+    """Download one file, resuming a partial .part file and verifying the result"""
+    target = target_dir / filename
+    partial = target.with_name(target.name + ".part")
+    target.parent.mkdir(parents=True, exist_ok=True)
+    
+    if verify_file(target, meta):
+        stats.add(skipped=meta["size"])
+        return True
+    
+    offset = partial.stat().st_size if partial.exists() else 0
+    if offset > meta["size"]:
+        partial.unlink()
+        offset = 0
+    
+    hasher = _new_hasher(meta, meta["size"])
+    if offset:
+        _hash_file(partial, hasher, limit=offset)
+        stats.add(resumed=offset)
+    
+    start = time.perf_counter()
+    received = 0
+    try:
+        with open(partial, "ab") as f:
+            for chunk in source.open(model, filename, offset):
+                f.write(chunk)
+                hasher.update(chunk)
+                received += len(chunk)
+    except Exception as e:
+        stats.add(downloaded=received, transfer_seconds=time.perf_counter() - start)
+        logger.error(f"✗ {model['name']}/{filename}: {e} (partial file kept for resume)")
+        return False
+    stats.add(downloaded=received, transfer_seconds=time.perf_counter() - start)
+    
+    expected = _expected_digest(meta)
+    if partial.stat().st_size != meta["size"] or (expected and hasher.hexdigest() != expected):
+        partial.unlink()
+        logger.error(f"✗ {model['name']}/{filename}: size or hash mismatch, discarded")
+        return False
+    
+    os.replace(partial, target)
+    return True
+
+def default_variant(config: Config) -> str:
+    """Weight variant the loaders will ask for on this node
+    
+    Mirrors resolve_profile: fp16 weights are only used off-CPU, so a CPU node
+    needs the fp32 files even when performance.use_fp16 is set.
+    """
+    if not config.get("performance.use_fp16", True):
+        return "fp32"
+    try:
+        import torch
+    except ImportError:
+        raise SystemExit("torch is not installed, so the device is unknown; pass --variant explicitly")
+    accelerated = torch.cuda.is_available() or torch.backends.mps.is_available()
+    return "fp16" if accelerated else "fp32"
+
+def present_files(files: Dict[str, Dict], target_dir: Path) -> Dict[str, Dict]:
+    """Manifest entries whose file exists in a model directory"""
+    return {filename: meta for filename, meta in files.items() if (target_dir / filename).exists()}
+
+def write_manifest(path: Path, manifest: Dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+def _human(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f}{unit}" if unit != "B" else f"{int(n)}B"
+        n /= 1024
+
+def main():
+    parser = argparse.ArgumentParser(description="Download ImgGen AI models")
+    parser.add_argument("--config", default="config/default.yaml", help="Configuration file")
+    parser.add_argument("--source", default="hf",
+                        help="'hf' (Hugging Face Hub), an HTTP mirror URL or a local directory laid out like model_dir")
+    parser.add_argument("--only", nargs="+", help="Model names to download (default: all)")
+    parser.add_argument("--variant", choices=["fp16", "fp32"],
+                        help="Weight variant (default: fp16 if performance.use_fp16 and a GPU is present, else fp32)")
+    parser.add_argument("--jobs", "-j", type=int, default=4, help="Concurrent file downloads")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be downloaded")
+    parser.add_argument("--dedupe", action="store_true", help="Deduplicate identical files into the model store afterwards")
+    args = parser.parse_args()
+    
+    logger = setup_logger("model_downloader")
+    config = Config(args.config)
+    
+    model_dir = Path(config.get("model_dir", "data/models"))
+    model_dir.mkdir(parents=True, exist_ok=True)
+    
+    variant = args.variant or default_variant(config)
+    models = [m for m in default_models(config) if not args.only or m["name"] in args.only]
+    source = make_source(args.source)
+    
+    logger.info(f"Listing {len(models)} models from {args.source} ({variant} weights)...")
+    
+    manifest = {}
+    jobs = []
+    total_bytes = 0
+    selected_bytes = 0
     for model in models:
-        if download_model(model["repo_id"], model["local_path"], logger):
-            success_count += 1
+        try:
+            files = source.list_files(model)
+        except Exception as e:
+            logger.error(f"✗ Failed to list {model['repo_id']}: {e}")
+            continue
+        
+        components = None
+        if "model_index.json" in files:
+            try:
+                components = pipeline_components(source.read_json(model, "model_index.json"))
+            except Exception as e:
+                logger.warning(f"Could not read {model['name']}/model_index.json, keeping every component: {e}")
+        
+        selected = select_files(files, variant, components)
+        manifest[model["name"]] = {"repo_id": model["repo_id"], "files": selected}
+        total_bytes += sum(meta["size"] for meta in files.values())
+        selected_bytes += sum(meta["size"] for meta in selected.values())
+        jobs.extend((model, filename, meta) for filename, meta in selected.items())
+    
+    logger.info(f"Selected {len(jobs)} files, {_human(selected_bytes)} of {_human(total_bytes)} "
+                f"({_human(total_bytes - selected_bytes)} of unused variants skipped)")
+    
+    if args.dry_run:
+        for model, filename, meta in jobs:
+            print(f"{model['name']}/{filename}  {meta['size']}")
+        return
+    
+    stats = DownloadStats()
+    failures = []
+    start = time.perf_counter()
+    
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {
+            pool.submit(download_file, source, model, filename, meta, model_dir / model["name"], stats, logger):
+                f"{model['name']}/{filename}"
+            for model, filename, meta in jobs
+        }
+        for future in as_completed(futures):
+            if not future.result():
+                failures.append(futures[future])
+    
+    wall = time.perf_counter() - start
+    
+    # The manifest lists only files present on disk, so this model_dir can itself serve as a mirror
+    manifest_path = model_dir / MANIFEST_NAME
+    previous = {}
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            previous = json.load(f)
+    for name, entry in manifest.items():
+        files = {**previous.get(name, {}).get("files", {}), **entry["files"]}
+        entry["files"] = present_files(files, model_dir / name)
+    write_manifest(manifest_path, {**previous, **manifest})
+    
+    logger.info(f"Download complete: {len(jobs) - len(failures)}/{len(jobs)} files in {wall:.1f}s")
+    logger.info(f"Transferred {_human(stats.downloaded)}, resumed from {_human(stats.resumed)} of partial files, "
+                f"{_human(stats.skipped)} already present and verified")
+    if stats.transfer_seconds > wall:
+        logger.info(f"Parallel transfers saved {stats.transfer_seconds - wall:.1f}s over sequential "
+                    f"({stats.transfer_seconds:.1f}s of transfer time)")
     
-    logger.info(f"Download complete: {success_count}/{len(models)} models downloaded successfully")
+    if args.dedupe:
+        ModelStore(model_dir).ingest()
     
-    if success_count < len(models):
-        logger.warning("Some models failed to download. Check your internet connection and try again.")
+    if failures:
+        logger.warning(f"{len(failures)} files failed; re-run to resume them.")
         sys.exit(1)
     else:
         logger.info("All models downloaded successfully!")
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Model Store Script
+Deduplicates model files under model_dir by content hash, collects garbage and reports sharing
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# Add src to path
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from utils.config import Config
+from utils.logger import setup_logger
+from utils.model_store import ModelStore
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed model store")
+    parser.add_argument("--config", default="config/default.yaml", help="Configuration file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("ingest", help="Store every model file once and link it into place")
+    gc = subparsers.add_parser("gc", help="Delete blobs no model directory references")
+    gc.add_argument("--dry-run", action="store_true", help="Only report what would be removed")
+    subparsers.add_parser("report", help="Show shared versus unique bytes")
+    args = parser.parse_args()
+    
+    setup_logger("imggen")
+    config = Config(args.config)
+    store = ModelStore(Path(config.get("model_dir", "data/models")))
+    
+    if args.command == "ingest":
+        result = store.ingest()
+    elif args.command == "gc":
+        result = store.gc(dry_run=args.dry_run)
+    else:
+        result = store.report()
+    
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Output Store Script
+Indexes outputs saved before the output index existed, applies retention and searches the index
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Add src to path
+sys.path.append(str(Path(__file__).parent.parent / "src"))
+
+from utils.config import Config
+from utils.logger import setup_logger
+from utils.output_store import OutputStore
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexed output store")
+    parser.add_argument("--config", default="config/default.yaml", help="Configuration file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    index = subparsers.add_parser("index", help="Index flat txt2img_*/img2img_*/inpaint_* files in output_dir")
+    index.add_argument("--dir", help="Directory to scan (default: output_dir)")
+    index.add_argument("--thumbnails", action="store_true", help="Also generate thumbnails for them")
+    prune = subparsers.add_parser("prune", help="Apply the retention policy now")
+    prune.add_argument("--max-age-days", type=float, help="Override outputs.retention.max_age_days")
+    prune.add_argument("--max-count", type=int, help="Override outputs.retention.max_count")
+    search = subparsers.add_parser("search", help="Query the index, newest first")
+    search.add_argument("--prompt", help="Prompt substring")
+    search.add_argument("--kind", choices=["txt2img", "img2img", "inpaint"])
+    search.add_argument("--since", type=datetime.fromisoformat, help="ISO date or datetime")
+    search.add_argument("--until", type=datetime.fromisoformat, help="ISO date or datetime")
+    search.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+    
+    setup_logger("imggen")
+    store = OutputStore.from_config(Config(args.config))
+    
+    try:
+        if args.command == "index":
+            result = store.index_existing(Path(args.dir) if args.dir else None, thumbnails=args.thumbnails)
+        elif args.command == "prune":
+            result = {"removed": store.prune(max_age_days=args.max_age_days, max_count=args.max_count)}
+        else:
+            result = store.query(prompt=args.prompt, kind=args.kind, since=args.since, until=args.until,
+                                 limit=args.limit)
+    finally:
+        store.close()
+    
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Admission Control - Cost-weighted per-client token buckets for the API
+"""
+
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from ..utils.config import Config
+from ..utils.logger import get_logger
+from ..utils.sizes import parse_size
+
+RATE_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+def parse_rate(value: str) -> Tuple[float, float]:
+    """Parse a rate such as "100/minute" into (amount, period in seconds)"""
+    match = re.fullmatch(r"\s*([\d.]+)\s*/\s*(second|minute|hour|day)s?\s*", str(value).lower())
+    if not match:
+        raise ValueError(f"Invalid rate limit: {value!r}")
+    return float(match.group(1)), float(RATE_PERIODS[match.group(2)])
+
+class CostModel:
+    """Estimates request cost from pixels x steps x images per model type, calibrated from observed timings
+    
+    Costs are expressed in units of a reference request (1024x1024, 20 steps, one
+    image, plain SDXL), so a rate limit of "100/minute" means 100 reference-sized
+    generations per minute. Each request type keeps its own seconds-per-unit
+    coefficient, so measured timings set the relative price of refiner,
+    progressive, img2img and inpaint requests against plain text-to-image.
+    """
+    
+    # Seconds per megapixel-step-image; starting points that observed timings replace
+    DEFAULT_COEFFICIENTS = {
+        "sdxl": 0.05,
+        "sdxl_refiner": 0.06,
+        "sdxl_progressive": 0.035,
+        "img2img": 0.05,
+        "inpaint": 0.052,
+        "controlnet": 0.065
+    }
+    
+    REFERENCE = ("sdxl", 1024, 1024, 20)
+    
+    def __init__(self, coefficients: Optional[Dict[str, float]] = None, smoothing: float = 0.2):
+        self.coefficients = dict(self.DEFAULT_COEFFICIENTS)
+        self.coefficients.update(coefficients or {})
+        self.smoothing = smoothing
+    
+    @staticmethod
+    def _work(width: int, height: int, steps: float, images: int = 1) -> float:
+        return (width * height / 1e6) * max(steps, 1) * max(images, 1)
+    
+    def estimate_seconds(self, model_type: str, width: int, height: int, steps: float, images: int = 1) -> float:
+        """Predicted wall time of a request"""
+        coefficient = self.coefficients.get(model_type, self.coefficients["sdxl"])
+        return coefficient * self._work(width, height, steps, images)
+    
+    def cost(self, model_type: str, width: int, height: int, steps: float, images: int = 1) -> float:
+        """Cost of a request in reference-request units"""
+        model, ref_w, ref_h, ref_steps = self.REFERENCE
+        reference = self._work(ref_w, ref_h, ref_steps) * self.coefficients[model]
+        return self.estimate_seconds(model_type, width, height, steps, images) / reference
+    
+    def observe(self, model_type: str, width: int, height: int, steps: float, seconds: float, images: int = 1):
+        """Fold a measured generation time into the model's coefficient"""
+        work = self._work(width, height, steps, images)
+        if work <= 0 or seconds <= 0:
+            return
+        
+        # Single float assignment; concurrent observers may race but never corrupt
+        previous = self.coefficients.get(model_type, self.coefficients["sdxl"])
+        self.coefficients[model_type] = (1 - self.smoothing) * previous + self.smoothing * (seconds / work)
+
+class TokenBucket:
+    """Token bucket refilled continuously; each instance has its own lock"""
+    
+    __slots__ = ("capacity", "refill_rate", "tokens", "updated", "_lock")
+    
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def try_acquire(self, cost: float, now: Optional[float] = None) -> Tuple[bool, float]:
+        """Take ``cost`` tokens if available; returns (admitted, seconds until retry)"""
+        now = time.monotonic() if now is None else now
+        
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+            self.updated = now
+            
+            # A request larger than the whole bucket is admitted from a full bucket
+            # and leaves it in debt, otherwise it could never run at all
+            required = min(cost, self.capacity)
+            if self.tokens >= required:
+                self.tokens -= cost
+                return True, 0.0
+            
+            return False, (required - self.tokens) / self.refill_rate
+
+class AdmissionDecision:
+    """Outcome of an admission check"""
+    
+    __slots__ = ("admitted", "cost", "retry_after")
+    
+    def __init__(self, admitted: bool, cost: float, retry_after: float = 0.0):
+        self.admitted = admitted
+        self.cost = cost
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Per-client cost-weighted rate limiting and request size limits from the api config"""
+    
+    def __init__(self, config: Config, cost_model: Optional[CostModel] = None, max_clients: int = 10000):
+        self.logger = get_logger(__name__)
+        self.cost_model = cost_model or CostModel()
+        self.max_clients = max_clients
+        self._prune_lock = threading.Lock()
+        self.configure(config)
+    
+    def configure(self, config: Config):
+        """(Re)read size and rate limits; buckets restart full under the new limit"""
+        self.config = config
+        self.max_request_size = parse_size(config.get("api.max_request_size", "50MB"))
+        self.api_keys = frozenset(config.get("api.api_keys") or ())
+        
+        rate_limit = config.get("api.rate_limit")
+        if rate_limit:
+            amount, period = parse_rate(rate_limit)
+            self.capacity = amount
+            self.refill_rate = amount / period
+        else:
+            self.capacity = None
+            self.refill_rate = None
+        
+        self._buckets: Dict[str, TokenBucket] = {}
+    
+    @property
+    def enabled(self) -> bool:
+        return self.capacity is not None
+    
+    def check_size(self, content_length: Optional[int]) -> bool:
+        """Whether a declared body size is within the configured limit"""
+        return content_length is not None and content_length <= self.max_request_size
+    
+    def client_id(self, api_key: Optional[str], address: Optional[str]) -> str:
+        """Bucket key of a caller
+        
+        Only keys listed in api.api_keys identify a client; anything else a caller
+        sends is ignored, otherwise a fresh header value would get a fresh bucket.
+        """
+        if api_key and api_key in self.api_keys:
+            return f"key:{api_key}"
+        return f"address:{address or 'unknown'}"
+    
+    def request_work(self, kind: str, params: Dict[str, Any]) -> Tuple[str, int, int, float, int]:
+        """(model type, width, height, denoising steps, images) a request runs, with the pipeline defaults
+        
+        ``params`` are the keyword arguments of the ImgGenApp call; img2img/inpaint
+        requests without an explicit size run at ``source_size`` of the input image.
+        """
+        if kind == "txt2img":
+            width = params.get("width") or 1024
+            height = params.get("height") or 1024
+            # As in ImgGenApp.generate_image, an explicit num_inference_steps overrides steps
+            steps = params.get("num_inference_steps") or params.get("steps") or 20
+            images = params.get("num_images") or self.config.get("performance.batch_size", 1)
+            
+            model_type = "sdxl"
+            if params.get("refiner", self.config.get("generation.use_refiner", False)):
+                model_type = "sdxl_refiner"
+            elif self._progressive(params, width, height):
+                model_type = "sdxl_progressive"
+            return model_type, width, height, steps, images
+        
+        # img2img/inpaint run one image at the source size, for the last `strength` of the schedule
+        source_width, source_height = params.get("source_size") or (1024, 1024)
+        width = params.get("width") or source_width
+        height = params.get("height") or source_height
+        steps = params.get("num_inference_steps") or 50
+        strength = params.get("strength", 0.8 if kind == "img2img" else 1.0)
+        return kind, width, height, steps * strength, 1
+    
+    def request_cost(self, kind: str, params: Dict[str, Any]) -> float:
+        """Cost of a generation request in reference-request units"""
+        model_type, width, height, steps, images = self.request_work(kind, params)
+        return self.cost_model.cost(model_type, width, height, steps, images)
+    
+    def admit(self, client_id: str, kind: str, params: Dict[str, Any]) -> AdmissionDecision:
+        """Charge a request against its client's bucket"""
+        cost = self.request_cost(kind, params)
+        if not self.enabled:
+            return AdmissionDecision(True, cost)
+        
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._prune()
+            bucket = self._buckets.setdefault(client_id, TokenBucket(self.capacity, self.refill_rate))
+        
+        admitted, retry_after = bucket.try_acquire(cost)
+        if not admitted:
+            self.logger.debug(f"Rejected request from {client_id}: cost {cost:.2f}, retry in {retry_after:.1f}s")
+        return AdmissionDecision(admitted, cost, retry_after)
+    
+    def record(self, kind: str, params: Dict[str, Any], seconds: float):
+        """Calibrate the cost model with a measured generation time"""
+        model_type, width, height, steps, images = self.request_work(kind, params)
+        self.cost_model.observe(model_type, width, height, steps, seconds, images)
+    
+    def _progressive(self, params: Dict[str, Any], width: int, height: int) -> bool:
+        """Whether text-to-image takes the progressive path (mirrors the pipeline's plan)"""
+        settings = dict(self.config.get("generation.progressive", {}) or {})
+        requested = params.get("progressive")
+        if isinstance(requested, dict):
+            settings.update(requested)
+            enabled = True
+        elif requested is not None:
+            enabled = bool(requested)
+        else:
+            enabled = settings.get("enabled", False)
+        
+        base_size = settings.get("base_size", 1024)
+        return enabled and width * height > base_size * base_size
+    
+    def _prune(self):
+        """Drop buckets that have refilled completely; they carry no state"""
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            idle = self.capacity / self.refill_rate
+            for client_id, bucket in list(self._buckets.items()):
+                if now - bucket.updated >= idle:
+                    self._buckets.pop(client_id, None)
+        finally:
+            self._prune_lock.release()
\ No newline at end of file
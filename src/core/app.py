@@ -2,26 +2,54 @@
 Core Application Class for ImgGen AI
 """
 
+import sqlite3
+import threading
 import yaml
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 
+from .executor import ConcurrentExecutor, run_request
 from .pipeline import ImageGenerationPipeline
 from .model_manager import ModelManager
-from ..utils.config import Config
-from ..utils.logger import get_logger
+from ..utils.config import Config, ConfigWatcher
+from ..utils.logger import get_logger, setup_logger_from_config
 
 class ImgGenApp:
     """Main application class that orchestrates all components"""
     
-    def __init__(self, config_path: str = "config/default.yaml"):
+    def __init__(self, config_path: str = "config/default.yaml", log_level: Optional[str] = None):
         self.logger = get_logger(__name__)
         self.config = Config(config_path)
         
+        # A command-line level override survives reloads of the logging section
+        self.log_level = log_level
+        
         # Initialize core components
         self.model_manager = ModelManager(self.config)
         self.pipeline = ImageGenerationPipeline(self.model_manager, self.config)
         
+        # Pipelines, schedulers and UNet patches hold per-call state; one in-process generation at a time
+        self.generation_lock = threading.Lock()
+        
+        # Optionally run several CPU requests at once in forked workers sharing the weights
+        self.executor = None
+        workers = self.config.get("execution.concurrent_workers", 0)
+        if workers and self.model_manager.device == "cpu":
+            self.executor = ConcurrentExecutor(
+                self.pipeline, workers, threads_per_worker=self.config.get("execution.threads_per_worker")
+            )
+        elif workers:
+            self.logger.warning("execution.concurrent_workers is ignored on GPU devices")
+        
+        # Edits to the config file are applied live by the components that own them,
+        # between requests so no generation sees its models or scheduler swapped
+        self.config.subscribe("logging", self._reconfigure_logging, "logging")
+        self.config_watcher = ConfigWatcher(
+            self.config, interval=self.config.get("reload.interval", 2.0), reload=self.reload_config
+        )
+        if self.config.get("reload.enabled", True):
+            self.config_watcher.start()
+        
         self.logger.info("ImgGen AI initialized successfully")
     
     def generate_image(self, 
@@ -44,7 +72,7 @@ class ImgGenApp:
             **kwargs
         }
         
-        return self.pipeline.text_to_image(params)
+        return self._run_request("txt2img", params)
     
     def transform_image(self,
                        image_path: str,
@@ -60,7 +88,7 @@ class ImgGenApp:
             **kwargs
         }
         
-        return self.pipeline.image_to_image(params)
+        return self._run_request("img2img", params)
     
     def inpaint_image(self,
                      image_path: str,
@@ -76,7 +104,57 @@ class ImgGenApp:
             **kwargs
         }
         
-        return self.pipeline.inpaint(params)
+        return self._run_request("inpaint", params)
+    
+    def _run_request(self, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a generation in-process or on the concurrent workers, with memory deltas attached"""
+        if self.executor is not None:
+            return self.executor.submit(kind, params).result()
+        with self.generation_lock:
+            return run_request(self.pipeline, kind, params)
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """Memory accounting, leak status and latent cache statistics for the metrics endpoint"""
+        if self.executor is not None:
+            # Requests ran in the workers, which each hold their own cache
+            latent_cache = self.executor.latent_cache_stats()
+        else:
+            latent_cache = self.pipeline.latent_cache.stats() if self.pipeline.latent_cache is not None else None
+        return {
+            "memory": self.model_manager.get_memory_usage(),
+            "latent_cache": latent_cache
+        }
+    
+    def search_outputs(self, **filters) -> Dict[str, Any]:
+        """Query saved outputs by prompt substring, date range, seed, model or kind"""
+        return self._on_output_store("query", **filters)
+    
+    def prune_outputs(self, max_age_days: Optional[float] = None, max_count: Optional[int] = None) -> int:
+        """Apply the output retention policy now"""
+        return self._on_output_store("prune", max_age_days=max_age_days, max_count=max_count)
+    
+    def _on_output_store(self, method: str, **kwargs) -> Any:
+        try:
+            return getattr(self.pipeline.output_store, method)(**kwargs)
+        except sqlite3.ProgrammingError:
+            # A reload closed the store between the lookup and the call; use its replacement
+            return getattr(self.pipeline.output_store, method)(**kwargs)
+    
+    def reload_config(self) -> Dict[str, Any]:
+        """Re-read the config file and apply what changed, once no generation is running"""
+        with self.generation_lock:
+            return self.config.reload()
+    
+    def get_reload_events(self) -> List[Dict[str, Any]]:
+        """Recent config reloads: changed keys, per-component apply times and errors"""
+        return list(self.config.reload_events)
+    
+    def _reconfigure_logging(self, changes: Dict[str, Any]):
+        setup_logger_from_config(self.config, level=self.log_level)
+    
+    def release_shared_image(self, name: str) -> bool:
+        """Free a shared memory result once its consumer has finished with it"""
+        return self.pipeline.shared_images.release(name)
     
     def start_api_server(self, host: str = "127.0.0.1", port: int = 8000):
         """Start REST API server"""
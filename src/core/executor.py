@@ -0,0 +1,291 @@
+"""
+Concurrent Executor - Runs several CPU requests at once on one copy of the weights
+Workers are forked after the models are loaded, so every worker maps the parent's
+weight pages copy-on-write; each is pinned to its own disjoint set of cores
+"""
+
+import gc
+import itertools
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Sequence
+
+import torch
+
+from ..utils.logger import current_request_id, forward_logs, get_logger, request_scope, start_log_relay
+from ..utils.output_store import OutputStore
+
+logger = get_logger(__name__)
+
+# Pipeline entry point for each request kind
+METHODS = {
+    "txt2img": "text_to_image",
+    "img2img": "image_to_image",
+    "inpaint": "inpaint"
+}
+
+def run_request(pipeline: Any, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one request on a pipeline with its memory deltas attached to the result"""
+    with pipeline.model_manager.memory.track(kind) as usage:
+        result = getattr(pipeline, METHODS[kind])(params)
+    result["memory"] = usage
+    return result
+
+def partition_cores(workers: int, cores: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """Split the usable cores into ``workers`` disjoint, contiguous, near-equal sets"""
+    if cores is None:
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    if workers > len(cores):
+        raise ValueError(f"Cannot give {workers} workers disjoint cores out of {len(cores)}")
+    
+    size, extra = divmod(len(cores), workers)
+    budgets, start = [], 0
+    for index in range(workers):
+        end = start + size + (1 if index < extra else 0)
+        budgets.append(list(cores[start:end]))
+        start = end
+    return budgets
+
+def shared_names(result: Dict[str, Any]) -> List[str]:
+    """Names of the shared memory blocks a result hands off"""
+    outputs = result.get("batch") or [result]
+    return [output["shared_memory"]["name"] for output in outputs if "shared_memory" in output]
+
+def _worker_main(pipeline: Any, name: str, cores: List[int], threads: int, tasks, results, logs, current):
+    """Worker loop; runs in a forked child that inherited the loaded pipeline
+    
+    ``current`` is a shared value holding the id of the task this worker took last,
+    written directly to shared memory so it survives the worker dying mid-request.
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    
+    # Threads and SQLite connections do not survive fork; records go to the parent's
+    # handlers, and the child gets its own store connection
+    forward_logs(logs)
+    pipeline.output_store = OutputStore.from_config(pipeline.config)
+    
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            task_id, kind, params, request_id = task
+            current.value = task_id
+            with request_scope(request_id):
+                try:
+                    result = run_request(pipeline, kind, params)
+                except Exception as e:
+                    result = {"success": False, "error": str(e)}
+            if "memory" in result:
+                result["memory"]["worker"] = name
+            
+            # The parent adopts the blocks, so its release route frees them
+            for block in shared_names(result):
+                pipeline.shared_images.disown(block)
+            
+            latent_cache = pipeline.latent_cache.stats() if pipeline.latent_cache is not None else None
+            results.put((task_id, result, {"worker": name, "latent_cache": latent_cache}))
+    finally:
+        pipeline.output_store.close()
+
+class ConcurrentExecutor:
+    """K forked workers sharing one set of weights, each with a disjoint core budget
+    
+    CPU only: CUDA contexts cannot be forked, and on GPU the device, not the
+    cores, is the bottleneck. Workers keep the models they were forked with; a
+    config reload that swaps models needs the executor restarting.
+    
+    Worker log records, memory measurements, latent cache statistics and shared
+    memory results all come back to the parent, which logs, reports and releases
+    them as if the requests had run in-process.
+    """
+    
+    def __init__(self,
+                 pipeline: Any,
+                 workers: int,
+                 threads_per_worker: Optional[int] = None,
+                 cores: Optional[Sequence[int]] = None,
+                 preload: Sequence[str] = ("sdxl",)):
+        if pipeline.model_manager.device != "cpu":
+            raise ValueError("Concurrent execution is only supported on CPU")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        
+        self.pipeline = pipeline
+        self.workers = workers
+        self.budgets = partition_cores(workers, cores)
+        self.threads_per_worker = threads_per_worker
+        self.preload = preload
+        
+        self._context = get_context("fork")
+        self._tasks = None
+        self._results = None
+        self._logs = None
+        self._log_relay = None
+        self._processes = []
+        self._current = []
+        self.worker_stats: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[int, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._collector: Optional[threading.Thread] = None
+        self._stopping = False
+        self._start_lock = threading.Lock()
+    
+    def start(self):
+        with self._start_lock:
+            if not self._processes:
+                self._start_workers()
+    
+    def _start_workers(self):
+        
+        # Load weights before forking so the children share them rather than each loading a copy
+        for model_type in self.preload:
+            self.pipeline._ensure_models_loaded(model_type)
+        
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._logs = self._context.Queue()
+        self._log_relay = start_log_relay(self._logs)
+        self._current = [self._context.Value("q", -1, lock=False) for _ in range(self.workers)]
+        
+        # Keep the collector from touching shared objects' headers (and so their pages) after fork
+        gc.collect()
+        gc.freeze()
+        for index in range(self.workers):
+            self._processes.append(self._spawn(index, f"imggen-worker-{index}"))
+        gc.unfreeze()
+        
+        self._collector = threading.Thread(target=self._collect, name="executor-results", daemon=True)
+        self._collector.start()
+        logger.info(f"Started {self.workers} workers with cores {self.budgets}")
+    
+    def _spawn(self, index: int, name: str):
+        cores = self.budgets[index]
+        self._current[index].value = -1
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.pipeline, name, cores, self.threads_per_worker or len(cores),
+                  self._tasks, self._results, self._logs, self._current[index]),
+            name=name,
+            daemon=True
+        )
+        process.start()
+        return process
+    
+    def submit(self, kind: str, params: Dict[str, Any]) -> Future:
+        """Queue a request; the future resolves to the same dict the pipeline returns"""
+        if kind not in METHODS:
+            raise ValueError(f"Unknown request kind '{kind}', expected one of {tuple(METHODS)}")
+        if not self._processes:
+            self.start()
+        
+        future = Future()
+        task_id = next(self._ids)
+        with self._pending_lock:
+            self._pending[task_id] = future
+        self._tasks.put((task_id, kind, params, current_request_id()))
+        return future
+    
+    def _collect(self):
+        while True:
+            try:
+                item = self._results.get(timeout=1.0)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if item is None:
+                break
+            task_id, result, stats = item
+            with self._pending_lock:
+                future = self._pending.pop(task_id, None)
+            self._absorb(result, stats, owned=future is not None)
+            if future is not None:
+                future.set_result(result)
+            self._check_workers()
+    
+    def _absorb(self, result: Dict[str, Any], stats: Dict[str, Any], owned: bool = True):
+        """Take over what a worker's request left behind: memory figures, cache stats, shared blocks
+        
+        Blocks of a request whose caller already got an error (``owned`` false) are
+        freed straight away; nobody else would release them.
+        """
+        if "memory" in result:
+            self.pipeline.model_manager.memory.record(result["memory"])
+        self.worker_stats[stats["worker"]] = stats
+        for name in shared_names(result):
+            try:
+                self.pipeline.shared_images.adopt(name)
+            except FileNotFoundError:
+                logger.warning(f"Shared memory block '{name}' vanished before it was adopted")
+                continue
+            if not owned:
+                self.pipeline.shared_images.release(name)
+    
+    def latent_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """Latent cache statistics summed over the workers, with each worker's own figures"""
+        workers = {name: stats["latent_cache"] for name, stats in sorted(self.worker_stats.items())
+                   if stats["latent_cache"] is not None}
+        if not workers:
+            return None
+        
+        totals: Dict[str, Any] = {}
+        for stats in workers.values():
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and key != "hit_rate":
+                    totals[key] = totals.get(key, 0) + value
+        lookups = totals.get("memory_hits", 0) + totals.get("disk_hits", 0) + totals.get("misses", 0)
+        totals["hit_rate"] = (totals.get("memory_hits", 0) + totals.get("disk_hits", 0)) / lookups if lookups else 0.0
+        totals["workers"] = workers
+        return totals
+    
+    def _check_workers(self):
+        """A worker that died mid-request would leave its future waiting forever"""
+        dead = [process for process in self._processes if not process.is_alive()]
+        if not dead or self._stopping:
+            return
+        
+        # Fail only the task each dead worker last took; the others are still queued or
+        # running on healthy workers. A result that was already delivered is no longer pending.
+        for process in dead:
+            task_id = self._current[self._processes.index(process)].value
+            logger.error(f"Worker died: {process.name} (exit {process.exitcode})")
+            with self._pending_lock:
+                future = self._pending.pop(task_id, None)
+            if future is not None:
+                future.set_result({"success": False, "error": f"Worker died: {process.name} (exit {process.exitcode})"})
+        
+        # Replace the dead workers so the executor keeps its capacity, forked like the originals
+        gc.collect()
+        gc.freeze()
+        try:
+            for process in dead:
+                index = self._processes.index(process)
+                self._processes[index] = self._spawn(index, process.name)
+        finally:
+            gc.unfreeze()
+    
+    def shutdown(self):
+        if not self._processes:
+            return
+        self._stopping = True
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join()
+        self._results.put(None)
+        self._collector.join()
+        self._log_relay.stop()
+        
+        with self._pending_lock:
+            for future in self._pending.values():
+                future.set_result({"success": False, "error": "Executor shut down"})
+            self._pending.clear()
+        self._processes = []
+        self._stopping = False
+        logger.info("Workers stopped")
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""
+Guidance Truncation - Stops classifier-free guidance for the late denoising steps
+"""
+
+from typing import Any, Dict, Optional
+
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class GuidanceTruncation:
+    """Step-end callback that drops the unconditional CFG branch once it stops paying off
+    
+    Guidance is disabled after a fixed fraction of the steps (``cutoff``), or as soon
+    as the relative distance between the conditional and unconditional noise
+    predictions falls below ``adaptive_threshold``, whichever comes first. From then
+    on the UNet only sees the conditional half of the batch.
+    """
+    
+    # Batched CFG tensors that must be cut down to their conditional half
+    TENSOR_INPUTS = ["prompt_embeds", "add_text_embeds", "add_time_ids", "mask", "masked_image_latents"]
+    
+    def __init__(self, num_steps: int, cutoff: Optional[float] = None, adaptive_threshold: Optional[float] = None):
+        self.num_steps = num_steps
+        self.cutoff_step = max(1, round(num_steps * cutoff)) if cutoff is not None else None
+        self.adaptive_threshold = adaptive_threshold
+        
+        self.truncated_at: Optional[int] = None
+        self.divergence: Optional[float] = None
+        self._hook = None
+    
+    @classmethod
+    def from_params(cls, params: Dict[str, Any], num_steps: int) -> Optional["GuidanceTruncation"]:
+        """Build a truncation callback from request parameters, or None if not requested"""
+        cutoff = params.get("cfg_cutoff")
+        threshold = params.get("cfg_adaptive_threshold")
+        
+        if cutoff is None and threshold is None:
+            return None
+        # Truncation acts at the end of a step, so the first step always runs full CFG
+        if cutoff is not None and not 0.0 < cutoff <= 1.0:
+            raise ValueError(
+                f"cfg_cutoff must be greater than 0 and at most 1, got {cutoff}; "
+                "use guidance_scale <= 1 to disable guidance entirely"
+            )
+        if params.get("guidance_scale", 7.5) <= 1.0:
+            return None
+        
+        return cls(num_steps, cutoff=cutoff, adaptive_threshold=threshold)
+    
+    def attach(self, pipeline: Any):
+        """Start observing UNet predictions when adaptive truncation is enabled"""
+        if self.adaptive_threshold is not None and self._hook is None:
+            self._hook = pipeline.unet.register_forward_hook(self._capture_divergence)
+    
+    def detach(self):
+        """Stop observing UNet predictions"""
+        if self._hook is not None:
+            self._hook.remove()
+            self._hook = None
+    
+    def call_kwargs(self, pipeline: Any) -> Dict[str, Any]:
+        """Keyword arguments that wire this callback into a diffusers pipeline call"""
+        supported = getattr(pipeline, "_callback_tensor_inputs", [])
+        return {
+            "callback_on_step_end": self,
+            "callback_on_step_end_tensor_inputs": [name for name in self.TENSOR_INPUTS if name in supported]
+        }
+    
+    def _capture_divergence(self, module, inputs, output):
+        """Record how far apart the conditional and unconditional predictions are"""
+        if self.truncated_at is not None:
+            return
+        
+        sample = output[0] if isinstance(output, tuple) else output.sample
+        if sample.shape[0] % 2:
+            return
+        
+        uncond, cond = sample.float().chunk(2)
+        self.divergence = ((cond - uncond).norm() / cond.norm().clamp_min(1e-8)).item()
+    
+    def _should_truncate(self, step: int) -> bool:
+        if self.cutoff_step is not None and step + 1 >= self.cutoff_step:
+            return True
+        if self.adaptive_threshold is not None and self.divergence is not None:
+            return self.divergence < self.adaptive_threshold
+        return False
+    
+    def __call__(self, pipeline: Any, step: int, timestep: Any, callback_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        if self.truncated_at is None and self._should_truncate(step):
+            # The pipeline checks _guidance_scale > 1 to decide whether to run CFG
+            pipeline._guidance_scale = 0.0
+            for name in self.TENSOR_INPUTS:
+                if callback_kwargs.get(name) is not None:
+                    callback_kwargs[name] = callback_kwargs[name].chunk(2)[-1]
+            
+            self.truncated_at = step + 1
+            self.detach()
+            logger.debug(f"Classifier-free guidance disabled after step {self.truncated_at}/{self.num_steps}")
+        
+        return callback_kwargs
\ No newline at end of file
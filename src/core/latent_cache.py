@@ -0,0 +1,198 @@
+"""
+Latent Cache - Reuses VAE encodings of img2img/inpaint source images
+Entries are keyed by image content, resolution and VAE identity, held in a
+byte-bounded LRU in memory and optionally spilled to disk under cache_dir
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import torch
+from PIL import Image
+
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+def image_digest(image: Image.Image) -> str:
+    """Content hash of decoded pixels, independent of file format or path"""
+    hasher = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    hasher.update(image.tobytes())
+    return hasher.hexdigest()
+
+def encode_image(pipeline: Any, pixels: torch.Tensor, normalize: bool = False) -> torch.Tensor:
+    """VAE-encode preprocessed pixels the way the diffusers SDXL pipelines do
+    
+    Uses the mode of the latent distribution rather than a random sample, so
+    cached and freshly encoded latents are identical.
+    """
+    vae = pipeline.vae
+    dtype = vae.dtype
+    
+    # The SDXL VAE overflows in fp16 and is upcast for encoding
+    upcast = dtype == torch.float16 and getattr(vae.config, "force_upcast", False)
+    if upcast:
+        vae.to(dtype=torch.float32)
+    try:
+        with torch.no_grad():
+            pixels = pixels.to(device=pipeline._execution_device, dtype=vae.dtype)
+            latents = vae.encode(pixels).latent_dist.mode()
+    finally:
+        if upcast:
+            vae.to(dtype=dtype)
+    
+    latents = latents.to(dtype)
+    latents_mean = getattr(vae.config, "latents_mean", None)
+    latents_std = getattr(vae.config, "latents_std", None)
+    if normalize and latents_mean is not None and latents_std is not None:
+        mean = torch.tensor(latents_mean).view(1, -1, 1, 1).to(latents)
+        std = torch.tensor(latents_std).view(1, -1, 1, 1).to(latents)
+        return (latents - mean) * vae.config.scaling_factor / std
+    return latents * vae.config.scaling_factor
+
+class LatentCache:
+    """Byte-bounded LRU of encoded latents with an optional on-disk tier"""
+    
+    def __init__(self,
+                 max_bytes: int = 512 * 1024 ** 2,
+                 disk_dir: Optional[Path] = None,
+                 max_disk_bytes: int = 4 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_disk_bytes = max_disk_bytes
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        
+        self._entries: "OrderedDict[str, Tuple[torch.Tensor, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0,
+                       "encode_seconds": 0.0, "seconds_saved": 0.0}
+    
+    @classmethod
+    def from_config(cls, config) -> Optional["LatentCache"]:
+        if not config.get("latent_cache.enabled", True):
+            return None
+        disk_dir = None
+        if config.get("latent_cache.disk", False):
+            disk_dir = Path(config.get("cache_dir", "data/cache")) / "latents"
+        return cls(
+            max_bytes=int(config.get("latent_cache.max_memory_mb", 512)) * 1024 ** 2,
+            disk_dir=disk_dir,
+            max_disk_bytes=int(config.get("latent_cache.max_disk_mb", 4096)) * 1024 ** 2
+        )
+    
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        return hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+    
+    def get_or_encode(self, key: str, encode: Callable[[], torch.Tensor],
+                      persist: bool = True) -> Tuple[torch.Tensor, str]:
+        """Cached latents for ``key``, encoding on a miss; returns (latents, "memory"|"disk"|"miss")
+        
+        ``persist`` is False for keys that are not stable across processes; those
+        never touch the disk tier.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                self._stats["seconds_saved"] += entry[1]
+                return entry[0], "memory"
+        
+        if persist and self.disk_dir is not None:
+            loaded = self._load(key)
+            if loaded is not None:
+                latents, seconds = loaded
+                self._insert(key, latents, seconds)
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                    self._stats["seconds_saved"] += seconds
+                return latents, "disk"
+        
+        start = time.perf_counter()
+        latents = encode().detach().cpu()
+        seconds = time.perf_counter() - start
+        
+        self._insert(key, latents, seconds)
+        if persist and self.disk_dir is not None:
+            self._store(key, latents, seconds)
+        with self._lock:
+            self._stats["misses"] += 1
+            self._stats["encode_seconds"] += seconds
+        return latents, "miss"
+    
+    def _insert(self, key: str, latents: torch.Tensor, seconds: float):
+        size = latents.numel() * latents.element_size()
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[0].numel() * previous[0].element_size()
+            self._entries[key] = (latents, seconds)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted.numel() * evicted.element_size()
+                self._stats["evictions"] += 1
+    
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.pt"
+    
+    def _load(self, key: str) -> Optional[Tuple[torch.Tensor, float]]:
+        path = self._disk_path(key)
+        try:
+            entry = torch.load(path, map_location="cpu", weights_only=True)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cached latents {path.name}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)  # Disk eviction is least-recently-used by mtime
+        return entry["latents"], float(entry["seconds"])
+    
+    def _store(self, key: str, latents: torch.Tensor, seconds: float):
+        path = self._disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        try:
+            torch.save({"latents": latents, "seconds": seconds}, tmp)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not write cached latents: {e}")
+            return
+        self._prune_disk()
+    
+    def _prune_disk(self):
+        files = [(p, p.stat()) for p in self.disk_dir.glob("*/*.pt")]
+        total = sum(st.st_size for _, st in files)
+        if total <= self.max_disk_bytes:
+            return
+        for path, st in sorted(files, key=lambda item: item[1].st_mtime):
+            path.unlink(missing_ok=True)
+            total -= st.st_size
+            if total <= self.max_disk_bytes:
+                break
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["disk"] = self.disk_dir is not None
+        return stats
\ No newline at end of file
@@ -0,0 +1,247 @@
+"""
+Memory Accounting - Per-component weight bytes, per-request peaks and leak detection
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import torch
+
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # No procfs (macOS); the lifetime peak is the closest portable figure
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _reset_peak_rss() -> bool:
+    """Reset the kernel's RSS high-water mark (Linux >= 4.0); False when unsupported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_rss() -> Optional[int]:
+    """RSS high-water mark since the last reset, from /proc/self/status"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def module_memory(module: torch.nn.Module) -> Dict[str, Any]:
+    """Parameter and buffer bytes of a module, with a per-device breakdown"""
+    usage = {"parameters": 0, "buffers": 0, "devices": {}}
+    for kind, tensors in (("parameters", module.parameters()), ("buffers", module.buffers())):
+        for tensor in tensors:
+            size = tensor.numel() * tensor.element_size()
+            usage[kind] += size
+            device = str(tensor.device)
+            usage["devices"][device] = usage["devices"].get(device, 0) + size
+    usage["total"] = usage["parameters"] + usage["buffers"]
+    return usage
+
+def pipeline_memory(pipeline: Any) -> Dict[str, Dict[str, Any]]:
+    """Memory of every torch module a diffusers pipeline holds, by component name"""
+    components = getattr(pipeline, "components", None) or {}
+    return {
+        name: module_memory(component)
+        for name, component in components.items() if isinstance(component, torch.nn.Module)
+    }
+
+class LeakDetector:
+    """Flags steady memory growth over a sliding window of requests
+    
+    A leak is suspected when the least-squares slope of post-request memory is at
+    least ``min_slope`` bytes per request, the window grew by ``min_growth`` bytes
+    overall, and most consecutive requests did not shrink it; one-off jumps from
+    allocator caching or lazy initialisation do not trigger it.
+    """
+    
+    def __init__(self, window: int = 20, min_slope: int = 8 * 1024 ** 2, min_growth: int = 128 * 1024 ** 2,
+                 monotonic_fraction: float = 0.8):
+        self.window = window
+        self.min_slope = min_slope
+        self.min_growth = min_growth
+        self.monotonic_fraction = monotonic_fraction
+        self.samples = deque(maxlen=window)
+    
+    def add(self, value: int):
+        self.samples.append(value)
+    
+    def status(self) -> Dict[str, Any]:
+        samples = list(self.samples)
+        status = {"window": self.window, "samples": len(samples), "suspected": False,
+                  "slope_bytes_per_request": 0.0, "growth_bytes": 0}
+        if len(samples) < max(3, self.window // 2):
+            return status
+        
+        n = len(samples)
+        mean_x = (n - 1) / 2
+        mean_y = sum(samples) / n
+        covariance = sum((i - mean_x) * (y - mean_y) for i, y in enumerate(samples))
+        variance = sum((i - mean_x) ** 2 for i in range(n))
+        slope = covariance / variance
+        growth = samples[-1] - samples[0]
+        rising = sum(b >= a for a, b in zip(samples, samples[1:])) / (n - 1)
+        
+        status.update({
+            "slope_bytes_per_request": slope,
+            "growth_bytes": growth,
+            "suspected": slope >= self.min_slope and growth >= self.min_growth and rising >= self.monotonic_fraction
+        })
+        return status
+
+class MemoryTracker:
+    """Records memory around each request and watches the trend for leaks"""
+    
+    def __init__(self, device: str, window: int = 20, history: int = 100):
+        self.device = device
+        self.requests = deque(maxlen=history)
+        self.rss_leaks = LeakDetector(window)
+        self.cuda_leaks = LeakDetector(window) if device == "cuda" else None
+        
+        # Requests run in executor workers, each with its own RSS trend
+        self.worker_leaks: Dict[str, LeakDetector] = {}
+        self._window = window
+        self._lock = threading.Lock()
+        self._active = 0
+        self._warned = False
+        
+        # Exact peaks need a resettable kernel high-water mark; otherwise RSS is sampled
+        self.exact_peaks = _reset_peak_rss() and _peak_rss() is not None
+    
+    @contextmanager
+    def track(self, kind: str) -> Iterator[Dict[str, Any]]:
+        """Measure one request; the yielded dict is filled in when it finishes
+        
+        Peaks are process-wide, so overlapping requests each see the combined peak.
+        """
+        usage: Dict[str, Any] = {"kind": kind}
+        with self._lock:
+            # Only the first of overlapping requests resets the high-water marks
+            first = self._active == 0
+            self._active += 1
+            if first and self.exact_peaks:
+                _reset_peak_rss()
+            if first and self.device == "cuda":
+                torch.cuda.reset_peak_memory_stats()
+        
+        rss_before = current_rss()
+        cuda_before = torch.cuda.memory_allocated() if self.device == "cuda" else None
+        sampler = None if self.exact_peaks else _RssSampler(rss_before)
+        start = time.perf_counter()
+        try:
+            yield usage
+        finally:
+            rss_after = current_rss()
+            peak = _peak_rss() if self.exact_peaks else sampler.stop()
+            usage.update({
+                "seconds": time.perf_counter() - start,
+                "rss_before": rss_before,
+                "rss_after": rss_after,
+                "rss_delta": rss_after - rss_before,
+                "rss_peak_delta": max(peak or rss_after, rss_after) - rss_before
+            })
+            if cuda_before is not None:
+                cuda_after = torch.cuda.memory_allocated()
+                usage.update({
+                    "cuda_delta": cuda_after - cuda_before,
+                    "cuda_peak_delta": torch.cuda.max_memory_allocated() - cuda_before
+                })
+            
+            with self._lock:
+                self._active -= 1
+                self.requests.append(usage)
+                self.rss_leaks.add(rss_after)
+                if self.cuda_leaks is not None:
+                    self.cuda_leaks.add(cuda_after)
+                self._check_leaks()
+    
+    def record(self, usage: Dict[str, Any]):
+        """Add a request measured in another process, keyed by its ``worker`` name"""
+        worker = usage.get("worker", "worker")
+        with self._lock:
+            self.requests.append(usage)
+            detector = self.worker_leaks.setdefault(worker, LeakDetector(self._window))
+            detector.add(usage["rss_after"])
+            self._check_leaks()
+    
+    def _check_leaks(self):
+        suspected = self.rss_leaks.status()["suspected"] or (
+            self.cuda_leaks is not None and self.cuda_leaks.status()["suspected"]
+        ) or any(detector.status()["suspected"] for detector in self.worker_leaks.values())
+        if suspected and not self._warned:
+            logger.warning(f"Memory grew steadily over the last {self.rss_leaks.window} requests; possible leak")
+        self._warned = suspected
+    
+    def report(self, models: Dict[str, Any]) -> Dict[str, Any]:
+        """Process, per-model/per-component and per-request memory figures"""
+        per_model = {}
+        unique: Dict[int, int] = {}
+        for key, pipeline in models.items():
+            components = pipeline_memory(pipeline) if pipeline is not None else {}
+            per_model[key] = {
+                "total": sum(usage["total"] for usage in components.values()),
+                "components": components
+            }
+            for name, usage in components.items():
+                # Components shared between pipelines are counted once in the total
+                unique[id(getattr(pipeline, name))] = usage["total"]
+        
+        report = {
+            "device": self.device,
+            "rss": current_rss(),
+            "model_bytes": sum(unique.values()),
+            "models": per_model,
+            "recent_requests": list(self.requests)[-10:],
+            "leak": {"rss": self.rss_leaks.status()}
+        }
+        with self._lock:
+            workers = sorted(self.worker_leaks.items())
+        if workers:
+            report["workers"] = {
+                worker: {"rss": detector.samples[-1], "leak": detector.status()} for worker, detector in workers
+            }
+        if self.device == "cuda":
+            report.update({
+                "cuda_allocated": torch.cuda.memory_allocated(),
+                "cuda_reserved": torch.cuda.memory_reserved(),
+                "cuda_peak": torch.cuda.max_memory_allocated()
+            })
+            report["leak"]["cuda"] = self.cuda_leaks.status()
+        return report
+
+class _RssSampler:
+    """Fallback peak tracking where the kernel high-water mark cannot be reset"""
+    
+    def __init__(self, initial: int, interval: float = 0.01):
+        self.peak = initial
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+        self._thread.start()
+    
+    def _run(self, interval: float):
+        while not self._done.wait(interval):
+            self.peak = max(self.peak, current_rss())
+    
+    def stop(self) -> int:
+        self._done.set()
+        self._thread.join()
+        return max(self.peak, current_rss())
\ No newline at end of file
@@ -2,27 +2,83 @@
 Model Manager - Handles loading and management of AI models
 """
 
+import diffusers
 import torch
 from pathlib import Path
-from typing import Dict, Any, Optional
-from diffusers import StableDiffusionXLPipeline, ControlNetModel, StableDiffusionXLControlNetPipeline
+from typing import Dict, Any, List, Optional, Tuple
+from diffusers import (
+    StableDiffusionXLPipeline,
+    StableDiffusionXLImg2ImgPipeline,
+    StableDiffusionXLInpaintPipeline,
+    ControlNetModel,
+    StableDiffusionXLControlNetPipeline
+)
 
+from .memory import MemoryTracker
+from .performance import PerformanceProfile, apply_attention_options, apply_profile, resolve_profile
+from .token_merging import TokenMerging
 from ..utils.config import Config
 from ..utils.logger import get_logger
+from ..utils.model_store import ModelStore
 
 class ModelManager:
     """Manages loading and caching of AI models"""
     
+    # Weight-bearing pipeline components that can be shared between pipelines
+    SHAREABLE_COMPONENTS = ("unet", "vae", "text_encoder", "text_encoder_2")
+    
+    DEFAULT_CONTROLNET_MODELS = {
+        "canny": "diffusers/controlnet-canny-sdxl-1.0",
+        "depth": "diffusers/controlnet-depth-sdxl-1.0",
+        "pose": "thibaud/controlnet-openpose-sdxl-1.0"
+    }
+    
+    # Pipelines built from the base SDXL modules without loading anything
+    DERIVED_MODELS = ("sdxl_img2img", "sdxl_inpaint")
+    
+    # Performance keys that change how weights are placed; loaded models must be rebuilt
+    PLACEMENT_KEYS = (
+        "performance.memory_strategy",
+        "performance.use_fp16",
+        "performance.enable_cpu_offload",
+        "performance.enable_sequential_cpu_offload"
+    )
+    
     def __init__(self, config: Config):
         self.config = config
         self.logger = get_logger(__name__)
         self.device = self._get_device()
         self.models = {}
         
+        # Memory strategy derived from the performance config section
+        self.profile = resolve_profile(config, self.device)
+        self.logger.info(f"Using {self.profile} ({self.profile.reason})")
+        
         # Model paths
         self.model_dir = Path(config.get("model_dir", "data/models"))
         self.model_dir.mkdir(parents=True, exist_ok=True)
         
+        # Identical components are loaded once and shared between pipelines,
+        # keyed by the content identity of their weight files
+        self.store = ModelStore(self.model_dir)
+        self.components: Dict[str, Any] = {}
+        self.component_owners: Dict[str, set] = {}
+        self._variant_fallbacks: set = set()
+        
+        # Token merging is patched onto loaded pipelines on demand
+        self.token_merging = TokenMerging(
+            max_downsample=config.get("performance.token_merging_max_downsample", 2)
+        )
+        
+        # Per-request memory deltas and leak detection across requests
+        self.memory = MemoryTracker(self.device, window=config.get("performance.leak_window", 20))
+        
+        # Identity each loaded model was built with; a config change only reloads
+        # the models whose identity it changes
+        self.model_identities: Dict[str, str] = {}
+        config.subscribe(("models", "performance"), self.apply_config_changes, "model_manager")
+        config.subscribe("generation.default_scheduler", self._scheduler_changed, "scheduler")
+        
     def _get_device(self) -> str:
         """Determine the best available device"""
         if torch.cuda.is_available():
@@ -32,32 +88,32 @@ class ModelManager:
         else:
             return "cpu"
     
-    def load_sdxl(self, model_id: str = "stabilityai/stable-diffusion-xl-base-1.0") -> StableDiffusionXLPipeline:
+    def load_sdxl(self, model_id: Optional[str] = None) -> StableDiffusionXLPipeline:
         """Load Stable Diffusion XL pipeline"""
         if "sdxl" in self.models:
             return self.models["sdxl"]
         
-        self.logger.info(f"Loading SDXL model: {model_id}")
+        model_id = model_id or self.config.get("models.sdxl_model", "stabilityai/stable-diffusion-xl-base-1.0")
+        source = self._resolve_model(model_id, "sdxl-base")
+        self.logger.info(f"Loading SDXL model: {source}")
         
         try:
+            shared = self._shared_components(source)
             pipeline = StableDiffusionXLPipeline.from_pretrained(
-                model_id,
-                torch_dtype=torch.float16 if self.device != "cpu" else torch.float32,
+                source,
+                torch_dtype=self.profile.torch_dtype,
                 use_safetensors=True,
-                variant="fp16" if self.device != "cpu" else None
+                variant=self._source_variant(source),
+                **shared
             )
             
-            pipeline = pipeline.to(self.device)
-            
-            # Enable memory efficient attention
-            if hasattr(pipeline, "enable_xformers_memory_efficient_attention"):
-                pipeline.enable_xformers_memory_efficient_attention()
-            
-            # Enable CPU offload for memory efficiency
-            if self.device == "cuda":
-                pipeline.enable_model_cpu_offload()
+            # Device placement, offload and attention options from the performance profile
+            pipeline = apply_profile(pipeline, self.profile, self.device)
+            self.set_scheduler(pipeline)
             
+            self._register_components("sdxl", source, pipeline)
             self.models["sdxl"] = pipeline
+            self.model_identities["sdxl"] = self._model_identity(source)
             self.logger.info("SDXL model loaded successfully")
             return pipeline
             
@@ -65,6 +121,65 @@ class ModelManager:
             self.logger.error(f"Failed to load SDXL model: {e}")
             raise
     
+    def load_img2img(self) -> StableDiffusionXLImg2ImgPipeline:
+        """Image-to-image view of the base SDXL pipeline; shares every module, loads nothing"""
+        if "sdxl_img2img" in self.models:
+            return self.models["sdxl_img2img"]
+        
+        base = self.load_sdxl()
+        pipeline = StableDiffusionXLImg2ImgPipeline(**base.components)
+        
+        self.models["sdxl_img2img"] = pipeline
+        return pipeline
+    
+    def load_inpaint(self) -> StableDiffusionXLInpaintPipeline:
+        """Inpainting view of the base SDXL pipeline; shares every module, loads nothing"""
+        if "sdxl_inpaint" in self.models:
+            return self.models["sdxl_inpaint"]
+        
+        base = self.load_sdxl()
+        pipeline = StableDiffusionXLInpaintPipeline(**base.components)
+        
+        self.models["sdxl_inpaint"] = pipeline
+        return pipeline
+    
+    def load_refiner(self, model_id: Optional[str] = None) -> StableDiffusionXLImg2ImgPipeline:
+        """Load the SDXL refiner, sharing the base pipeline's VAE and second text encoder"""
+        if "sdxl_refiner" in self.models:
+            return self.models["sdxl_refiner"]
+        
+        base = self.load_sdxl()
+        model_id = model_id or self.config.get("models.sdxl_refiner", "stabilityai/stable-diffusion-xl-refiner-1.0")
+        source = self._resolve_model(model_id, "sdxl-refiner")
+        self.logger.info(f"Loading SDXL refiner: {source}")
+        
+        try:
+            # The refiner ships the same VAE and OpenCLIP encoder as the base model
+            shared = self._shared_components(source, ["unet"])
+            shared["vae"] = base.vae
+            shared["text_encoder_2"] = base.text_encoder_2
+            
+            pipeline = StableDiffusionXLImg2ImgPipeline.from_pretrained(
+                source,
+                torch_dtype=self.profile.torch_dtype,
+                use_safetensors=True,
+                variant=self._source_variant(source),
+                **shared
+            )
+            
+            pipeline = apply_profile(pipeline, self.profile, self.device)
+            self.set_scheduler(pipeline)
+            
+            self._register_components("sdxl_refiner", source, pipeline, ["unet", "vae", "text_encoder_2"])
+            self.models["sdxl_refiner"] = pipeline
+            self.model_identities["sdxl_refiner"] = self._expected_identity("sdxl_refiner")
+            self.logger.info("SDXL refiner loaded successfully")
+            return pipeline
+            
+        except Exception as e:
+            self.logger.error(f"Failed to load SDXL refiner: {e}")
+            raise
+    
     def load_controlnet(self, controlnet_type: str = "canny") -> StableDiffusionXLControlNetPipeline:
         """Load ControlNet pipeline"""
         cache_key = f"controlnet_{controlnet_type}"
@@ -76,34 +191,31 @@ class ModelManager:
         
         try:
             # Load ControlNet model
-            controlnet_models = {
-                "canny": "diffusers/controlnet-canny-sdxl-1.0",
-                "depth": "diffusers/controlnet-depth-sdxl-1.0",
-                "pose": "thibaud/controlnet-openpose-sdxl-1.0"
-            }
-            
-            controlnet_id = controlnet_models.get(controlnet_type, controlnet_models["canny"])
-            
+            controlnet_source = self._controlnet_source(controlnet_type)
             controlnet = ControlNetModel.from_pretrained(
-                controlnet_id,
-                torch_dtype=torch.float16 if self.device != "cpu" else torch.float32
+                controlnet_source,
+                torch_dtype=self.profile.torch_dtype,
+                variant=self._source_variant(controlnet_source)
             )
             
-            # Load SDXL pipeline with ControlNet
+            # Load SDXL pipeline with ControlNet, reusing the base components when already loaded
+            base = self._resolve_model(self.config.get("models.sdxl_model", "stabilityai/stable-diffusion-xl-base-1.0"), "sdxl-base")
+            shared = self._shared_components(base)
             pipeline = StableDiffusionXLControlNetPipeline.from_pretrained(
-                "stabilityai/stable-diffusion-xl-base-1.0",
+                base,
                 controlnet=controlnet,
-                torch_dtype=torch.float16 if self.device != "cpu" else torch.float32,
+                torch_dtype=self.profile.torch_dtype,
                 use_safetensors=True,
-                variant="fp16" if self.device != "cpu" else None
+                variant=self._source_variant(base),
+                **shared
             )
             
-            pipeline = pipeline.to(self.device)
-            
-            if hasattr(pipeline, "enable_xformers_memory_efficient_attention"):
-                pipeline.enable_xformers_memory_efficient_attention()
+            pipeline = apply_profile(pipeline, self.profile, self.device)
+            self.set_scheduler(pipeline)
             
+            self._register_components(cache_key, base, pipeline)
             self.models[cache_key] = pipeline
+            self.model_identities[cache_key] = self._expected_identity(cache_key)
             self.logger.info(f"ControlNet {controlnet_type} loaded successfully")
             return pipeline
             
@@ -144,10 +256,209 @@ class ModelManager:
             self.logger.error(f"Failed to load LoRA adapter: {e}")
             return False
     
+    def _resolve_model(self, model_id: str, local_name: str) -> str:
+        """Prefer a model downloaded into model_dir over the hub id
+        
+        A local directory is only used when every weight folder has files of one
+        common variant; a partial or empty download falls back to the hub id.
+        """
+        local = self.model_dir / local_name
+        if not ((local / "model_index.json").exists() or (local / "config.json").exists()):
+            return model_id
+        if not self._local_variants(local):
+            self.logger.warning(f"{local} has no complete set of weights, loading {model_id} instead")
+            return model_id
+        return str(local)
+    
+    @staticmethod
+    def _is_fp16(path: Path) -> bool:
+        # Shards put the variant before or after their number: model.fp16-00001-of-00002.safetensors
+        return ".fp16." in path.name or ".fp16-" in path.name
+    
+    @classmethod
+    def _local_variants(cls, local: Path) -> set:
+        """Weight variants ("fp16" or None) present in every weight folder of a local model"""
+        # Pipelines load their component folders; single models keep weights at the top level
+        folders = [p for p in local.iterdir() if p.is_dir()] if (local / "model_index.json").exists() else [local]
+        common = None
+        for folder in folders:
+            weights = [
+                p for p in folder.iterdir()
+                if p.suffix in (".safetensors", ".bin") and p.name.startswith(("diffusion_pytorch_model", "model"))
+            ]
+            if not weights:
+                continue
+            variants = {"fp16" if cls._is_fp16(p) else None for p in weights}
+            common = variants if common is None else common & variants
+        return common or set()
+    
+    def _source_variant(self, source: str) -> Optional[str]:
+        """Variant to request from a source; a local directory may only hold the other one"""
+        local = Path(source)
+        if not local.is_dir():
+            return self.profile.variant
+        
+        variants = self._local_variants(local)
+        if self.profile.variant in variants or not variants:
+            return self.profile.variant
+        
+        # fp16 files load fine into fp32 modules and vice versa; only the download differs
+        variant = next(iter(variants))
+        if source not in self._variant_fallbacks:
+            self._variant_fallbacks.add(source)
+            self.logger.warning(f"{source} has no {self.profile.variant or 'fp32'} weights, loading its {variant or 'fp32'} files")
+        return variant
+    
+    def _weight_files(self, folder: Path, variant: Optional[str]) -> List[Path]:
+        """Weight files from_pretrained would load for a component folder"""
+        return [p for p in sorted(folder.glob("*.safetensors")) if self._is_fp16(p) == (variant == "fp16")]
+    
+    def _component_key(self, source: str, name: str) -> Optional[str]:
+        """Identity of a pipeline component; equal keys mean identical weights"""
+        folder = Path(source) / name
+        if folder.is_dir():
+            identity = self.store.identity(self._weight_files(folder, self._source_variant(source)))
+            if identity is None:
+                return None
+        else:
+            identity = f"{source}/{name}"
+        return f"{identity}:{self.profile.torch_dtype}"
+    
+    def _shared_components(self, source: str, names: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Already-loaded components that a pipeline from `source` can reuse"""
+        shared = {}
+        for name in names or self.SHAREABLE_COMPONENTS:
+            key = self._component_key(source, name)
+            if key in self.components:
+                shared[name] = self.components[key]
+        
+        if shared:
+            self.logger.info(f"Reusing loaded components: {', '.join(shared)}")
+        return shared
+    
+    def _register_components(self, model_key: str, source: str, pipeline: Any, names: Optional[List[str]] = None):
+        """Record a pipeline's components so later pipelines can share them"""
+        for name in names or self.SHAREABLE_COMPONENTS:
+            module = getattr(pipeline, name, None)
+            key = self._component_key(source, name)
+            if module is None or key is None:
+                continue
+            self.components.setdefault(key, module)
+            self.component_owners.setdefault(key, set()).add(model_key)
+    
+    def _controlnet_source(self, controlnet_type: str) -> str:
+        controlnet_models = {**self.DEFAULT_CONTROLNET_MODELS, **(self.config.get("models.controlnet_models") or {})}
+        controlnet_id = controlnet_models.get(controlnet_type, controlnet_models["canny"])
+        return self._resolve_model(controlnet_id, f"controlnet-{controlnet_type}")
+    
+    def _model_identity(self, source: str, names: Optional[List[str]] = None) -> str:
+        """Weights, dtype and placement a pipeline from `source` would be built with"""
+        keys = [self._component_key(source, name) or f"{source}/{name}" for name in names or self.SHAREABLE_COMPONENTS]
+        return f"{'|'.join(keys)}@{self.profile.strategy}"
+    
+    def _expected_identity(self, model_key: str) -> Optional[str]:
+        """Identity the current config implies for a loaded model; None for derived pipelines"""
+        base = self._resolve_model(self.config.get("models.sdxl_model", "stabilityai/stable-diffusion-xl-base-1.0"), "sdxl-base")
+        if model_key == "sdxl":
+            return self._model_identity(base)
+        if model_key == "sdxl_refiner":
+            refiner = self._resolve_model(
+                self.config.get("models.sdxl_refiner", "stabilityai/stable-diffusion-xl-refiner-1.0"), "sdxl-refiner"
+            )
+            # The refiner borrows the base VAE and second text encoder
+            return f"{self._model_identity(refiner, ['unet'])}+{self._model_identity(base)}"
+        if model_key.startswith("controlnet_"):
+            controlnet = self._controlnet_source(model_key[len("controlnet_"):])
+            return f"{controlnet}+{self._model_identity(base)}"
+        return None
+    
+    def apply_config_changes(self, changes: Dict[str, Tuple[Any, Any]]) -> List[str]:
+        """Apply reloaded ``models``/``performance`` settings to loaded models
+        
+        Attention options and token merging are toggled on the live pipelines. Only
+        models whose identity (weights, dtype or placement) changed are unloaded;
+        they are loaded again on their next use. Returns the unloaded model keys.
+        """
+        if any(key.startswith("performance.") for key in changes):
+            profile = resolve_profile(self.config, self.device)
+            if profile.mode == "auto" and self.profile.mode == "auto" and not set(changes) & set(self.PLACEMENT_KEYS):
+                # Free memory measured now excludes the resident models; keep the original decision
+                profile = PerformanceProfile(
+                    strategy=self.profile.strategy,
+                    enable_xformers=profile.enable_xformers,
+                    attention_slicing=self.profile.attention_slicing and not profile.enable_xformers,
+                    vae_slicing=self.profile.vae_slicing,
+                    use_fp16=self.profile.use_fp16,
+                    batch_size=profile.batch_size,
+                    mode="auto",
+                    reason=self.profile.reason
+                )
+            if profile.to_dict() != self.profile.to_dict():
+                self.logger.info(f"Performance profile changed to {profile}")
+            self.profile = profile
+        
+        if "performance.token_merging_max_downsample" in changes:
+            self.token_merging.max_downsample = self.config.get("performance.token_merging_max_downsample", 2)
+            # Patches are rebuilt with the new setting on the next request
+            for pipeline in self.models.values():
+                self.token_merging.remove(pipeline)
+        
+        unloaded = [
+            key for key, identity in list(self.model_identities.items())
+            if key in self.models and self._expected_identity(key) != identity
+        ]
+        for key in unloaded:
+            self.logger.info(f"Model '{key}' changed identity; it reloads on next use")
+            self.unload_model(key)
+        
+        for key, pipeline in self.models.items():
+            if key not in unloaded and hasattr(pipeline, "enable_attention_slicing"):
+                apply_attention_options(pipeline, self.profile)
+        return unloaded
+    
+    def set_scheduler(self, pipeline: Any, name: Optional[str] = None):
+        """Swap a pipeline's scheduler in place, keeping its configured noise schedule"""
+        name = name or self.config.get("generation.default_scheduler")
+        scheduler = getattr(pipeline, "scheduler", None)
+        if not name or scheduler is None or type(scheduler).__name__ == name:
+            return
+        
+        scheduler_cls = getattr(diffusers, name, None)
+        if scheduler_cls is None or not hasattr(scheduler_cls, "from_config"):
+            raise ValueError(f"Unknown scheduler '{name}'")
+        pipeline.scheduler = scheduler_cls.from_config(scheduler.config)
+    
+    def _scheduler_changed(self, changes: Dict[str, Tuple[Any, Any]]):
+        for pipeline in self.models.values():
+            self.set_scheduler(pipeline)
+    
+    def component_identity(self, module: Any) -> Optional[str]:
+        """Stable identity of a loaded component (weights and dtype), if it was registered"""
+        return next((key for key, component in self.components.items() if component is module), None)
+    
+    def set_token_merging(self, pipeline: Any, ratio: Optional[float] = None) -> float:
+        """Apply token merging to a loaded pipeline without reloading it"""
+        if ratio is None:
+            ratio = self.config.get("performance.token_merging_ratio", 0.0)
+        return self.token_merging.apply(pipeline, ratio)
+    
     def unload_model(self, model_key: str):
         """Unload a specific model to free memory"""
         if model_key in self.models:
+            # Derived pipelines hold the same modules and would keep them alive
+            if model_key == "sdxl":
+                for derived in self.DERIVED_MODELS:
+                    self.models.pop(derived, None)
+            
+            self.token_merging.remove(self.models[model_key])
             del self.models[model_key]
+            self.model_identities.pop(model_key, None)
+            
+            for key, owners in list(self.component_owners.items()):
+                owners.discard(model_key)
+                if not owners:
+                    del self.component_owners[key]
+                    self.components.pop(key, None)
             torch.cuda.empty_cache() if torch.cuda.is_available() else None
             self.logger.info(f"Model '{model_key}' unloaded")
     
@@ -156,14 +467,20 @@ class ModelManager:
         return {
             "device": self.device,
             "loaded_models": list(self.models.keys()),
-            "memory_usage": self._get_memory_usage()
+            "token_merging": {
+                key: self.token_merging.current_ratio(pipeline)
+                for key, pipeline in self.models.items()
+            },
+            "performance_profile": self.profile.to_dict(),
+            "shared_components": {
+                key: sorted(owners)
+                for key, owners in self.component_owners.items() if len(owners) > 1
+            },
+            "memory_usage": self.get_memory_usage()
         }
     
-    def _get_memory_usage(self) -> Dict[str, Any]:
-        """Get current memory usage"""
-        if torch.cuda.is_available():
-            return {
-                "gpu_memory_allocated": torch.cuda.memory_allocated() / 1024**3,  # GB
-                "gpu_memory_reserved": torch.cuda.memory_reserved() / 1024**3,    # GB
-            }
-        return {"cpu_only": True}
\ No newline at end of file
+    def get_memory_usage(self) -> Dict[str, Any]:
+        """Process/CUDA totals, per-model and per-component weight bytes, recent request deltas and leak status"""
+        # Derived pipelines only re-list modules their parent already reports
+        models = {key: pipeline for key, pipeline in self.models.items() if key not in self.DERIVED_MODELS}
+        return self.memory.report(models)
@@ -0,0 +1,229 @@
+"""
+Performance Profiles - Turns the performance config section into a memory strategy
+"""
+
+import os
+from typing import Any, Dict, Optional
+
+import torch
+
+from ..utils.config import Config
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+GB = 1024 ** 3
+
+# Rough SDXL footprints in fp16; fp32 doubles them
+SDXL_WEIGHT_BYTES = 6.9 * GB          # UNet + both text encoders + VAE
+SDXL_LARGEST_COMPONENT_BYTES = 5.1 * GB  # UNet, the peak resident set under model offload
+SDXL_ACTIVATION_BYTES_1024 = 3.0 * GB    # Attention and VAE decode peak at 1024x1024
+
+# Headroom kept free for the allocator and other processes
+MEMORY_HEADROOM = 0.9
+
+STRATEGIES = ("none", "model_offload", "sequential_offload")
+
+# Keys that pick the memory strategy by hand; the auto mode decides these itself
+MANUAL_KEYS = (
+    "performance.enable_cpu_offload",
+    "performance.enable_sequential_cpu_offload",
+    "performance.enable_attention_slicing",
+    "performance.enable_vae_slicing"
+)
+
+class PerformanceProfile:
+    """Memory strategy and speed options applied to every loaded pipeline"""
+    
+    def __init__(self,
+                 strategy: str = "none",
+                 enable_xformers: bool = False,
+                 attention_slicing: bool = False,
+                 vae_slicing: bool = False,
+                 use_fp16: bool = False,
+                 batch_size: int = 1,
+                 mode: str = "manual",
+                 reason: str = ""):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown memory strategy '{strategy}', expected one of {STRATEGIES}")
+        
+        self.strategy = strategy
+        self.enable_xformers = enable_xformers
+        self.attention_slicing = attention_slicing
+        self.vae_slicing = vae_slicing
+        self.use_fp16 = use_fp16
+        self.batch_size = batch_size
+        self.mode = mode
+        self.reason = reason
+    
+    @property
+    def torch_dtype(self) -> torch.dtype:
+        return torch.float16 if self.use_fp16 else torch.float32
+    
+    @property
+    def variant(self) -> Optional[str]:
+        return "fp16" if self.use_fp16 else None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "strategy": self.strategy,
+            "enable_xformers": self.enable_xformers,
+            "attention_slicing": self.attention_slicing,
+            "vae_slicing": self.vae_slicing,
+            "use_fp16": self.use_fp16,
+            "batch_size": self.batch_size,
+            "reason": self.reason
+        }
+    
+    def __repr__(self) -> str:
+        options = [name for name in ("enable_xformers", "attention_slicing", "vae_slicing", "use_fp16") if getattr(self, name)]
+        return f"PerformanceProfile({self.mode}: {self.strategy}, {', '.join(options) or 'no extras'}, batch={self.batch_size})"
+
+def available_memory(device: str) -> Optional[int]:
+    """Bytes of memory currently free on the device, or None if it cannot be measured"""
+    try:
+        if device == "cuda":
+            free, _ = torch.cuda.mem_get_info()
+            return free
+        
+        # CPU and MPS draw from system RAM
+        try:
+            import psutil
+            return psutil.virtual_memory().available
+        except ImportError:
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError, RuntimeError):
+        return None
+
+def xformers_available() -> bool:
+    """Whether xformers can be imported"""
+    try:
+        import xformers  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def estimate_requirements(use_fp16: bool, width: int, height: int, batch_size: int) -> Dict[str, float]:
+    """Estimate SDXL weight and activation memory for a resolution and batch size"""
+    scale = 1 if use_fp16 else 2
+    activations = SDXL_ACTIVATION_BYTES_1024 * (width * height) / (1024 * 1024) * batch_size * scale
+    return {
+        "weights": SDXL_WEIGHT_BYTES * scale,
+        "largest_component": SDXL_LARGEST_COMPONENT_BYTES * scale,
+        "activations": activations
+    }
+
+def resolve_profile(config: Config, device: str) -> PerformanceProfile:
+    """Build the performance profile for a device from the ``performance`` config section"""
+    mode = config.get("performance.memory_strategy", "manual")
+    use_fp16 = bool(config.get("performance.use_fp16", True)) and device != "cpu"
+    enable_xformers = (bool(config.get("performance.enable_xformers", True))
+                       and device == "cuda" and xformers_available())
+    batch_size = int(config.get("performance.batch_size", 1))
+    
+    if mode != "auto":
+        if config.get("performance.enable_sequential_cpu_offload", False):
+            strategy = "sequential_offload"
+        elif config.get("performance.enable_cpu_offload", True):
+            strategy = "model_offload"
+        else:
+            strategy = "none"
+        
+        # Offloading moves weights between CPU and an accelerator; meaningless on CPU
+        if device != "cuda":
+            strategy = "none"
+        
+        return PerformanceProfile(
+            strategy=strategy,
+            enable_xformers=enable_xformers,
+            attention_slicing=bool(config.get("performance.enable_attention_slicing", False)),
+            vae_slicing=bool(config.get("performance.enable_vae_slicing", False)),
+            use_fp16=use_fp16,
+            batch_size=batch_size,
+            mode="manual",
+            reason="configured explicitly"
+        )
+    
+    overridden = [key for key in MANUAL_KEYS if config.get(key) is not None]
+    if overridden:
+        logger.warning(f"memory_strategy 'auto' ignores {', '.join(overridden)}; "
+                       f"set memory_strategy to 'manual' to use them")
+    
+    width = config.get("generation.default_width", 1024)
+    height = config.get("generation.default_height", 1024)
+    return _auto_profile(device, use_fp16, enable_xformers, batch_size, width, height)
+
+def _auto_profile(device: str, use_fp16: bool, enable_xformers: bool, batch_size: int,
+                  width: int, height: int) -> PerformanceProfile:
+    """Pick the cheapest strategy whose estimated peak fits in the free memory"""
+    free = available_memory(device)
+    need = estimate_requirements(use_fp16, width, height, batch_size)
+    
+    def profile(strategy: str, slicing: bool, reason: str) -> PerformanceProfile:
+        return PerformanceProfile(
+            strategy=strategy,
+            enable_xformers=enable_xformers,
+            # xformers already bounds attention memory, slicing would only slow it down
+            attention_slicing=slicing and not enable_xformers,
+            vae_slicing=slicing,
+            use_fp16=use_fp16,
+            batch_size=batch_size,
+            mode="auto",
+            reason=reason
+        )
+    
+    if free is None:
+        return profile("model_offload" if device == "cuda" else "none", True, "free memory unknown")
+    
+    budget = free * MEMORY_HEADROOM
+    sliced_activations = need["activations"] / 2
+    free_gb = free / GB
+    
+    candidates = [("none", False, need["weights"] + need["activations"])]
+    candidates.append(("none", True, need["weights"] + sliced_activations))
+    if device == "cuda":
+        candidates.append(("model_offload", False, need["largest_component"] + need["activations"]))
+        candidates.append(("model_offload", True, need["largest_component"] + sliced_activations))
+    
+    for strategy, slicing, peak in candidates:
+        if peak <= budget:
+            return profile(strategy, slicing, f"estimated peak {peak / GB:.1f}GB fits in {free_gb:.1f}GB free")
+    
+    if device == "cuda":
+        return profile("sequential_offload", True, f"only {free_gb:.1f}GB free, streaming weights per layer")
+    
+    # Nothing left to trade on CPU/MPS; slice to keep the peak as low as possible
+    return profile("none", True, f"only {free_gb:.1f}GB free, estimated peak exceeds it")
+
+def apply_profile(pipeline: Any, profile: PerformanceProfile, device: str) -> Any:
+    """Place a freshly loaded pipeline on its device according to a profile"""
+    if profile.strategy == "model_offload":
+        pipeline.enable_model_cpu_offload()
+    elif profile.strategy == "sequential_offload":
+        pipeline.enable_sequential_cpu_offload()
+    else:
+        pipeline = pipeline.to(device)
+    
+    apply_attention_options(pipeline, profile)
+    return pipeline
+
+def apply_attention_options(pipeline: Any, profile: PerformanceProfile):
+    """Toggle attention and VAE memory options; safe to call on a live pipeline"""
+    if profile.enable_xformers:
+        try:
+            pipeline.enable_xformers_memory_efficient_attention()
+        except Exception as e:
+            logger.warning(f"Could not enable xformers attention: {e}")
+    elif hasattr(pipeline, "disable_xformers_memory_efficient_attention"):
+        pipeline.disable_xformers_memory_efficient_attention()
+    
+    if profile.attention_slicing:
+        pipeline.enable_attention_slicing()
+    elif hasattr(pipeline, "disable_attention_slicing"):
+        pipeline.disable_attention_slicing()
+    
+    if profile.vae_slicing:
+        pipeline.enable_vae_slicing()
+    elif hasattr(pipeline, "disable_vae_slicing"):
+        pipeline.disable_vae_slicing()
\ No newline at end of file
@@ -3,15 +3,22 @@ Image Generation Pipeline
 Handles different generation workflows: text-to-image, image-to-image, inpainting
 """
 
-from typing import Dict, Any, Optional
-from pathlib import Path
+import math
+import secrets
+import time
+from typing import Dict, Any, Optional, Tuple
 import torch
+import torch.nn.functional as F
 from PIL import Image
 
+from .guidance import GuidanceTruncation
+from .latent_cache import LatentCache, encode_image, image_digest
 from .model_manager import ModelManager
 from ..utils.config import Config
 from ..utils.logger import get_logger
-from ..utils.image_utils import load_image, save_image
+from ..utils.image_utils import load_image
+from ..utils.output_store import OutputStore
+from ..utils.handoff import RETURN_MODES, SharedImageRegistry, tensor_to_uint8
 
 class ImageGenerationPipeline:
     """Main pipeline for image generation tasks"""
@@ -23,18 +30,64 @@ class ImageGenerationPipeline:
         
         # Load base models
         self.sdxl_pipeline = None
+        self.img2img_pipeline = None
+        self.inpaint_pipeline = None
+        self.refiner_pipeline = None
         self.controlnet_pipeline = None
         self.instantid_pipeline = None
         
+        # Shared memory blocks handed to same-host consumers
+        self.shared_images = SharedImageRegistry()
+        
+        # Saved outputs are indexed for search and retention
+        self.output_store = OutputStore.from_config(config)
+        
+        # VAE encodings of img2img/inpaint sources, reused across prompts and strengths
+        self.latent_cache = LatentCache.from_config(config)
+        
+        # Runs after the model manager's own handler on reload
+        config.subscribe(("models", "performance"), self._drop_unloaded_models, "pipeline")
+        config.subscribe(("output_dir", "outputs"), self._reopen_output_store, "output_store")
+        config.subscribe(("cache_dir", "latent_cache"), self._rebuild_latent_cache, "latent_cache")
+        
     def _ensure_models_loaded(self, model_type: str):
         """Ensure required models are loaded"""
         if model_type == "sdxl" and self.sdxl_pipeline is None:
             self.sdxl_pipeline = self.model_manager.load_sdxl()
+        elif model_type == "img2img" and self.img2img_pipeline is None:
+            self.img2img_pipeline = self.model_manager.load_img2img()
+        elif model_type == "inpaint" and self.inpaint_pipeline is None:
+            self.inpaint_pipeline = self.model_manager.load_inpaint()
+        elif model_type == "refiner" and self.refiner_pipeline is None:
+            self.refiner_pipeline = self.model_manager.load_refiner()
         elif model_type == "controlnet" and self.controlnet_pipeline is None:
             self.controlnet_pipeline = self.model_manager.load_controlnet()
         elif model_type == "instantid" and self.instantid_pipeline is None:
             self.instantid_pipeline = self.model_manager.load_instantid()
     
+    def _drop_unloaded_models(self, changes: Dict[str, Any]):
+        """Forget pipelines the model manager unloaded so they reload on next use"""
+        loaded = [id(pipeline) for pipeline in self.model_manager.models.values()]
+        dropped = False
+        for attr in ("sdxl_pipeline", "img2img_pipeline", "inpaint_pipeline", "refiner_pipeline",
+                     "controlnet_pipeline", "instantid_pipeline"):
+            pipeline = getattr(self, attr)
+            if pipeline is not None and id(pipeline) not in loaded:
+                setattr(self, attr, None)
+                dropped = True
+        
+        # In-memory keys of unregistered VAEs use object ids, which a new VAE may reuse
+        if dropped and self.latent_cache is not None:
+            self.latent_cache.clear()
+    
+    def _reopen_output_store(self, changes: Dict[str, Any]):
+        previous = self.output_store
+        self.output_store = OutputStore.from_config(self.config)
+        previous.close()
+    
+    def _rebuild_latent_cache(self, changes: Dict[str, Any]):
+        self.latent_cache = LatentCache.from_config(self.config)
+    
     def text_to_image(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Generate image from text prompt"""
         self._ensure_models_loaded("sdxl")
@@ -47,32 +100,67 @@ class ImageGenerationPipeline:
             height = params.get("height", 1024)
             steps = params.get("num_inference_steps", 20)
             guidance_scale = params.get("guidance_scale", 7.5)
-            seed = params.get("seed", None)
+            num_images = params.get("num_images", self.model_manager.profile.batch_size)
+            use_refiner = params.get("refiner", self.config.get("generation.use_refiner", False))
+            denoising_end = params.get("denoising_end", self.config.get("generation.refiner_denoising_end", 0.8))
+            
+            progressive = self._progressive_plan(params, width, height)
             
-            # Set seed for reproducibility
-            if seed is not None:
-                torch.manual_seed(seed)
+            start = time.perf_counter()
+            
+            if use_refiner and progressive:
+                raise ValueError("The refiner and progressive high-resolution modes cannot be combined")
+            if use_refiner:
+                self._ensure_models_loaded("refiner")
+            
+            self.model_manager.set_token_merging(self.sdxl_pipeline, params.get("token_merging_ratio"))
+            base_steps = round(steps * denoising_end) if use_refiner else steps
+            truncation = GuidanceTruncation.from_params(params, base_steps)
+            
+            # Per-request RNG so concurrent requests stay reproducible
+            generator = self._generator(params)
+            
+            if use_refiner:
+                # The base stops at denoising_end and hands raw latents to the refiner
+                stage_kwargs = {"denoising_end": denoising_end, "output_type": "latent"}
+            elif progressive:
+                # The first pass runs at the base resolution and stays in latent space if possible
+                width, height = progressive["base"]
+                stage_kwargs = {"output_type": "latent" if progressive["upscaler"] == "latent" else "pil"}
+            else:
+                stage_kwargs = self._output_kwargs(params)
             
             # Generate image
-            result = self.sdxl_pipeline(
+            result = self._run(
+                self.sdxl_pipeline,
+                truncation,
                 prompt=prompt,
                 negative_prompt=negative_prompt,
                 width=width,
                 height=height,
                 num_inference_steps=steps,
                 guidance_scale=guidance_scale,
-                return_dict=True
+                num_images_per_prompt=num_images,
+                generator=generator,
+                return_dict=True,
+                **stage_kwargs
             )
             
-            # Save image
-            image = result.images[0]
-            output_path = self._save_generated_image(image, "txt2img")
+            extra = self._truncation_info(truncation)
+            if use_refiner:
+                result = self._refine_latents(result.images, params, steps, denoising_end, num_images, generator)
+                extra["refiner"] = {"denoising_end": denoising_end}
+            elif progressive:
+                result = self._progressive_upscale(result.images, params, progressive, generator)
+                extra["progressive"] = {
+                    "base": list(progressive["base"]),
+                    "stages": [list(size) for size in progressive["stages"]],
+                    "upscaler": progressive["upscaler"]
+                }
             
-            return {
-                "success": True,
-                "image_path": str(output_path),
-                "parameters": params
-            }
+            model = self._model_name("sdxl_refiner" if use_refiner else None)
+            timings = {"generate": time.perf_counter() - start}
+            return self._build_result(result.images, "txt2img", params, model=model, timings=timings, **extra)
             
         except Exception as e:
             self.logger.error(f"Text-to-image generation failed: {e}")
@@ -80,7 +168,7 @@ class ImageGenerationPipeline:
     
     def image_to_image(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Transform existing image with new prompt"""
-        self._ensure_models_loaded("sdxl")
+        self._ensure_models_loaded("img2img")
         
         try:
             # Load input image
@@ -91,25 +179,39 @@ class ImageGenerationPipeline:
             prompt = params.get("prompt", "")
             strength = params.get("strength", 0.8)
             guidance_scale = params.get("guidance_scale", 7.5)
+            steps = params.get("num_inference_steps", 50)
+            start = time.perf_counter()
+            
+            # Encode the source once per image/resolution/VAE and reuse it
+            height, width = self.img2img_pipeline.image_processor.get_default_height_width(
+                input_image, params.get("height"), params.get("width")
+            )
+            image_latents, cache_state = self._source_latents(
+                self.img2img_pipeline, input_image, height, width, normalize=True
+            )
+            encoded = time.perf_counter()
+            
+            self.model_manager.set_token_merging(self.img2img_pipeline, params.get("token_merging_ratio"))
+            truncation = GuidanceTruncation.from_params(params, int(steps * strength))
             
             # Generate transformed image
-            result = self.sdxl_pipeline(
+            result = self._run(
+                self.img2img_pipeline,
+                truncation,
                 prompt=prompt,
-                image=input_image,
+                image=image_latents,
                 strength=strength,
+                num_inference_steps=steps,
                 guidance_scale=guidance_scale,
-                return_dict=True
+                generator=self._generator(params),
+                return_dict=True,
+                **self._output_kwargs(params)
             )
             
-            # Save image
-            image = result.images[0]
-            output_path = self._save_generated_image(image, "img2img")
-            
-            return {
-                "success": True,
-                "image_path": str(output_path),
-                "parameters": params
-            }
+            timings = {"encode": encoded - start, "generate": time.perf_counter() - start}
+            return self._build_result(result.images, "img2img", params, model=self._model_name(),
+                                      timings=timings, latent_cache={"image": cache_state},
+                                      **self._truncation_info(truncation))
             
         except Exception as e:
             self.logger.error(f"Image-to-image generation failed: {e}")
@@ -117,7 +219,7 @@ class ImageGenerationPipeline:
     
     def inpaint(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Inpaint masked regions of an image"""
-        self._ensure_models_loaded("sdxl")
+        self._ensure_models_loaded("inpaint")
         
         try:
             # Load input image and mask
@@ -130,30 +232,184 @@ class ImageGenerationPipeline:
             # Extract parameters
             prompt = params.get("prompt", "")
             strength = params.get("strength", 1.0)
+            steps = params.get("num_inference_steps", 50)
+            start = time.perf_counter()
+            
+            pipeline = self.inpaint_pipeline
+            height, width = pipeline.image_processor.get_default_height_width(
+                input_image, params.get("height"), params.get("width")
+            )
+            image_latents, cache_state = self._source_latents(pipeline, input_image, height, width)
+            cache_states = {"image": cache_state}
+            
+            # Only inpainting UNets (9 input channels) consume the masked-image latents
+            masked_image_latents = None
+            if pipeline.unet.config.in_channels == 9:
+                masked_image_latents, cache_states["masked_image"] = self._source_latents(
+                    pipeline, input_image, height, width, mask=mask_image
+                )
+            encoded = time.perf_counter()
+            
+            self.model_manager.set_token_merging(pipeline, params.get("token_merging_ratio"))
+            truncation = GuidanceTruncation.from_params(params, int(steps * strength))
             
             # Generate inpainted image
-            result = self.sdxl_pipeline(
+            result = self._run(
+                pipeline,
+                truncation,
                 prompt=prompt,
-                image=input_image,
+                image=image_latents,
                 mask_image=mask_image,
+                masked_image_latents=masked_image_latents,
+                height=height,
+                width=width,
                 strength=strength,
-                return_dict=True
+                num_inference_steps=steps,
+                generator=self._generator(params),
+                return_dict=True,
+                **self._output_kwargs(params)
             )
             
-            # Save image
-            image = result.images[0]
-            output_path = self._save_generated_image(image, "inpaint")
-            
-            return {
-                "success": True,
-                "image_path": str(output_path),
-                "parameters": params
-            }
+            timings = {"encode": encoded - start, "generate": time.perf_counter() - start}
+            return self._build_result(result.images, "inpaint", params, model=self._model_name(),
+                                      timings=timings, latent_cache=cache_states,
+                                      **self._truncation_info(truncation))
             
         except Exception as e:
             self.logger.error(f"Inpainting failed: {e}")
             return {"success": False, "error": str(e)}
     
+    def _source_latents(self, pipeline: Any, image: Image.Image, height: int, width: int,
+                        normalize: bool = False, mask: Optional[Image.Image] = None) -> Tuple[Any, str]:
+        """VAE latents of a source image, or of its unmasked part when a mask is given
+        
+        Returns (latents, cache state) where the state is "memory", "disk", "miss" or "disabled".
+        """
+        def encode():
+            pixels = pipeline.image_processor.preprocess(image, height=height, width=width)
+            if mask is not None:
+                mask_pixels = pipeline.mask_processor.preprocess(mask, height=height, width=width)
+                pixels = pixels * (mask_pixels < 0.5)
+            return encode_image(pipeline, pixels, normalize)
+        
+        if self.latent_cache is None:
+            return encode(), "disabled"
+        
+        # Registered VAEs have a content identity that stays valid across restarts
+        vae_identity = self.model_manager.component_identity(pipeline.vae)
+        parts = [image_digest(image), f"{width}x{height}", vae_identity or f"object:{id(pipeline.vae)}", normalize]
+        if mask is not None:
+            parts.append(image_digest(mask))
+        
+        key = LatentCache.make_key(*parts)
+        return self.latent_cache.get_or_encode(key, encode, persist=vae_identity is not None)
+    
+    def _refine_latents(self, latents: Any, params: Dict[str, Any], steps: int,
+                        denoising_end: float, num_images: int, generator: torch.Generator) -> Any:
+        """Finish the last (1 - denoising_end) of the schedule with the refiner, latent in latent out"""
+        self.model_manager.set_token_merging(self.refiner_pipeline, params.get("token_merging_ratio"))
+        truncation = GuidanceTruncation.from_params(params, steps - round(steps * denoising_end))
+        
+        return self._run(
+            self.refiner_pipeline,
+            truncation,
+            prompt=params.get("prompt", ""),
+            negative_prompt=params.get("negative_prompt", ""),
+            image=latents,
+            num_inference_steps=steps,
+            denoising_start=denoising_end,
+            guidance_scale=params.get("guidance_scale", 7.5),
+            num_images_per_prompt=num_images,
+            generator=generator,
+            return_dict=True,
+            **self._output_kwargs(params)
+        )
+    
+    def _progressive_plan(self, params: Dict[str, Any], width: int, height: int) -> Optional[Dict[str, Any]]:
+        """Resolutions and step split for progressive high-resolution generation, or None"""
+        settings = dict(self.config.get("generation.progressive", {}) or {})
+        requested = params.get("progressive")
+        if isinstance(requested, dict):
+            settings.update(requested)
+            enabled = True
+        elif requested is not None:
+            enabled = bool(requested)
+        else:
+            enabled = settings.get("enabled", False)
+        
+        base_size = settings.get("base_size", 1024)
+        if not enabled or width * height <= base_size * base_size:
+            return None
+        
+        # Keep the aspect ratio and bring the area down to about base_size^2
+        scale = base_size / math.sqrt(width * height)
+        num_stages = max(1, int(settings.get("stages", 1)))
+        
+        def snap(value: float) -> int:
+            return max(64, int(round(value / 64)) * 64)
+        
+        base = (snap(width * scale), snap(height * scale))
+        stages = [
+            (snap(base[0] * (width / base[0]) ** (i / num_stages)), snap(base[1] * (height / base[1]) ** (i / num_stages)))
+            for i in range(1, num_stages)
+        ] + [(width, height)]
+        
+        refine_steps = settings.get("refine_steps", 8)
+        if not isinstance(refine_steps, (list, tuple)):
+            refine_steps = [refine_steps] * num_stages
+        if len(refine_steps) != num_stages:
+            raise ValueError(f"progressive.refine_steps needs one entry per stage ({num_stages})")
+        
+        upscaler = settings.get("upscaler", "latent")
+        if upscaler not in ("latent", "pixel"):
+            raise ValueError(f"Unknown progressive upscaler '{upscaler}', expected 'latent' or 'pixel'")
+        
+        return {
+            "base": base,
+            "stages": stages,
+            "refine_steps": list(refine_steps),
+            "strength": settings.get("strength", 0.35),
+            "upscaler": upscaler
+        }
+    
+    def _progressive_upscale(self, images: Any, params: Dict[str, Any], plan: Dict[str, Any],
+                             generator: torch.Generator) -> Any:
+        """Upscale the base pass stage by stage, each followed by a short partial-strength denoise"""
+        self._ensure_models_loaded("img2img")
+        self.model_manager.set_token_merging(self.img2img_pipeline, params.get("token_merging_ratio"))
+        
+        strength = plan["strength"]
+        batch = len(images)
+        result = None
+        
+        for index, ((width, height), refine_steps) in enumerate(zip(plan["stages"], plan["refine_steps"])):
+            last = index == len(plan["stages"]) - 1
+            
+            if plan["upscaler"] == "latent":
+                images = F.interpolate(images, size=(height // 8, width // 8), mode="bicubic", align_corners=False)
+                stage_output = self._output_kwargs(params) if last else {"output_type": "latent"}
+            else:
+                images = [image.resize((width, height), Image.Resampling.LANCZOS) for image in images]
+                stage_output = self._output_kwargs(params) if last else {"output_type": "pil"}
+            
+            # img2img runs int(num_inference_steps * strength) steps; aim for refine_steps
+            result = self._run(
+                self.img2img_pipeline,
+                GuidanceTruncation.from_params(params, refine_steps),
+                prompt=[params.get("prompt", "")] * batch,
+                negative_prompt=[params.get("negative_prompt", "")] * batch,
+                image=images,
+                strength=strength,
+                num_inference_steps=math.ceil(refine_steps / strength),
+                guidance_scale=params.get("guidance_scale", 7.5),
+                generator=generator,
+                return_dict=True,
+                **stage_output
+            )
+            images = result.images
+        
+        return result
+    
     def controlnet_generate(self, params: Dict[str, Any]) -> Dict[str, Any]:
         """Generate image with ControlNet guidance"""
         self._ensure_models_loaded("controlnet")
@@ -169,13 +425,86 @@ class ImageGenerationPipeline:
         # Implementation for InstantID stylization
         pass
     
-    def _save_generated_image(self, image: Image.Image, prefix: str) -> Path:
-        """Save generated image with timestamp"""
-        from datetime import datetime
+    def _generator(self, params: Dict[str, Any]) -> torch.Generator:
+        """Request-local RNG; the global torch seed is shared by every thread
+        
+        A seed is drawn when none is given and recorded in params, so every
+        output can be reproduced. CPU generators give the same noise on any device.
+        """
+        if params.get("seed") is None:
+            params["seed"] = secrets.randbits(32)
+        return torch.Generator("cpu").manual_seed(int(params["seed"]))
+    
+    def _run(self, pipeline: Any, truncation: Optional[GuidanceTruncation], **kwargs) -> Any:
+        """Call a diffusers pipeline, wiring in guidance truncation when requested"""
+        if truncation is None:
+            return pipeline(**kwargs)
+        
+        truncation.attach(pipeline)
+        try:
+            return pipeline(**kwargs, **truncation.call_kwargs(pipeline))
+        finally:
+            truncation.detach()
+    
+    def _truncation_info(self, truncation: Optional[GuidanceTruncation]) -> Dict[str, Any]:
+        """Report at which step classifier-free guidance was dropped"""
+        if truncation is None:
+            return {}
+        return {"cfg_truncated_at_step": truncation.truncated_at}
+    
+    def _output_kwargs(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Pipeline output options for the requested return mode"""
+        mode = params.get("return_mode", "path")
+        if mode not in RETURN_MODES:
+            raise ValueError(f"Unknown return_mode '{mode}', expected one of {RETURN_MODES}")
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{prefix}_{timestamp}.png"
-        output_path = Path(self.config.get("output_dir", "data/outputs")) / filename
+        # Raw modes skip the PIL conversion and quantise the decoded tensor directly
+        return {} if mode == "path" else {"output_type": "pt"}
+    
+    def _build_result(self, images: Any, prefix: str, params: Dict[str, Any],
+                      model: Optional[str] = None, timings: Optional[Dict[str, float]] = None,
+                      **extra) -> Dict[str, Any]:
+        """Hand back a generation result as a saved file, a numpy array or a shared memory block"""
+        mode = params.get("return_mode", "path")
+        if mode != "path":
+            images = tensor_to_uint8(images)
+        
+        record = {"model": model, "timings": timings or {}}
+        outputs = [self._hand_off(image, prefix, params, mode, record) for image in images]
+        
+        self.logger.info(f"{prefix} produced {len(outputs)} image(s)", extra={"stage": prefix, "timings": record["timings"]})
+        
+        # The first image keeps the single-image keys; batches also list every output
+        result = {"success": True, **outputs[0], "parameters": params, "timings": record["timings"], **extra}
+        if len(outputs) > 1:
+            result["batch"] = outputs
+        return result
+    
+    def _hand_off(self, image: Any, prefix: str, params: Dict[str, Any], mode: str,
+                  record: Dict[str, Any]) -> Dict[str, Any]:
+        """Save and/or expose a single output image according to the return mode"""
+        if mode == "path":
+            return self._save_generated_image(image, prefix, params, **record)
+        
+        output = {}
+        if params.get("save_output", True):
+            output.update(self._save_generated_image(Image.fromarray(image), prefix, params, **record))
         
-        save_image(image, output_path)
-        return output_path
\ No newline at end of file
+        if mode == "array":
+            output["image"] = image
+        else:
+            output["shared_memory"] = self.shared_images.publish(image)
+        return output
+    
+    def _model_name(self, stage: Optional[str] = None) -> str:
+        """Model identifier recorded with saved outputs"""
+        name = self.config.get("models.sdxl_model", "stabilityai/stable-diffusion-xl-base-1.0")
+        if stage == "sdxl_refiner":
+            name += "+" + self.config.get("models.sdxl_refiner", "stabilityai/stable-diffusion-xl-refiner-1.0")
+        return name
+    
+    def _save_generated_image(self, image: Image.Image, prefix: str, params: Dict[str, Any],
+                              model: Optional[str] = None, timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """Save generated image through the indexed output store"""
+        output_id, output_path = self.output_store.save(image, prefix, params, model=model, timings=timings)
+        return {"output_id": output_id, "image_path": str(output_path)}
\ No newline at end of file
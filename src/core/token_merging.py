@@ -0,0 +1,101 @@
+"""
+Token Merging - Merges redundant UNet tokens before attention and unmerges them after
+"""
+
+from typing import Any, Dict
+
+from ..utils.logger import get_logger
+
+try:
+    import tomesd
+except ImportError:  # Optional dependency
+    tomesd = None
+
+logger = get_logger(__name__)
+
+class TokenMerging:
+    """Applies and removes token merging patches on loaded pipelines in place"""
+    
+    def __init__(self, max_downsample: int = 2, sx: int = 2, sy: int = 2, use_rand: bool = False):
+        self.max_downsample = max_downsample
+        self.sx = sx
+        self.sy = sy
+        self.use_rand = use_rand
+        
+        # Ratio currently patched into each UNet; pipelines derived from the same
+        # components share a UNet and therefore its patch
+        self._applied: Dict[int, float] = {}
+    
+    @property
+    def available(self) -> bool:
+        """Whether the tomesd backend is installed"""
+        return tomesd is not None
+    
+    @staticmethod
+    def _key(pipeline: Any) -> int:
+        return id(getattr(pipeline, "unet", pipeline))
+    
+    @staticmethod
+    def merging_blocks(pipeline: Any, max_downsample: int) -> int:
+        """Transformer blocks of a UNet that run at or below ``max_downsample``
+        
+        tomesd only merges tokens in these. SDXL has no attention at full
+        resolution, so it needs a max_downsample of at least 2.
+        """
+        unet = getattr(pipeline, "unet", pipeline)
+        levels = len(unet.down_blocks)
+        stages = [(2 ** index, block) for index, block in enumerate(unet.down_blocks)]
+        stages.append((2 ** (levels - 1), unet.mid_block))
+        stages += [(2 ** (levels - 1 - index), block) for index, block in enumerate(unet.up_blocks)]
+        return sum(
+            1
+            for downsample, block in stages if block is not None and downsample <= max_downsample
+            for module in block.modules() if hasattr(module, "attn1")
+        )
+    
+    def current_ratio(self, pipeline: Any) -> float:
+        """Get the merge ratio currently applied to a pipeline"""
+        return self._applied.get(self._key(pipeline), 0.0)
+    
+    def apply(self, pipeline: Any, ratio: float) -> float:
+        """Set the merge ratio for a pipeline, patching or unpatching as needed
+        
+        Returns the ratio that is actually in effect afterwards.
+        """
+        ratio = max(0.0, min(float(ratio or 0.0), 0.9))
+        
+        if ratio == self.current_ratio(pipeline):
+            return ratio
+        
+        if ratio == 0.0:
+            self.remove(pipeline)
+            return 0.0
+        
+        if not self.available:
+            logger.warning("Token merging requested but tomesd is not installed; running without it")
+            return 0.0
+        
+        # apply_patch removes any previous patch before re-patching
+        tomesd.apply_patch(
+            pipeline,
+            ratio=ratio,
+            max_downsample=self.max_downsample,
+            sx=self.sx,
+            sy=self.sy,
+            use_rand=self.use_rand
+        )
+        self._applied[self._key(pipeline)] = ratio
+        if not self.merging_blocks(pipeline, self.max_downsample):
+            logger.warning(f"Token merging max_downsample {self.max_downsample} reaches no attention block; it will have no effect")
+        logger.debug(f"Token merging enabled with ratio {ratio}")
+        return ratio
+    
+    def remove(self, pipeline: Any):
+        """Remove token merging from a pipeline, restoring the original attention blocks"""
+        if self._key(pipeline) not in self._applied:
+            return
+        
+        if self.available:
+            tomesd.remove_patch(pipeline)
+        del self._applied[self._key(pipeline)]
+        logger.debug("Token merging disabled")
\ No newline at end of file
@@ -10,7 +10,8 @@ from pathlib import Path
 
 from core.app import ImgGenApp
 from ui.interface import launch_interface
-from utils.logger import setup_logger
+from utils.config import Config
+from utils.logger import setup_logger_from_config
 
 def main():
     parser = argparse.ArgumentParser(description="ImgGen AI - Image Generation System")
@@ -23,13 +24,13 @@ def main():
     
     args = parser.parse_args()
     
-    # Setup logging
-    log_level = "DEBUG" if args.verbose else "INFO"
-    logger = setup_logger(level=log_level)
+    # Setup logging from the config's logging section
+    log_level = "DEBUG" if args.verbose else None
+    logger = setup_logger_from_config(Config(args.config), level=log_level)
     
     try:
         # Initialize the application
-        app = ImgGenApp(config_path=args.config)
+        app = ImgGenApp(config_path=args.config, log_level=log_level)
         
         if args.mode == "ui":
             logger.info("Launching ComfyUI interface...")
@@ -0,0 +1,189 @@
+"""
+REST API for ImgGen AI
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from ..core.admission import AdmissionController
+from ..utils.logger import get_logger, request_scope
+
+class GenerateRequest(BaseModel):
+    prompt: str
+    negative_prompt: str = ""
+    width: int = 1024
+    height: int = 1024
+    steps: int = 20
+    guidance_scale: float = 7.5
+    seed: Optional[int] = None
+    options: Dict[str, Any] = {}
+
+class TransformRequest(BaseModel):
+    image_path: str
+    prompt: str
+    strength: float = 0.8
+    options: Dict[str, Any] = {}
+
+class InpaintRequest(BaseModel):
+    image_path: str
+    mask_path: str
+    prompt: str
+    options: Dict[str, Any] = {}
+
+def _json_safe(value: Any) -> Any:
+    """Drop in-process-only values (raw arrays) from a result before serialising it"""
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items() if not isinstance(item, np.ndarray)}
+    if isinstance(value, list):
+        return [_json_safe(item) for item in value if not isinstance(item, np.ndarray)]
+    return value
+
+def _image_size(path: str) -> Optional[Tuple[int, int]]:
+    """Size of a source image from its header, for costing img2img/inpaint requests"""
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except (OSError, ValueError):
+        return None
+
+def _in_request_scope(request_id: str, handler, *args, **kwargs):
+    """Run a handler on a worker thread with the request id set for its log records"""
+    with request_scope(request_id):
+        return handler(*args, **kwargs)
+
+def create_api_app(imggen_app) -> FastAPI:
+    """Create the FastAPI application around an ImgGenApp instance"""
+    logger = get_logger(__name__)
+    config = imggen_app.config
+    admission = AdmissionController(config)
+    config.subscribe(("api.max_request_size", "api.rate_limit", "api.api_keys"), lambda changes: admission.configure(config), "admission")
+    
+    api = FastAPI(title="ImgGen AI")
+    
+    if config.get("api.enable_cors", False):
+        api.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+    
+    @api.middleware("http")
+    async def limit_request_size(request: Request, call_next):
+        # Reject oversized bodies from the declared length, before anything is read or decoded
+        if request.method in ("POST", "PUT", "PATCH"):
+            length = request.headers.get("content-length")
+            if length is None:
+                return JSONResponse({"detail": "Content-Length required"}, status_code=411)
+            if not length.isdigit():
+                return JSONResponse({"detail": "Invalid Content-Length"}, status_code=400)
+            if not admission.check_size(int(length)):
+                return JSONResponse({"detail": "Request body too large"}, status_code=413)
+        return await call_next(request)
+    
+    async def run_admitted(request: Request, kind: str, handler, options: Dict[str, Any], **fields) -> Dict[str, Any]:
+        # Options may not shadow the request's own fields; the handler would get them twice
+        reserved = sorted(options.keys() & fields.keys())
+        if reserved:
+            raise HTTPException(status_code=400, detail=f"Reserved keys in options: {', '.join(reserved)}")
+        
+        # Cost the same merged arguments the handler receives
+        kwargs = {**fields, **options}
+        params = dict(kwargs)
+        if "image_path" in kwargs:
+            params["source_size"] = await run_in_threadpool(_image_size, kwargs["image_path"])
+        client_id = admission.client_id(request.headers.get("x-api-key"), request.client.host if request.client else None)
+        
+        with request_scope(request.headers.get("x-request-id")) as request_id:
+            decision = admission.admit(client_id, kind, params)
+            if not decision.admitted:
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"Rate limit exceeded (request cost {decision.cost:.2f})",
+                    headers={"Retry-After": str(max(1, round(decision.retry_after))), "X-Request-ID": request_id}
+                )
+            
+            result = await run_in_threadpool(_in_request_scope, request_id, handler, **kwargs)
+            if result.get("success"):
+                # The pipeline's own timing excludes time spent queued behind other requests
+                seconds = result.get("timings", {}).get("generate")
+                if seconds:
+                    admission.record(kind, params, seconds)
+            else:
+                logger.warning(f"Request failed: {result.get('error')}")
+        
+        return {**_json_safe(result), "cost": decision.cost, "request_id": request_id}
+    
+    @api.get("/health")
+    async def health():
+        return {"status": "ok"}
+    
+    @api.get("/models")
+    async def models():
+        return imggen_app.model_manager.get_model_info()
+    
+    @api.get("/metrics")
+    async def metrics():
+        return await run_in_threadpool(imggen_app.get_metrics)
+    
+    @api.get("/config/reloads")
+    async def config_reloads():
+        return imggen_app.get_reload_events()
+    
+    @api.get("/outputs")
+    async def outputs(prompt: Optional[str] = None,
+                      since: Optional[datetime] = None,
+                      until: Optional[datetime] = None,
+                      seed: Optional[int] = None,
+                      model: Optional[str] = None,
+                      kind: Optional[str] = None,
+                      limit: int = 50,
+                      cursor: Optional[str] = None):
+        return await run_in_threadpool(
+            imggen_app.search_outputs,
+            prompt=prompt, since=since, until=until, seed=seed, model=model, kind=kind,
+            limit=min(max(limit, 1), 500), cursor=cursor
+        )
+    
+    @api.delete("/shared/{name}")
+    async def release_shared(name: str):
+        # Shared memory results stay allocated until their consumer releases them
+        if not await run_in_threadpool(imggen_app.release_shared_image, name):
+            raise HTTPException(status_code=404, detail=f"Unknown shared memory block '{name}'")
+        return {"released": name}
+    
+    @api.post("/generate")
+    async def generate(body: GenerateRequest, request: Request):
+        return await run_admitted(
+            request, "txt2img", imggen_app.generate_image, body.options,
+            prompt=body.prompt,
+            negative_prompt=body.negative_prompt,
+            width=body.width,
+            height=body.height,
+            steps=body.steps,
+            guidance_scale=body.guidance_scale,
+            seed=body.seed
+        )
+    
+    @api.post("/transform")
+    async def transform(body: TransformRequest, request: Request):
+        return await run_admitted(
+            request, "img2img", imggen_app.transform_image, body.options,
+            image_path=body.image_path,
+            prompt=body.prompt,
+            strength=body.strength
+        )
+    
+    @api.post("/inpaint")
+    async def inpaint(body: InpaintRequest, request: Request):
+        return await run_admitted(
+            request, "inpaint", imggen_app.inpaint_image, body.options,
+            image_path=body.image_path,
+            mask_path=body.mask_path,
+            prompt=body.prompt
+        )
+    
+    return api
\ No newline at end of file
@@ -1,10 +1,141 @@
 """
 Configuration Management
+Supports hot reload: edits are validated against a schema, diffed, and each changed
+key is handed to the components that subscribed to it
 """
 
+import threading
+import time
 import yaml
+from collections import deque
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+from .logger import get_logger
+
+# diffusers schedulers that can drive the SDXL pipelines
+SCHEDULERS = (
+    "DDIMScheduler",
+    "DDPMScheduler",
+    "DEISMultistepScheduler",
+    "DPMSolverMultistepScheduler",
+    "DPMSolverSinglestepScheduler",
+    "EulerAncestralDiscreteScheduler",
+    "EulerDiscreteScheduler",
+    "HeunDiscreteScheduler",
+    "KDPM2AncestralDiscreteScheduler",
+    "KDPM2DiscreteScheduler",
+    "LCMScheduler",
+    "LMSDiscreteScheduler",
+    "PNDMScheduler",
+    "TCDScheduler",
+    "UniPCMultistepScheduler"
+)
+
+# Known keys: dotted key -> (accepted types, allowed values or None). Unknown keys pass through.
+CONFIG_SCHEMA = {
+    "model_dir": (str, None),
+    "output_dir": (str, None),
+    "cache_dir": (str, None),
+    "temp_dir": (str, None),
+    "outputs.index_path": (str, None),
+    "outputs.thumbnail_size": (int, None),
+    "outputs.retention.max_age_days": ((int, float), None),
+    "outputs.retention.max_count": (int, None),
+    "latent_cache.enabled": (bool, None),
+    "latent_cache.max_memory_mb": (int, None),
+    "latent_cache.disk": (bool, None),
+    "latent_cache.max_disk_mb": (int, None),
+    "generation.default_width": (int, None),
+    "generation.default_height": (int, None),
+    "generation.default_steps": (int, None),
+    "generation.default_guidance_scale": ((int, float), None),
+    "generation.max_width": (int, None),
+    "generation.max_height": (int, None),
+    "generation.max_steps": (int, None),
+    "generation.default_scheduler": (str, SCHEDULERS),
+    "generation.use_refiner": (bool, None),
+    "generation.refiner_denoising_end": ((int, float), None),
+    "generation.progressive.enabled": (bool, None),
+    "generation.progressive.upscaler": (str, ("latent", "pixel")),
+    "models.sdxl_model": (str, None),
+    "models.sdxl_refiner": (str, None),
+    "models.controlnet_models": (dict, None),
+    "performance.memory_strategy": (str, ("auto", "manual")),
+    "performance.enable_xformers": (bool, None),
+    "performance.enable_cpu_offload": (bool, None),
+    "performance.enable_sequential_cpu_offload": (bool, None),
+    "performance.enable_attention_slicing": (bool, None),
+    "performance.enable_vae_slicing": (bool, None),
+    "performance.use_fp16": (bool, None),
+    "performance.batch_size": (int, None),
+    "performance.token_merging_ratio": ((int, float), None),
+    "performance.token_merging_max_downsample": (int, (1, 2, 4, 8)),
+    "performance.leak_window": (int, None),
+    "execution.concurrent_workers": (int, None),
+    "execution.threads_per_worker": (int, None),
+    "logging.level": (str, ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")),
+    "logging.file": (str, None),
+    "logging.backup_count": (int, None),
+    "logging.format": (str, ("text", "json")),
+    "logging.console": (bool, None),
+    "api.enable_cors": (bool, None),
+    "api.rate_limit": (str, None),
+    "api.api_keys": (list, None),
+    "api.max_request_size": ((str, int), None),
+    "reload.enabled": (bool, None),
+    "reload.interval": ((int, float), None)
+}
+
+class ConfigError(ValueError):
+    """Raised when a configuration file fails to parse or validate"""
+
+def _flatten(data: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """Leaf values keyed by dotted path; lists count as leaves"""
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            flat.update(_flatten(value, f"{path}."))
+        else:
+            flat[path] = value
+    return flat
+
+def validate_config(data: Any) -> List[str]:
+    """Schema violations in a parsed configuration; empty when valid"""
+    if not isinstance(data, dict):
+        return ["configuration must be a mapping"]
+    
+    errors = []
+    for key, (types, allowed) in CONFIG_SCHEMA.items():
+        value = _lookup(data, key)
+        if value is None:
+            continue
+        # bool is an int subclass; a flag where a number belongs is still a mistake
+        if not isinstance(value, types) or (isinstance(value, bool) and types is not bool):
+            expected = types.__name__ if isinstance(types, type) else "/".join(t.__name__ for t in types)
+            errors.append(f"{key}: expected {expected}, got {type(value).__name__}")
+        elif allowed is not None and value not in allowed:
+            errors.append(f"{key}: {value!r} is not one of {allowed}")
+    return errors
+
+def diff_config(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Tuple[Any, Any]]:
+    """Changed leaf keys mapped to (old value, new value)"""
+    old_flat, new_flat = _flatten(old or {}), _flatten(new or {})
+    return {
+        key: (old_flat.get(key), new_flat.get(key))
+        for key in sorted(old_flat.keys() | new_flat.keys())
+        if old_flat.get(key) != new_flat.get(key)
+    }
+
+def _lookup(data: Dict[str, Any], key: str) -> Any:
+    value = data
+    for k in key.split('.'):
+        if isinstance(value, dict) and k in value:
+            value = value[k]
+        else:
+            return None
+    return value
 
 class Config:
     """Configuration manager for ImgGen AI"""
@@ -12,6 +143,12 @@ class Config:
     def __init__(self, config_path: str = "config/default.yaml"):
         self.config_path = Path(config_path)
         self.config_data = self._load_config()
+        self.logger = get_logger(__name__)
+        
+        # (key prefixes, callback, owner name) in subscription order
+        self._subscribers: List[Tuple[Tuple[str, ...], Callable, str]] = []
+        self._reload_lock = threading.Lock()
+        self.reload_events = deque(maxlen=50)
     
     def _load_config(self) -> Dict[str, Any]:
         """Load configuration from YAML file"""
@@ -95,4 +232,128 @@ class Config:
         save_path.parent.mkdir(parents=True, exist_ok=True)
         
         with open(save_path, 'w') as f:
-            yaml.dump(self.config_data, f, default_flow_style=False, indent=2)
\ No newline at end of file
+            yaml.dump(self.config_data, f, default_flow_style=False, indent=2)
+    
+    def subscribe(self, prefixes, callback: Callable[[Dict[str, Tuple[Any, Any]]], None], owner: str):
+        """Call ``callback(changes)`` on reload when any key under one of ``prefixes`` changed"""
+        if isinstance(prefixes, str):
+            prefixes = (prefixes,)
+        self._subscribers.append((tuple(prefixes), callback, owner))
+    
+    def reload(self) -> Dict[str, Any]:
+        """Re-read the file, validate it and hand each change to its owners
+        
+        An invalid file leaves the running configuration untouched, and so does a
+        change an owner fails to apply: the previous values are restored and the
+        owners that already ran are handed the reverse change. Returns the reload
+        event, which is also kept in ``reload_events``.
+        """
+        with self._reload_lock:
+            event = {"time": time.time(), "changed": [], "applied": {}, "errors": []}
+            start = time.perf_counter()
+            
+            try:
+                with open(self.config_path, 'r') as f:
+                    data = yaml.safe_load(f)
+            except Exception as e:
+                data = None
+                event["errors"].append(f"parse: {e}")
+            
+            if data is not None:
+                event["errors"].extend(validate_config(data))
+            elif not event["errors"]:
+                event["errors"].append("configuration is empty")
+            
+            if event["errors"]:
+                self.logger.error(f"Config reload rejected: {'; '.join(event['errors'])}")
+            else:
+                changes = diff_config(self.config_data, data)
+                event["changed"] = list(changes)
+                previous, self.config_data = self.config_data, data
+                called, failed = self._dispatch(changes, event)
+                if failed:
+                    self.config_data = previous
+                    reverse = {key: (new, old) for key, (old, new) in changes.items()}
+                    self._dispatch(reverse, event, only=called, label="rollback ")
+                    event["rolled_back"] = True
+                    self.logger.error("Config reload rolled back to the previous configuration")
+            
+            event["seconds"] = time.perf_counter() - start
+            self.reload_events.append(event)
+            if event["changed"]:
+                applied = ", ".join(f"{owner} {seconds:.2f}s" for owner, seconds in event["applied"].items())
+                self.logger.info(f"Config reloaded: {len(event['changed'])} keys changed, "
+                                 f"applied by {applied or 'no component'} in {event['seconds']:.2f}s")
+            return event
+    
+    def _dispatch(self, changes: Dict[str, Tuple[Any, Any]], event: Dict[str, Any],
+                  only: Optional[List[int]] = None, label: str = "") -> Tuple[List[int], bool]:
+        """Hand each subscriber its share of the changes, in subscription order
+        
+        Stops at the first failing subscriber. Returns the indices of the
+        subscribers that were called, including a failed one, and whether one failed.
+        """
+        called = []
+        for index, (prefixes, callback, owner) in enumerate(self._subscribers):
+            if only is not None and index not in only:
+                continue
+            owned = {
+                key: change for key, change in changes.items()
+                if any(key == prefix or key.startswith(prefix + ".") for prefix in prefixes)
+            }
+            if not owned:
+                continue
+            
+            called.append(index)
+            start = time.perf_counter()
+            try:
+                callback(owned)
+            except Exception as e:
+                event["errors"].append(f"{label}{owner}: {e}")
+                self.logger.error(f"Applying config {label}change in {owner} failed: {e}")
+                if only is None:
+                    return called, True
+            finally:
+                event["applied"][owner] = event["applied"].get(owner, 0.0) + time.perf_counter() - start
+        return called, False
+
+class ConfigWatcher:
+    """Background thread that reloads a Config whenever its file changes on disk
+    
+    ``reload`` replaces ``config.reload`` so the owner can apply changes at a safe
+    point, e.g. between requests.
+    """
+    
+    def __init__(self, config: Config, interval: float = 2.0, reload: Optional[Callable[[], Any]] = None):
+        self.config = config
+        self.interval = interval
+        self.reload = reload or config.reload
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stamp = self._file_stamp()
+    
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = self.config.config_path.stat()
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+    
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            stamp = self._file_stamp()
+            if stamp is None or stamp == self._stamp:
+                continue
+            self._stamp = stamp
+            self.reload()
\ No newline at end of file
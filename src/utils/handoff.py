@@ -0,0 +1,105 @@
+"""
+Zero-copy result hand-off
+Exposes generated images as raw uint8 arrays, in-process or through named shared memory
+"""
+
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import torch
+
+RETURN_MODES = ("path", "array", "shared_memory")
+
+def tensor_to_uint8(images: torch.Tensor) -> np.ndarray:
+    """Convert a decoded NCHW float batch in [0, 1] to an NHWC uint8 numpy view
+    
+    The only copy is the unavoidable float -> uint8 quantisation; the returned
+    array shares memory with the quantised CPU tensor.
+    """
+    quantised = images.mul(255).round_().clamp_(0, 255).to(torch.uint8)
+    return quantised.permute(0, 2, 3, 1).contiguous().cpu().numpy()
+
+def attach_shared_image(descriptor: Dict[str, Any]) -> Tuple[np.ndarray, SharedMemory]:
+    """Map a published image from another process without copying it
+    
+    Keep the returned SharedMemory object alive for as long as the array is used,
+    then call ``close()`` on it. The producer owns the block and unlinks it.
+    """
+    shm = SharedMemory(name=descriptor["name"])
+    
+    # Only the producer should unlink the block when this process exits
+    resource_tracker.unregister(shm._name, "shared_memory")
+    
+    array = np.ndarray(tuple(descriptor["shape"]), dtype=np.dtype(descriptor["dtype"]), buffer=shm.buf)
+    return array, shm
+
+class SharedImageRegistry:
+    """Publishes images into named shared memory blocks and owns their lifetime"""
+    
+    def __init__(self):
+        self._blocks: Dict[str, SharedMemory] = {}
+        self._lock = threading.Lock()
+    
+    def publish(self, array: np.ndarray) -> Dict[str, Any]:
+        """Copy an array into a new shared memory block and return its descriptor"""
+        shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+        view[...] = array
+        
+        with self._lock:
+            self._blocks[shm.name] = shm
+        
+        return {
+            "name": shm.name,
+            "shape": list(array.shape),
+            "dtype": array.dtype.str,
+            "nbytes": array.nbytes
+        }
+    
+    def release(self, name: str) -> bool:
+        """Close and unlink a published block once consumers are done with it"""
+        with self._lock:
+            shm = self._blocks.pop(name, None)
+        
+        if shm is None:
+            return False
+        
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            # Already gone, e.g. cleaned up after a crashed producer; still ours to forget
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return True
+    
+    def disown(self, name: str) -> bool:
+        """Stop owning a block without unlinking it; another process adopts and releases it"""
+        with self._lock:
+            shm = self._blocks.pop(name, None)
+        
+        if shm is None:
+            return False
+        
+        # Otherwise this process's resource tracker unlinks the block when it exits
+        resource_tracker.unregister(shm._name, "shared_memory")
+        shm.close()
+        return True
+    
+    def adopt(self, name: str):
+        """Take ownership of a block another process published and disowned"""
+        shm = SharedMemory(name=name)
+        with self._lock:
+            self._blocks[shm.name] = shm
+    
+    def release_all(self):
+        """Release every block still owned by this registry"""
+        with self._lock:
+            names = list(self._blocks)
+        for name in names:
+            self.release(name)
+    
+    def __len__(self) -> int:
+        return len(self._blocks)
\ No newline at end of file
@@ -1,43 +1,194 @@
 """
 Logging utilities
+Log calls only enqueue the record; a background listener thread does the formatting
+and all console/file I/O, with size-based rotation and an optional JSON line format
 """
 
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
+import queue
 import sys
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Iterator, Optional
 
-def setup_logger(name: str = "imggen", level: str = "INFO", log_file: Optional[str] = None) -> logging.Logger:
-    """Setup logger with console and file handlers"""
+from .sizes import parse_size
+
+# Extra fields carried into JSON lines when passed via ``extra=``
+STRUCTURED_FIELDS = ("request_id", "timings", "stage")
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_listeners: Dict[str, logging.handlers.QueueListener] = {}
+
+@contextmanager
+def request_scope(request_id: Optional[str] = None) -> Iterator[str]:
+    """Tag every log record emitted in this context with a request id"""
+    request_id = request_id or uuid.uuid4().hex[:12]
+    token = _request_id.set(request_id)
+    try:
+        yield request_id
+    finally:
+        _request_id.reset(token)
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+class RequestContextFilter(logging.Filter):
+    """Stamps the request id on records in the emitting thread, before they are queued"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = _request_id.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that defers all formatting to the listener thread
+    
+    The stock handler formats the message before enqueueing so records can be
+    pickled; an in-process queue does not need that, so the emitting thread
+    only pays for the filter and the put.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class _RelayHandler(logging.Handler):
+    """Hands records forwarded from another process to the local logger of the same name"""
+    
+    def emit(self, record: logging.LogRecord):
+        logger = logging.getLogger(record.name)
+        if logger.isEnabledFor(record.levelno):
+            logger.handle(record)
+
+def start_log_relay(log_queue) -> logging.handlers.QueueListener:
+    """Drain records that child processes put on ``log_queue`` into this process's handlers"""
+    listener = logging.handlers.QueueListener(log_queue, _RelayHandler())
+    listener.start()
+    return listener
+
+def forward_logs(log_queue, name: str = "imggen") -> logging.Logger:
+    """Send this (forked) process's records to the parent's relay instead of its own handlers
+    
+    The inherited handlers would write to the parent's files without coordinating
+    rotation, and the inherited listener thread does not exist after fork. The
+    stock queue handler formats each record so it can be pickled.
+    """
+    logger = logging.getLogger(name)
+    logger.handlers.clear()
+    _listeners.clear()
+    
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+    logger.addHandler(handler)
+    return logger
+
+def setup_logger(name: str = "imggen",
+                 level: str = "INFO",
+                 log_file: Optional[str] = None,
+                 max_file_size=None,
+                 backup_count: int = 5,
+                 json_format: bool = False,
+                 console: bool = True) -> logging.Logger:
+    """Setup logger with console and rotating file handlers behind a queue listener"""
     
     logger = logging.getLogger(name)
     logger.setLevel(getattr(logging, level.upper()))
     
-    # Clear existing handlers
+    # Clear existing handlers and stop the previous listener, flushing what it holds
     logger.handlers.clear()
+    previous = _listeners.pop(name, None)
+    if previous is not None:
+        _stop_listener(previous)
     
     # Create formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
+    
+    handlers = []
     
     # Console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
     
-    # File handler
+    # File handler, rotated by size when a limit is configured
     if log_file:
         log_path = Path(log_file)
         log_path.parent.mkdir(parents=True, exist_ok=True)
         
-        file_handler = logging.FileHandler(log_path)
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_path,
+            maxBytes=parse_size(max_file_size) if max_file_size else 0,
+            backupCount=backup_count if max_file_size else 0,
+            encoding="utf-8"
+        )
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    logger.addHandler(queue_handler)
+    
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners[name] = listener
     
     return logger
 
+def setup_logger_from_config(config, name: str = "imggen", level: Optional[str] = None) -> logging.Logger:
+    """Setup logger from the ``logging`` section of the configuration"""
+    return setup_logger(
+        name,
+        level=level or config.get("logging.level", "INFO"),
+        log_file=config.get("logging.file"),
+        max_file_size=config.get("logging.max_file_size"),
+        backup_count=config.get("logging.backup_count", 5),
+        json_format=config.get("logging.format", "text") == "json",
+        console=config.get("logging.console", True)
+    )
+
+def _stop_listener(listener: logging.handlers.QueueListener):
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+@atexit.register
+def shutdown_logging():
+    """Drain queued records and close the handlers"""
+    while _listeners:
+        _, listener = _listeners.popitem()
+        _stop_listener(listener)
+
 def get_logger(name: str) -> logging.Logger:
     """Get logger instance"""
     return logging.getLogger(f"imggen.{name}")
\ No newline at end of file
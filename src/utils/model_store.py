@@ -0,0 +1,214 @@
+"""
+Content-addressed model store
+Identical weight files under model_dir are stored once in model_dir/.store and hard-linked
+(or symlinked across filesystems) into every model directory that uses them
+"""
+
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from .logger import get_logger
+
+STORE_DIRNAME = ".store"
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Files that are never deduplicated
+SKIP_SUFFIXES = (".part", ".lock")
+SKIP_NAMES = ("manifest.json",)
+
+def sha256_file(path: Path) -> str:
+    """Stream a file through sha256"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class ModelStore:
+    """Deduplicates files under a model directory by content hash"""
+    
+    def __init__(self, model_dir: Path, min_size: int = 64 * 1024):
+        self.model_dir = Path(model_dir).resolve()
+        self.blob_dir = self.model_dir / STORE_DIRNAME / "sha256"
+        self.min_size = min_size
+        self.logger = get_logger(__name__)
+        
+        # (st_dev, st_ino) of every blob -> digest, built lazily
+        self._inodes: Optional[Dict[Tuple[int, int], str]] = None
+    
+    def blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / digest
+    
+    def _blobs(self) -> Iterator[Path]:
+        if self.blob_dir.exists():
+            yield from (p for p in self.blob_dir.glob("*/*") if p.is_file())
+    
+    def _model_files(self) -> Iterator[Path]:
+        """Every file in the model directories, excluding the store itself"""
+        for root, dirs, files in os.walk(self.model_dir):
+            dirs[:] = [d for d in dirs if d != STORE_DIRNAME]
+            for name in files:
+                if name.endswith(SKIP_SUFFIXES) or name in SKIP_NAMES:
+                    continue
+                yield Path(root) / name
+    
+    def _inode_index(self) -> Dict[Tuple[int, int], str]:
+        if self._inodes is None:
+            self._inodes = {}
+            for blob in self._blobs():
+                st = blob.stat()
+                self._inodes[(st.st_dev, st.st_ino)] = blob.name
+        return self._inodes
+    
+    def digest_of(self, path: Path, compute: bool = False) -> Optional[str]:
+        """Content digest of a file if it is already in the store (or computed on request)"""
+        path = Path(path)
+        if path.is_symlink():
+            target = path.resolve()
+            if self.blob_dir in target.parents:
+                return target.name
+        
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            return None
+        
+        digest = self._inode_index().get((st.st_dev, st.st_ino))
+        if digest is None and compute:
+            digest = sha256_file(path)
+        return digest
+    
+    def identity(self, paths: Iterable[Path]) -> Optional[str]:
+        """Stable identity of a set of weight files; equal content gives equal identity
+        
+        Falls back to inode identity for files that have not been ingested, so two
+        paths only compare equal when they really are the same file.
+        """
+        parts = []
+        for path in sorted(Path(p) for p in paths):
+            digest = self.digest_of(path)
+            if digest is None:
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    return None
+                digest = f"inode:{st.st_dev}:{st.st_ino}"
+            parts.append(digest)
+        
+        if not parts:
+            return None
+        return parts[0] if len(parts) == 1 else hashlib.sha256("|".join(parts).encode()).hexdigest()
+    
+    def ingest(self) -> Dict[str, int]:
+        """Move every model file into the store and link it back in place"""
+        stats = {"files": 0, "linked": 0, "new_blobs": 0, "bytes_saved": 0}
+        
+        for path in self._model_files():
+            if path.is_symlink() or path.stat().st_size < self.min_size:
+                continue
+            stats["files"] += 1
+            
+            if self.digest_of(path) is not None:
+                continue  # Already linked to a blob
+            
+            digest = sha256_file(path)
+            blob = self.blob_path(digest)
+            size = path.stat().st_size
+            
+            if blob.exists():
+                self._replace_with_link(path, blob)
+                stats["linked"] += 1
+                stats["bytes_saved"] += size
+            else:
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.link(path, blob)
+                except OSError:
+                    # Different filesystem, where os.replace fails too: copy the data into the
+                    # store under a temporary name, then swap the file for a symlink
+                    tmp = blob.with_name(blob.name + ".part")
+                    shutil.copyfile(path, tmp)
+                    os.replace(tmp, blob)
+                    self._replace_with_link(path, blob)
+                stats["new_blobs"] += 1
+            
+            st = blob.stat()
+            self._inode_index()[(st.st_dev, st.st_ino)] = digest
+        
+        self.logger.info(f"Ingested {stats['files']} files: {stats['new_blobs']} new blobs, "
+                         f"{stats['linked']} deduplicated ({stats['bytes_saved'] / 1024 ** 3:.2f}GB saved)")
+        return stats
+    
+    def _replace_with_link(self, path: Path, blob: Path):
+        tmp = path.with_name(path.name + ".dedup")
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            tmp.symlink_to(blob)
+        os.replace(tmp, path)
+    
+    def _reference_counts(self) -> Dict[str, int]:
+        """Number of model files pointing at each blob"""
+        symlinks: Dict[str, int] = {}
+        for path in self._model_files():
+            if path.is_symlink():
+                target = path.resolve()
+                if self.blob_dir in target.parents:
+                    symlinks[target.name] = symlinks.get(target.name, 0) + 1
+        
+        counts = {}
+        for blob in self._blobs():
+            # A blob's own directory entry accounts for one hard link
+            counts[blob.name] = blob.stat().st_nlink - 1 + symlinks.get(blob.name, 0)
+        return counts
+    
+    def gc(self, dry_run: bool = False) -> Dict[str, int]:
+        """Delete blobs that no model directory references any more"""
+        removed = 0
+        freed = 0
+        for digest, refs in self._reference_counts().items():
+            if refs > 0:
+                continue
+            blob = self.blob_path(digest)
+            freed += blob.stat().st_size
+            removed += 1
+            if not dry_run:
+                blob.unlink()
+        
+        self._inodes = None
+        self.logger.info(f"{'Would remove' if dry_run else 'Removed'} {removed} unreferenced blobs "
+                         f"({freed / 1024 ** 3:.2f}GB)")
+        return {"removed": removed, "bytes_freed": freed}
+    
+    def report(self) -> Dict[str, int]:
+        """Shared versus unique bytes across model directories"""
+        report = {
+            "blobs": 0,
+            "shared_blobs": 0,
+            "shared_bytes": 0,
+            "unique_bytes": 0,
+            "unreferenced_bytes": 0,
+            "bytes_saved": 0,
+            "unstored_bytes": 0
+        }
+        
+        for digest, refs in self._reference_counts().items():
+            size = self.blob_path(digest).stat().st_size
+            report["blobs"] += 1
+            if refs == 0:
+                report["unreferenced_bytes"] += size
+            elif refs == 1:
+                report["unique_bytes"] += size
+            else:
+                report["shared_blobs"] += 1
+                report["shared_bytes"] += size
+                report["bytes_saved"] += size * (refs - 1)
+        
+        for path in self._model_files():
+            if not path.is_symlink() and self.digest_of(path) is None:
+                report["unstored_bytes"] += path.stat().st_size
+        
+        return report
\ No newline at end of file
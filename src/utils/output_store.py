@@ -0,0 +1,355 @@
+"""
+Output Store
+Writes generated images into dated folders and indexes them in SQLite, with
+background thumbnails, paginated queries and retention pruning
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+from .image_utils import save_image
+from .logger import get_logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    thumbnail_path TEXT,
+    prompt TEXT,
+    negative_prompt TEXT,
+    seed INTEGER,
+    model TEXT,
+    width INTEGER,
+    height INTEGER,
+    steps INTEGER,
+    parameters TEXT,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outputs_created ON outputs(created_at);
+CREATE INDEX IF NOT EXISTS idx_outputs_seed ON outputs(seed);
+CREATE INDEX IF NOT EXISTS idx_outputs_model ON outputs(model, created_at);
+CREATE INDEX IF NOT EXISTS idx_outputs_path ON outputs(path);
+"""
+
+# Trigram full-text index for prompt substring search; needs SQLite >= 3.34
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS outputs_fts USING fts5(
+    prompt, content='outputs', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS outputs_fts_insert AFTER INSERT ON outputs BEGIN
+    INSERT INTO outputs_fts(rowid, prompt) VALUES (new.id, new.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS outputs_fts_delete AFTER DELETE ON outputs BEGIN
+    INSERT INTO outputs_fts(outputs_fts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+END;
+"""
+
+# Files written flat into output_dir before outputs were indexed
+LEGACY_NAME = re.compile(r"^(txt2img|img2img|inpaint)_(\d{8}_\d{6})\.png$")
+
+COLUMNS = ("id", "created_at", "kind", "path", "thumbnail_path", "prompt", "negative_prompt",
+           "seed", "model", "width", "height", "steps", "parameters", "timings")
+
+def _json_default(value: Any) -> Any:
+    """Keep non-JSON parameters (arrays, paths) from breaking the index"""
+    return str(value) if not hasattr(value, "shape") else f"<array {tuple(value.shape)}>"
+
+class OutputStore:
+    """Persists generated images and their metadata"""
+    
+    def __init__(self,
+                 output_dir: Path,
+                 index_path: Optional[Path] = None,
+                 thumbnail_size: int = 256,
+                 max_age_days: Optional[float] = None,
+                 max_count: Optional[int] = None,
+                 prune_every: int = 100):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.thumbnail_dir = self.output_dir / ".thumbnails"
+        self.thumbnail_size = thumbnail_size
+        self.max_age_days = max_age_days
+        self.max_count = max_count
+        self.prune_every = prune_every
+        self.logger = get_logger(__name__)
+        
+        index_path = Path(index_path) if index_path else self.output_dir / "index.sqlite"
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(index_path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._writes = 0
+        
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+            try:
+                self._db.executescript(FTS_SCHEMA)
+                self.full_text = True
+            except sqlite3.OperationalError:
+                self.full_text = False
+            self._db.commit()
+        
+        # Thumbnails and pruning never block the generation thread
+        self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="output-store")
+    
+    @classmethod
+    def from_config(cls, config) -> "OutputStore":
+        return cls(
+            Path(config.get("output_dir", "data/outputs")),
+            index_path=config.get("outputs.index_path"),
+            thumbnail_size=config.get("outputs.thumbnail_size", 256),
+            max_age_days=config.get("outputs.retention.max_age_days"),
+            max_count=config.get("outputs.retention.max_count")
+        )
+    
+    def save(self,
+             image: Image.Image,
+             kind: str,
+             params: Dict[str, Any],
+             model: Optional[str] = None,
+             timings: Optional[Dict[str, float]] = None) -> Tuple[int, Path]:
+        """Write an image and index it; returns (output id, path)"""
+        now = datetime.now()
+        path = self.output_dir / now.strftime("%Y/%m/%d") / f"{kind}_{now.strftime('%H%M%S_%f')}.png"
+        
+        start = time.perf_counter()
+        save_image(image, path)
+        timings = {**(timings or {}), "save": time.perf_counter() - start}
+        
+        row = (
+            now.timestamp(), kind, str(path),
+            params.get("prompt"), params.get("negative_prompt"), params.get("seed"), model,
+            image.width, image.height, params.get("num_inference_steps"),
+            json.dumps(params, default=_json_default), json.dumps(timings)
+        )
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO outputs (created_at, kind, path, prompt, negative_prompt, seed, model, "
+                "width, height, steps, parameters, timings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row
+            )
+            self._db.commit()
+            output_id = cursor.lastrowid
+            self._writes += 1
+            prune_due = self.prune_every and self._writes % self.prune_every == 0
+        
+        self._background.submit(self._make_thumbnail, output_id, image.copy())
+        if prune_due and (self.max_age_days or self.max_count):
+            self._background.submit(self.prune)
+        
+        return output_id, path
+    
+    def index_existing(self, directory: Optional[Path] = None, thumbnails: bool = False,
+                       batch_size: int = 1000) -> Dict[str, int]:
+        """Index images saved flat as ``<kind>_<YYYYmmdd_HHMMSS>.png`` before the store existed
+        
+        Paths already in the index are skipped, so it is safe to re-run. Prompts and
+        seeds were never recorded for these files; they are searchable by date and
+        kind and fall under the retention policy like any other output.
+        """
+        directory = Path(directory) if directory else self.output_dir
+        stats = {"found": 0, "indexed": 0, "already_indexed": 0, "unreadable": 0}
+        
+        with self._lock:
+            known = {row[0] for row in self._db.execute("SELECT path FROM outputs")}
+        
+        pending = []
+        for entry in os.scandir(directory):
+            match = LEGACY_NAME.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            stats["found"] += 1
+            
+            path = str(directory / entry.name)
+            if path in known:
+                stats["already_indexed"] += 1
+                continue
+            
+            try:
+                with Image.open(path) as image:
+                    width, height = image.size
+            except (OSError, ValueError):
+                stats["unreadable"] += 1
+                continue
+            
+            created_at = datetime.strptime(match.group(2), "%Y%m%d_%H%M%S").timestamp()
+            pending.append((created_at, match.group(1), path, width, height))
+            if len(pending) >= batch_size:
+                stats["indexed"] += self._insert_existing(pending, thumbnails)
+                pending = []
+        
+        if pending:
+            stats["indexed"] += self._insert_existing(pending, thumbnails)
+        
+        self.logger.info(f"Indexed {stats['indexed']} of {stats['found']} existing outputs in {directory} "
+                         f"({stats['already_indexed']} already indexed, {stats['unreadable']} unreadable)")
+        return stats
+    
+    def _insert_existing(self, rows, thumbnails: bool) -> int:
+        with self._lock:
+            ids = []
+            for created_at, kind, path, width, height in rows:
+                cursor = self._db.execute(
+                    "INSERT INTO outputs (created_at, kind, path, width, height, parameters, timings) "
+                    "VALUES (?, ?, ?, ?, ?, '{}', '{}')",
+                    (created_at, kind, path, width, height)
+                )
+                ids.append((cursor.lastrowid, path))
+            self._db.commit()
+        
+        if thumbnails:
+            for output_id, path in ids:
+                self._background.submit(self._thumbnail_from_file, output_id, path)
+        return len(ids)
+    
+    def _thumbnail_from_file(self, output_id: int, path: str):
+        try:
+            with Image.open(path) as image:
+                image.load()
+                self._make_thumbnail(output_id, image)
+        except OSError as e:
+            self.logger.warning(f"Thumbnail for output {output_id} failed: {e}")
+    
+    def _make_thumbnail(self, output_id: int, image: Image.Image):
+        try:
+            image.thumbnail((self.thumbnail_size, self.thumbnail_size), Image.Resampling.LANCZOS)
+            path = self.thumbnail_dir / f"{output_id // 1000:05d}" / f"{output_id}.jpg"
+            save_image(image.convert("RGB"), path, quality=85)
+            with self._lock:
+                self._db.execute("UPDATE outputs SET thumbnail_path = ? WHERE id = ?", (str(path), output_id))
+                self._db.commit()
+        except Exception as e:
+            self.logger.warning(f"Thumbnail for output {output_id} failed: {e}")
+    
+    def get(self, output_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM outputs WHERE id = ?", (output_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+    
+    def query(self,
+              prompt: Optional[str] = None,
+              since: Optional[datetime] = None,
+              until: Optional[datetime] = None,
+              seed: Optional[int] = None,
+              model: Optional[str] = None,
+              kind: Optional[str] = None,
+              limit: int = 50,
+              cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Newest-first page of outputs matching every given filter
+        
+        Pass the returned ``next_cursor`` back as ``cursor`` to fetch the next page.
+        Order is by creation time, so indexed older files sort among their peers.
+        """
+        clauses, args = [], []
+        
+        if prompt:
+            if self.full_text and len(prompt) >= 3:
+                escaped = prompt.replace('"', '""')
+                clauses.append("id IN (SELECT rowid FROM outputs_fts WHERE outputs_fts MATCH ?)")
+                args.append(f'"{escaped}"')
+            else:
+                clauses.append("prompt LIKE ? ESCAPE '\\'")
+                escaped = prompt.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                args.append(f"%{escaped}%")
+        if since is not None:
+            clauses.append("created_at >= ?")
+            args.append(since.timestamp())
+        if until is not None:
+            clauses.append("created_at < ?")
+            args.append(until.timestamp())
+        if seed is not None:
+            clauses.append("seed = ?")
+            args.append(seed)
+        if model is not None:
+            clauses.append("model = ?")
+            args.append(model)
+        if kind is not None:
+            clauses.append("kind = ?")
+            args.append(kind)
+        if cursor is not None:
+            created_at, output_id = self._parse_cursor(cursor)
+            clauses.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            args.extend((created_at, created_at, output_id))
+        
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = f"SELECT * FROM outputs {where} ORDER BY created_at DESC, id DESC LIMIT ?"
+        
+        with self._lock:
+            rows = self._db.execute(sql, (*args, limit + 1)).fetchall()
+        
+        items = [self._row_to_dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = f"{last['created_at']!r}:{last['id']}"
+        return {"items": items, "next_cursor": next_cursor}
+    
+    @staticmethod
+    def _parse_cursor(cursor: str) -> Tuple[float, int]:
+        try:
+            created_at, output_id = str(cursor).split(":")
+            return float(created_at), int(output_id)
+        except ValueError:
+            raise ValueError(f"Invalid cursor: {cursor!r}")
+    
+    def prune(self, max_age_days: Optional[float] = None, max_count: Optional[int] = None) -> int:
+        """Delete outputs older than max_age_days and beyond the newest max_count"""
+        max_age_days = max_age_days if max_age_days is not None else self.max_age_days
+        max_count = max_count if max_count is not None else self.max_count
+        
+        clauses, args = [], []
+        if max_age_days is not None:
+            clauses.append("created_at < ?")
+            args.append(time.time() - max_age_days * 86400)
+        if max_count is not None:
+            clauses.append("id NOT IN (SELECT id FROM outputs ORDER BY created_at DESC, id DESC LIMIT ?)")
+            args.append(max_count)
+        if not clauses:
+            return 0
+        
+        with self._lock:
+            doomed = self._db.execute(
+                f"SELECT id, path, thumbnail_path FROM outputs WHERE {' OR '.join(clauses)}", args
+            ).fetchall()
+            self._db.executemany("DELETE FROM outputs WHERE id = ?", [(row["id"],) for row in doomed])
+            self._db.commit()
+        
+        for row in doomed:
+            for path in (row["path"], row["thumbnail_path"]):
+                if path:
+                    Path(path).unlink(missing_ok=True)
+        
+        if doomed:
+            self.logger.info(f"Pruned {len(doomed)} outputs")
+        return len(doomed)
+    
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM outputs").fetchone()[0]
+    
+    def close(self):
+        self._background.shutdown(wait=True)
+        with self._lock:
+            self._db.close()
+    
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        item = {name: row[name] for name in COLUMNS}
+        item["created_at"] = datetime.fromtimestamp(item["created_at"]).isoformat()
+        item["parameters"] = json.loads(item["parameters"]) if item["parameters"] else {}
+        item["timings"] = json.loads(item["timings"]) if item["timings"] else {}
+        return item
\ No newline at end of file
@@ -0,0 +1,18 @@
+"""
+Size parsing for human-readable config values such as "50MB"
+"""
+
+import re
+from typing import Any
+
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+def parse_size(value: Any) -> int:
+    """Parse a size such as "50MB" (or a plain byte count) into bytes"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMG]?B)?\s*", str(value).upper())
+    if not match:
+        raise ValueError(f"Invalid size: {value!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2) or "B"])
@@ -0,0 +1,107 @@
+"""
+Tests for cost-weighted admission control
+"""
+
+import pytest
+import yaml
+
+from src.core.admission import AdmissionController, CostModel, TokenBucket, parse_rate
+from src.utils.config import Config
+
+def make_config(tmp_path, data):
+    path = tmp_path / "config.yaml"
+    path.write_text(yaml.safe_dump(data))
+    return Config(str(path))
+
+def test_parse_rate():
+    assert parse_rate("100/minute") == (100.0, 60.0)
+    with pytest.raises(ValueError):
+        parse_rate("100 per minute")
+
+def test_bucket_admits_until_empty_then_refills():
+    bucket = TokenBucket(capacity=2, refill_rate=1.0)
+    now = bucket.updated
+    assert bucket.try_acquire(1, now) == (True, 0.0)
+    assert bucket.try_acquire(1, now) == (True, 0.0)
+    
+    admitted, retry_after = bucket.try_acquire(1, now)
+    assert not admitted
+    assert retry_after == pytest.approx(1.0)
+    assert bucket.try_acquire(1, now + 1.0)[0]
+
+def test_bucket_admits_oversized_request_from_full_bucket():
+    bucket = TokenBucket(capacity=2, refill_rate=1.0)
+    now = bucket.updated
+    assert bucket.try_acquire(5, now)[0]
+    
+    # The bucket is left in debt for the excess
+    admitted, retry_after = bucket.try_acquire(1, now)
+    assert not admitted
+    assert retry_after == pytest.approx(4.0)
+
+def test_reference_request_costs_one():
+    model = CostModel()
+    assert model.cost("sdxl", 1024, 1024, 20) == pytest.approx(1.0)
+    assert model.cost("sdxl", 1024, 1024, 20, images=4) == pytest.approx(4.0)
+    assert model.cost("sdxl", 2048, 2048, 20) == pytest.approx(4.0)
+
+def test_calibration_moves_relative_cost():
+    model = CostModel(smoothing=1.0)
+    work = 1.048576 * 20
+    model.observe("sdxl", 1024, 1024, 20, seconds=10.0)
+    model.observe("sdxl_refiner", 1024, 1024, 20, seconds=20.0)
+    
+    assert model.estimate_seconds("sdxl", 1024, 1024, 20) == pytest.approx(10.0)
+    assert model.coefficients["sdxl_refiner"] == pytest.approx(20.0 / work)
+    assert model.cost("sdxl_refiner", 1024, 1024, 20) == pytest.approx(2.0)
+
+def test_observe_ignores_empty_measurements():
+    model = CostModel()
+    before = dict(model.coefficients)
+    model.observe("sdxl", 1024, 1024, 20, seconds=0)
+    assert model.coefficients == before
+
+def test_request_work_uses_pipeline_defaults(tmp_path):
+    admission = AdmissionController(make_config(tmp_path, {"performance": {"batch_size": 2}}))
+    
+    assert admission.request_work("txt2img", {}) == ("sdxl", 1024, 1024, 20, 2)
+    assert admission.request_work("txt2img", {"num_images": 3, "refiner": True})[0] == "sdxl_refiner"
+    assert admission.request_work("txt2img", {"width": 2048, "height": 2048, "progressive": True})[0] == "sdxl_progressive"
+    assert admission.request_work("txt2img", {"progressive": True})[0] == "sdxl"
+    
+    assert admission.request_work("img2img", {"source_size": (512, 768)}) == ("img2img", 512, 768, 40.0, 1)
+    assert admission.request_work("inpaint", {"source_size": (512, 512), "num_inference_steps": 30}) == (
+        "inpaint", 512, 512, 30.0, 1
+    )
+
+def test_options_steps_override_is_charged(tmp_path):
+    admission = AdmissionController(make_config(tmp_path, {}))
+    
+    # generate_image lets options' num_inference_steps replace steps, so the cost must too
+    params = {"steps": 20, "num_inference_steps": 100}
+    assert admission.request_work("txt2img", params)[3] == 100
+    assert admission.request_cost("txt2img", params) == pytest.approx(5.0)
+
+def test_record_calibrates_the_charged_type(tmp_path):
+    admission = AdmissionController(make_config(tmp_path, {}))
+    params = {"source_size": (1024, 1024)}
+    before = admission.request_cost("img2img", params)
+    for _ in range(20):
+        admission.record("img2img", params, seconds=1000.0)
+    assert admission.request_cost("img2img", params) > before
+
+def test_unknown_api_keys_share_the_address_bucket(tmp_path):
+    admission = AdmissionController(make_config(tmp_path, {"api": {"rate_limit": "1/minute", "api_keys": ["secret"]}}))
+    
+    assert admission.client_id("random", "10.0.0.1") == admission.client_id("other", "10.0.0.1")
+    assert admission.client_id("secret", "10.0.0.1") == "key:secret"
+    
+    client = admission.client_id("random", "10.0.0.1")
+    assert admission.admit(client, "txt2img", {}).admitted
+    assert not admission.admit(admission.client_id("fresh", "10.0.0.1"), "txt2img", {}).admitted
+    assert admission.admit(admission.client_id("secret", "10.0.0.1"), "txt2img", {}).admitted
+
+def test_disabled_without_rate_limit(tmp_path):
+    admission = AdmissionController(make_config(tmp_path, {}))
+    assert not admission.enabled
+    assert all(admission.admit("address:x", "txt2img", {}).admitted for _ in range(10))
@@ -0,0 +1,101 @@
+"""
+Tests for config validation, diffing and live reload
+"""
+
+import yaml
+
+from src.utils.config import Config, diff_config, validate_config
+
+BASE = {
+    "output_dir": "data/outputs",
+    "generation": {"default_steps": 20, "default_scheduler": "DPMSolverMultistepScheduler"},
+    "logging": {"level": "INFO", "format": "text"}
+}
+
+def _write(path, data):
+    path.write_text(yaml.safe_dump(data))
+
+def _config(tmp_path, data=BASE):
+    path = tmp_path / "config.yaml"
+    _write(path, data)
+    return Config(str(path)), path
+
+def _edit(data, **leaves):
+    edited = yaml.safe_load(yaml.safe_dump(data))
+    for key, value in leaves.items():
+        section, name = key.split("__")
+        edited[section][name] = value
+    return edited
+
+def test_diff_config_reports_changed_added_and_removed_leaves():
+    new = {"output_dir": "data/outputs", "generation": {"default_steps": 30}, "api": {"rate_limit": "10/minute"}}
+    assert diff_config(BASE, new) == {
+        "api.rate_limit": (None, "10/minute"),
+        "generation.default_scheduler": ("DPMSolverMultistepScheduler", None),
+        "generation.default_steps": (20, 30),
+        "logging.format": ("text", None),
+        "logging.level": ("INFO", None)
+    }
+    assert diff_config(BASE, BASE) == {}
+
+def test_validate_config():
+    assert validate_config(BASE) == []
+    assert validate_config(["not", "a", "mapping"]) == ["configuration must be a mapping"]
+    
+    errors = validate_config(_edit(BASE, generation__default_steps=True, logging__format="xml"))
+    assert len(errors) == 2
+    assert errors[0].startswith("generation.default_steps: expected int")
+    assert errors[1].startswith("logging.format: 'xml' is not one of")
+
+def test_validate_config_rejects_unknown_scheduler():
+    errors = validate_config(_edit(BASE, generation__default_scheduler="NoSuchScheduler"))
+    assert len(errors) == 1 and errors[0].startswith("generation.default_scheduler")
+
+def test_reload_routes_changes_by_prefix(tmp_path):
+    config, path = _config(tmp_path)
+    seen = {}
+    config.subscribe("generation", lambda changes: seen.setdefault("generation", changes), "generation")
+    config.subscribe(("logging.level", "api"), lambda changes: seen.setdefault("logging", changes), "logging")
+    config.subscribe("log", lambda changes: seen.setdefault("log", changes), "log")
+    
+    _write(path, _edit(BASE, generation__default_steps=30, logging__format="json"))
+    event = config.reload()
+    
+    assert event["changed"] == ["generation.default_steps", "logging.format"]
+    assert seen == {"generation": {"generation.default_steps": (20, 30)}}
+    assert list(event["applied"]) == ["generation"]
+    assert config.get("logging.format") == "json"
+
+def test_invalid_file_leaves_config_untouched(tmp_path):
+    config, path = _config(tmp_path)
+    calls = []
+    config.subscribe("generation", calls.append, "generation")
+    
+    _write(path, _edit(BASE, generation__default_scheduler="NoSuchScheduler"))
+    event = config.reload()
+    
+    assert event["errors"] and not event["changed"]
+    assert calls == []
+    assert config.get("generation.default_scheduler") == "DPMSolverMultistepScheduler"
+
+def test_failed_owner_rolls_back_the_reload(tmp_path):
+    config, path = _config(tmp_path)
+    applied, later = [], []
+    
+    def failing(changes):
+        raise RuntimeError("cannot apply")
+    
+    config.subscribe("generation", applied.append, "first")
+    config.subscribe("logging", failing, "second")
+    config.subscribe("generation", later.append, "third")
+    
+    _write(path, _edit(BASE, generation__default_steps=30, logging__level="DEBUG"))
+    event = config.reload()
+    
+    assert event["rolled_back"]
+    assert config.get("generation.default_steps") == 20
+    assert config.get("logging.level") == "INFO"
+    # The owner that ran is handed the reverse change; owners after the failure never run
+    assert applied == [{"generation.default_steps": (20, 30)}, {"generation.default_steps": (30, 20)}]
+    assert later == []
+    assert any(error.startswith("second:") for error in event["errors"])
@@ -0,0 +1,166 @@
+"""
+Tests for model file selection and resumable, verified downloads against a local mirror
+"""
+
+import hashlib
+import importlib.util
+import json
+import logging
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("requests")
+
+_spec = importlib.util.spec_from_file_location(
+    "download_models", Path(__file__).resolve().parent.parent / "scripts" / "download_models.py"
+)
+download_models = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(download_models)
+
+logger = logging.getLogger("test_download_models")
+
+PIPELINE_FILES = {
+    "model_index.json": {"size": 1},
+    "sd_xl_base_1.0.safetensors": {"size": 1},
+    "unet/config.json": {"size": 1},
+    "unet/diffusion_pytorch_model.safetensors": {"size": 1},
+    "unet/diffusion_pytorch_model.fp16.safetensors": {"size": 1},
+    "unet/diffusion_pytorch_model.bin": {"size": 1},
+    "vae/config.json": {"size": 1},
+    "vae/diffusion_pytorch_model.safetensors": {"size": 1},
+    "vae_1_0/config.json": {"size": 1},
+    "vae_1_0/diffusion_pytorch_model.safetensors": {"size": 1},
+    "tokenizer/vocab.json": {"size": 1},
+    "README.md": {"size": 1}
+}
+
+MODEL_INDEX = {
+    "_class_name": "StableDiffusionXLPipeline",
+    "unet": ["diffusers", "UNet2DConditionModel"],
+    "vae": ["diffusers", "AutoencoderKL"],
+    "tokenizer": ["transformers", "CLIPTokenizer"],
+    "feature_extractor": [None, None]
+}
+
+def test_pipeline_components():
+    assert download_models.pipeline_components(MODEL_INDEX) == {"unet", "vae", "tokenizer"}
+
+def test_select_fp16_prefers_variant_and_skips_unused_folders():
+    components = download_models.pipeline_components(MODEL_INDEX)
+    selected = download_models.select_files(PIPELINE_FILES, "fp16", components)
+    
+    assert sorted(selected) == [
+        "model_index.json",
+        "tokenizer/vocab.json",
+        "unet/config.json",
+        "unet/diffusion_pytorch_model.fp16.safetensors",
+        "vae/config.json",
+        "vae/diffusion_pytorch_model.safetensors"
+    ]
+
+def test_select_fp32_never_takes_fp16_files():
+    selected = download_models.select_files(PIPELINE_FILES, "fp32")
+    assert "unet/diffusion_pytorch_model.safetensors" in selected
+    assert "unet/diffusion_pytorch_model.fp16.safetensors" not in selected
+    assert "unet/diffusion_pytorch_model.bin" not in selected
+    assert "sd_xl_base_1.0.safetensors" not in selected
+
+def test_source_is_abstract():
+    with pytest.raises(TypeError):
+        download_models.Source()
+
+@pytest.fixture
+def mirror(tmp_path):
+    """A local directory laid out like model_dir with a manifest, standing in for a remote source"""
+    payload = bytes(range(256)) * 4096
+    root = tmp_path / "mirror"
+    (root / "model" / "unet").mkdir(parents=True)
+    (root / "model" / "unet" / "weights.bin").write_bytes(payload)
+    meta = {"size": len(payload), "sha256": hashlib.sha256(payload).hexdigest()}
+    (root / "manifest.json").write_text(json.dumps({"model": {"repo_id": "x/model", "files": {"unet/weights.bin": meta}}}))
+    return download_models.ManifestSource(str(root)), payload, meta
+
+def test_download_and_skip_when_verified(mirror, tmp_path):
+    source, payload, meta = mirror
+    model = {"name": "model", "repo_id": "x/model"}
+    target_dir = tmp_path / "models" / "model"
+    
+    stats = download_models.DownloadStats()
+    assert download_models.download_file(source, model, "unet/weights.bin", meta, target_dir, stats, logger)
+    assert (target_dir / "unet" / "weights.bin").read_bytes() == payload
+    assert stats.downloaded == len(payload)
+    
+    stats = download_models.DownloadStats()
+    assert download_models.download_file(source, model, "unet/weights.bin", meta, target_dir, stats, logger)
+    assert stats.skipped == len(payload) and stats.downloaded == 0
+
+def test_download_resumes_partial_file(mirror, tmp_path):
+    source, payload, meta = mirror
+    model = {"name": "model", "repo_id": "x/model"}
+    target_dir = tmp_path / "models" / "model"
+    partial = target_dir / "unet" / "weights.bin.part"
+    partial.parent.mkdir(parents=True)
+    partial.write_bytes(payload[:1000])
+    
+    stats = download_models.DownloadStats()
+    assert download_models.download_file(source, model, "unet/weights.bin", meta, target_dir, stats, logger)
+    assert (target_dir / "unet" / "weights.bin").read_bytes() == payload
+    assert stats.resumed == 1000
+    assert stats.downloaded == len(payload) - 1000
+    assert not partial.exists()
+
+def test_download_discards_hash_mismatch(mirror, tmp_path):
+    source, payload, meta = mirror
+    model = {"name": "model", "repo_id": "x/model"}
+    target_dir = tmp_path / "models" / "model"
+    bad = {**meta, "sha256": "0" * 64}
+    
+    stats = download_models.DownloadStats()
+    assert not download_models.download_file(source, model, "unet/weights.bin", bad, target_dir, stats, logger)
+    assert not (target_dir / "unet" / "weights.bin").exists()
+    assert not (target_dir / "unet" / "weights.bin.part").exists()
+
+def test_present_files(tmp_path):
+    (tmp_path / "unet").mkdir()
+    (tmp_path / "unet" / "config.json").write_text("{}")
+    files = {"unet/config.json": {"size": 2}, "vae/config.json": {"size": 2}}
+    assert download_models.present_files(files, tmp_path) == {"unet/config.json": {"size": 2}}
+
+@pytest.mark.parametrize("filename, kind", [
+    ("unet/diffusion_pytorch_model.safetensors", ("safetensors", None)),
+    ("unet/diffusion_pytorch_model.fp16.bin", ("bin", "fp16")),
+    ("unet/diffusion_pytorch_model-00001-of-00002.safetensors", ("safetensors", None)),
+    ("unet/diffusion_pytorch_model-00001-of-00002.fp16.safetensors", ("safetensors", "fp16")),
+    ("text_encoder_2/model.fp16-00002-of-00002.safetensors", ("safetensors", "fp16")),
+    ("unet/diffusion_pytorch_model.safetensors.index.json", ("safetensors", None)),
+    ("unet/diffusion_pytorch_model.safetensors.index.fp16.json", ("safetensors", "fp16")),
+    ("unet/config.json", None),
+    ("sd_xl_base_1.0.safetensors", None)
+])
+def test_weight_kind(filename, kind):
+    assert download_models.weight_kind(filename) == kind
+
+SHARDED_FILES = {
+    "unet/config.json": {"size": 1},
+    "unet/diffusion_pytorch_model-00001-of-00002.safetensors": {"size": 1},
+    "unet/diffusion_pytorch_model-00002-of-00002.safetensors": {"size": 1},
+    "unet/diffusion_pytorch_model.safetensors.index.json": {"size": 1},
+    "unet/diffusion_pytorch_model-00001-of-00002.fp16.safetensors": {"size": 1},
+    "unet/diffusion_pytorch_model-00002-of-00002.fp16.safetensors": {"size": 1},
+    "unet/diffusion_pytorch_model.safetensors.index.fp16.json": {"size": 1}
+}
+
+def test_select_keeps_every_shard_with_its_index():
+    assert sorted(download_models.select_files(SHARDED_FILES, "fp32")) == [
+        "unet/config.json",
+        "unet/diffusion_pytorch_model-00001-of-00002.safetensors",
+        "unet/diffusion_pytorch_model-00002-of-00002.safetensors",
+        "unet/diffusion_pytorch_model.safetensors.index.json"
+    ]
+    assert sorted(download_models.select_files(SHARDED_FILES, "fp16")) == [
+        "unet/config.json",
+        "unet/diffusion_pytorch_model-00001-of-00002.fp16.safetensors",
+        "unet/diffusion_pytorch_model-00002-of-00002.fp16.safetensors",
+        "unet/diffusion_pytorch_model.safetensors.index.fp16.json"
+    ]
@@ -0,0 +1,180 @@
+"""
+Tests for the concurrent executor's core partitioning and worker hand-back
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+
+from src.core.executor import ConcurrentExecutor, partition_cores, shared_names
+from src.utils.handoff import SharedImageRegistry
+from src.utils.logger import forward_logs, start_log_relay
+
+def test_partition_cores_is_disjoint_and_near_equal():
+    budgets = partition_cores(3, cores=list(range(8)))
+    assert budgets == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    
+    assert partition_cores(2, cores=[4, 5, 6, 7]) == [[4, 5], [6, 7]]
+    assert partition_cores(1, cores=[2, 3]) == [[2, 3]]
+
+def test_partition_cores_rejects_more_workers_than_cores():
+    with pytest.raises(ValueError):
+        partition_cores(3, cores=[0, 1])
+
+def test_shared_names_covers_batches():
+    single = {"shared_memory": {"name": "a"}}
+    batch = {"shared_memory": {"name": "a"}, "batch": [{"shared_memory": {"name": "a"}}, {"shared_memory": {"name": "b"}}]}
+    assert shared_names(single) == ["a"]
+    assert shared_names(batch) == ["a", "b"]
+    assert shared_names({"image_path": "out.png"}) == []
+
+def _block_sum(name):
+    # A plain attach: attach_shared_image would drop this process's tracker registration
+    shm = SharedMemory(name=name)
+    try:
+        return int(np.ndarray((12,), dtype=np.uint8, buffer=shm.buf).sum())
+    finally:
+        shm.close()
+
+def test_adopted_block_is_released_by_the_new_owner():
+    producer, consumer = SharedImageRegistry(), SharedImageRegistry()
+    descriptor = producer.publish(np.arange(12, dtype=np.uint8).reshape(2, 2, 3))
+    
+    assert producer.disown(descriptor["name"])
+    consumer.adopt(descriptor["name"])
+    assert _block_sum(descriptor["name"]) == sum(range(12))
+    
+    assert not producer.release(descriptor["name"])
+    assert consumer.release(descriptor["name"])
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=descriptor["name"])
+
+PRODUCER = """
+import json, sys
+import numpy as np
+from src.utils.handoff import SharedImageRegistry
+registry = SharedImageRegistry()
+descriptor = registry.publish(np.arange(12, dtype=np.uint8).reshape(2, 2, 3))
+registry.disown(descriptor["name"])
+print(json.dumps(descriptor))
+"""
+
+def test_adopted_block_outlives_its_producer():
+    # A separate interpreter has its own resource tracker, like a worker forked before the parent's started
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", PRODUCER], cwd=root, capture_output=True, text=True, check=True)
+    descriptor = json.loads(output.stdout)
+    
+    consumer = SharedImageRegistry()
+    consumer.adopt(descriptor["name"])
+    assert _block_sum(descriptor["name"]) == sum(range(12))
+    assert consumer.release(descriptor["name"])
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="needs POSIX shared memory under /dev/shm")
+def test_release_tolerates_a_vanished_block():
+    registry = SharedImageRegistry()
+    descriptor = registry.publish(np.zeros((2, 2, 3), dtype=np.uint8))
+    
+    # Removed behind the registry's back, as another process's resource tracker would
+    os.remove(os.path.join("/dev/shm", descriptor["name"].lstrip("/")))
+    
+    assert registry.release(descriptor["name"])
+    assert len(registry) == 0
+
+def test_latent_cache_stats_sum_over_workers():
+    executor = ConcurrentExecutor.__new__(ConcurrentExecutor)
+    executor.worker_stats = {
+        "imggen-worker-0": {"worker": "imggen-worker-0", "latent_cache": {"memory_hits": 3, "disk_hits": 0, "misses": 1, "hit_rate": 0.75, "disk": False}},
+        "imggen-worker-1": {"worker": "imggen-worker-1", "latent_cache": {"memory_hits": 1, "disk_hits": 1, "misses": 2, "hit_rate": 0.5, "disk": False}}
+    }
+    stats = executor.latent_cache_stats()
+    assert stats["memory_hits"] == 4 and stats["misses"] == 3
+    assert stats["hit_rate"] == pytest.approx(5 / 8)
+    assert set(stats["workers"]) == {"imggen-worker-0", "imggen-worker-1"}
+    
+    executor.worker_stats = {}
+    assert executor.latent_cache_stats() is None
+
+def _log_from_child(log_queue):
+    forward_logs(log_queue, name="imggen-test")
+    logging.getLogger("imggen-test.worker").warning("from %s", "child")
+
+def test_forked_worker_logs_reach_parent_handlers():
+    records = []
+    parent = logging.getLogger("imggen-test")
+    parent.setLevel(logging.INFO)
+    handler = logging.Handler()
+    handler.emit = records.append
+    parent.addHandler(handler)
+    
+    context = get_context("fork")
+    log_queue = context.Queue()
+    relay = start_log_relay(log_queue)
+    try:
+        process = context.Process(target=_log_from_child, args=(log_queue,))
+        process.start()
+        process.join()
+    finally:
+        relay.stop()
+        parent.removeHandler(handler)
+    
+    assert process.exitcode == 0
+    assert [(record.name, record.getMessage()) for record in records] == [("imggen-test.worker", "from child")]
+
+class _Process:
+    def __init__(self, name, alive=True, exitcode=None):
+        self.name = name
+        self.alive = alive
+        self.exitcode = exitcode
+    
+    def is_alive(self):
+        return self.alive
+
+def _executor(processes, current, pending):
+    executor = ConcurrentExecutor.__new__(ConcurrentExecutor)
+    executor._processes = processes
+    executor._current = [SimpleNamespace(value=task_id) for task_id in current]
+    executor._pending = pending
+    executor._pending_lock = threading.Lock()
+    executor._stopping = False
+    executor._spawn = lambda index, name: _Process(name)
+    return executor
+
+def test_dead_worker_fails_only_its_own_task():
+    running, queued, elsewhere = Future(), Future(), Future()
+    processes = [_Process("imggen-worker-0", alive=False, exitcode=-9), _Process("imggen-worker-1")]
+    executor = _executor(processes, current=[1, 2], pending={1: running, 2: elsewhere, 3: queued})
+    
+    executor._check_workers()
+    
+    assert running.result()["error"] == "Worker died: imggen-worker-0 (exit -9)"
+    assert not elsewhere.done() and not queued.done()
+    assert set(executor._pending) == {2, 3}
+    assert executor._processes[0].is_alive()
+
+def test_blocks_of_an_abandoned_request_are_freed():
+    registry = SharedImageRegistry()
+    descriptor = registry.publish(np.zeros((2, 2, 3), dtype=np.uint8))
+    registry.disown(descriptor["name"])
+    
+    executor = ConcurrentExecutor.__new__(ConcurrentExecutor)
+    executor.pipeline = SimpleNamespace(shared_images=SharedImageRegistry())
+    executor.worker_stats = {}
+    executor._absorb({"shared_memory": descriptor}, {"worker": "imggen-worker-0", "latent_cache": None}, owned=False)
+    
+    assert len(executor.pipeline.shared_images) == 0
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=descriptor["name"])
@@ -0,0 +1,29 @@
+"""
+Tests for classifier-free guidance truncation
+"""
+
+import pytest
+
+from src.core.guidance import GuidanceTruncation
+
+def test_not_requested_returns_none():
+    assert GuidanceTruncation.from_params({}, 20) is None
+
+def test_no_truncation_without_guidance():
+    assert GuidanceTruncation.from_params({"cfg_cutoff": 0.5, "guidance_scale": 1.0}, 20) is None
+
+@pytest.mark.parametrize("cutoff", [0, 0.0, -0.1, 1.5])
+def test_rejects_cutoff_outside_range(cutoff):
+    with pytest.raises(ValueError):
+        GuidanceTruncation.from_params({"cfg_cutoff": cutoff}, 20)
+
+def test_cutoff_step():
+    truncation = GuidanceTruncation.from_params({"cfg_cutoff": 0.5}, 20)
+    assert truncation.cutoff_step == 10
+    assert not truncation._should_truncate(8)
+    assert truncation._should_truncate(9)
+
+def test_small_cutoff_truncates_after_first_step():
+    truncation = GuidanceTruncation.from_params({"cfg_cutoff": 0.01}, 20)
+    assert truncation.cutoff_step == 1
+    assert truncation._should_truncate(0)
@@ -0,0 +1,47 @@
+"""
+Tests for leak detection and per-request memory accounting
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+
+from src.core.memory import LeakDetector, MemoryTracker
+
+MB = 1024 ** 2
+
+def test_leak_detector_needs_half_a_window():
+    detector = LeakDetector(window=10)
+    for value in range(4):
+        detector.add(value * 100 * MB)
+    assert detector.status()["samples"] == 4
+    assert not detector.status()["suspected"]
+
+def test_leak_detector_flags_steady_growth():
+    detector = LeakDetector(window=10)
+    for index in range(10):
+        detector.add(1000 * MB + index * 20 * MB)
+    
+    status = detector.status()
+    assert status["suspected"]
+    assert status["slope_bytes_per_request"] == pytest.approx(20 * MB)
+    assert status["growth_bytes"] == 180 * MB
+
+def test_leak_detector_ignores_fluctuation():
+    detector = LeakDetector(window=10)
+    for index in range(10):
+        detector.add(1000 * MB + (300 * MB if index % 2 else 0) + index * 20 * MB)
+    assert not detector.status()["suspected"]
+
+def test_tracker_keeps_worker_trends_apart():
+    tracker = MemoryTracker("cpu", window=10)
+    for index in range(10):
+        tracker.record({"kind": "txt2img", "worker": "imggen-worker-0", "rss_after": 1000 * MB + index * 20 * MB})
+        tracker.record({"kind": "txt2img", "worker": "imggen-worker-1", "rss_after": 2000 * MB})
+    
+    report = tracker.report({})
+    assert len(report["recent_requests"]) == 10
+    assert report["workers"]["imggen-worker-0"]["leak"]["suspected"]
+    assert not report["workers"]["imggen-worker-1"]["leak"]["suspected"]
+    assert report["workers"]["imggen-worker-1"]["rss"] == 2000 * MB
+    assert tracker._warned
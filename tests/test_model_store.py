@@ -0,0 +1,101 @@
+"""
+Tests for the content-addressed model store
+"""
+
+import errno
+import os
+from pathlib import Path
+
+from src.utils.model_store import ModelStore
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+def make_models(root):
+    shared = b"s" * 4096
+    write(root / "base" / "vae" / "diffusion_pytorch_model.safetensors", shared)
+    write(root / "refiner" / "vae" / "diffusion_pytorch_model.safetensors", shared)
+    write(root / "base" / "unet" / "diffusion_pytorch_model.safetensors", b"u" * 8192)
+    write(root / "base" / "unet" / "config.json", b"{}")
+    return shared
+
+def test_ingest_deduplicates_identical_files(tmp_path):
+    make_models(tmp_path)
+    store = ModelStore(tmp_path, min_size=1024)
+    
+    stats = store.ingest()
+    assert stats == {"files": 3, "linked": 1, "new_blobs": 2, "bytes_saved": 4096}
+    
+    base = tmp_path / "base" / "vae" / "diffusion_pytorch_model.safetensors"
+    refiner = tmp_path / "refiner" / "vae" / "diffusion_pytorch_model.safetensors"
+    assert base.stat().st_ino == refiner.stat().st_ino
+    assert store.identity([base]) == store.identity([refiner])
+    
+    # Files below min_size are left alone, and a second pass finds nothing new
+    assert not store.digest_of(tmp_path / "base" / "unet" / "config.json")
+    assert store.ingest()["new_blobs"] == 0
+
+def test_identity_differs_for_different_content(tmp_path):
+    make_models(tmp_path)
+    store = ModelStore(tmp_path, min_size=1024)
+    store.ingest()
+    vae = tmp_path / "base" / "vae" / "diffusion_pytorch_model.safetensors"
+    unet = tmp_path / "base" / "unet" / "diffusion_pytorch_model.safetensors"
+    assert store.identity([vae]) != store.identity([unet])
+    assert store.identity([tmp_path / "missing.safetensors"]) is None
+
+def test_report_counts_shared_and_unique_bytes(tmp_path):
+    make_models(tmp_path)
+    store = ModelStore(tmp_path, min_size=1024)
+    store.ingest()
+    
+    report = store.report()
+    assert report["blobs"] == 2
+    assert report["shared_blobs"] == 1
+    assert report["shared_bytes"] == 4096
+    assert report["unique_bytes"] == 8192
+    assert report["unreferenced_bytes"] == 0
+
+def test_gc_removes_only_unreferenced_blobs(tmp_path):
+    make_models(tmp_path)
+    store = ModelStore(tmp_path, min_size=1024)
+    store.ingest()
+    
+    (tmp_path / "base" / "unet" / "diffusion_pytorch_model.safetensors").unlink()
+    assert store.gc(dry_run=True) == {"removed": 1, "bytes_freed": 8192}
+    assert store.report()["blobs"] == 2
+    
+    assert store.gc() == {"removed": 1, "bytes_freed": 8192}
+    assert store.report()["blobs"] == 1
+    
+    # The shared VAE is still referenced by both models
+    (tmp_path / "refiner" / "vae" / "diffusion_pytorch_model.safetensors").unlink()
+    assert store.gc()["removed"] == 0
+
+def test_ingest_across_filesystems_copies_and_symlinks(tmp_path, monkeypatch):
+    make_models(tmp_path)
+    store = ModelStore(tmp_path, min_size=1024)
+    
+    # The store sits on another filesystem: links and renames between the two fail
+    def in_store(path):
+        return store.blob_dir in Path(path).parents
+    
+    def cross_device(operation):
+        def guarded(src, dst):
+            if in_store(src) != in_store(dst):
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            return operation(src, dst)
+        return guarded
+    
+    monkeypatch.setattr(os, "link", cross_device(os.link))
+    monkeypatch.setattr(os, "replace", cross_device(os.replace))
+    stats = store.ingest()
+    assert stats["new_blobs"] == 2 and stats["linked"] == 1
+    
+    base = tmp_path / "base" / "vae" / "diffusion_pytorch_model.safetensors"
+    unet = tmp_path / "base" / "unet" / "diffusion_pytorch_model.safetensors"
+    assert base.is_symlink() and unet.is_symlink()
+    assert base.read_bytes() == b"s" * 4096 and unet.read_bytes() == b"u" * 8192
+    assert not list(store.blob_dir.rglob("*.part"))
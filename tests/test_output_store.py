@@ -0,0 +1,97 @@
+"""
+Tests for the indexed output store
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("cv2")
+
+from src.utils.output_store import OutputStore
+
+@pytest.fixture
+def store(tmp_path):
+    store = OutputStore(tmp_path / "outputs")
+    yield store
+    store.close()
+
+def save(store, prompt, seed=1, kind="txt2img", model="sdxl"):
+    image = Image.new("RGB", (64, 48))
+    return store.save(image, kind, {"prompt": prompt, "seed": seed, "num_inference_steps": 20}, model=model)
+
+def test_save_writes_dated_file_and_row(store):
+    output_id, path = save(store, "a red fox in snow")
+    assert path.exists()
+    assert path.parent.relative_to(store.output_dir).parts == tuple(datetime.now().strftime("%Y/%m/%d").split("/"))
+    
+    item = store.get(output_id)
+    assert item["prompt"] == "a red fox in snow"
+    assert (item["width"], item["height"], item["steps"]) == (64, 48, 20)
+
+def test_query_filters(store):
+    save(store, "a red fox in snow", seed=1)
+    save(store, "a blue whale", seed=2, kind="img2img")
+    save(store, "red sky at night", seed=3, model="other")
+    
+    assert {item["seed"] for item in store.query(prompt="red")["items"]} == {1, 3}
+    assert [item["seed"] for item in store.query(seed=2)["items"]] == [2]
+    assert [item["seed"] for item in store.query(kind="img2img")["items"]] == [2]
+    assert [item["seed"] for item in store.query(model="other")["items"]] == [3]
+    assert store.query(since=datetime.now() + timedelta(days=1))["items"] == []
+    
+    # Short substrings fall back to LIKE, with wildcards taken literally
+    assert len(store.query(prompt="ed")["items"]) == 2
+    assert store.query(prompt="%")["items"] == []
+
+def test_query_pages_newest_first(store):
+    for seed in range(5):
+        save(store, f"prompt {seed}", seed=seed)
+    
+    first = store.query(limit=2)
+    second = store.query(limit=2, cursor=first["next_cursor"])
+    third = store.query(limit=2, cursor=second["next_cursor"])
+    
+    seeds = [item["seed"] for page in (first, second, third) for item in page["items"]]
+    assert seeds == [4, 3, 2, 1, 0]
+    assert third["next_cursor"] is None
+    with pytest.raises(ValueError):
+        store.query(cursor="garbage")
+
+def test_prune_by_count_keeps_newest(store):
+    paths = [save(store, f"prompt {seed}", seed=seed)[1] for seed in range(5)]
+    assert store.prune(max_count=2) == 3
+    assert store.count() == 2
+    assert [p.exists() for p in paths] == [False, False, False, True, True]
+
+def test_prune_by_age(store):
+    save(store, "recent")
+    assert store.prune(max_age_days=1) == 0
+    assert store.prune(max_age_days=0) == 1
+
+def test_index_existing_flat_outputs(store):
+    old = store.output_dir / "txt2img_20240102_030405.png"
+    Image.new("RGB", (32, 16)).save(old)
+    Image.new("RGB", (8, 8)).save(store.output_dir / "inpaint_20240103_000000.png")
+    (store.output_dir / "img2img_20240104_000000.png").write_bytes(b"not a png")
+    (store.output_dir / "notes.png").write_bytes(b"")
+    
+    stats = store.index_existing()
+    assert stats == {"found": 3, "indexed": 2, "already_indexed": 0, "unreadable": 1}
+    assert store.index_existing()["already_indexed"] == 2
+    
+    item = store.query(kind="txt2img")["items"][0]
+    assert item["path"] == str(old)
+    assert (item["width"], item["height"]) == (32, 16)
+    assert item["created_at"] == datetime(2024, 1, 2, 3, 4, 5).isoformat()
+
+def test_indexed_files_sort_and_prune_by_creation_time(store):
+    _, new_path = save(store, "new")
+    old = store.output_dir / "txt2img_20200101_000000.png"
+    Image.new("RGB", (8, 8)).save(old)
+    store.index_existing()
+    
+    assert [item["prompt"] for item in store.query()["items"]] == ["new", None]
+    assert store.prune(max_count=1) == 1
+    assert new_path.exists() and not old.exists()
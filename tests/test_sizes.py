@@ -0,0 +1,24 @@
+"""
+Tests for size parsing
+"""
+
+import pytest
+
+from src.utils.sizes import parse_size
+
+@pytest.mark.parametrize("value, expected", [
+    ("50MB", 50 * 1024 ** 2),
+    ("10 mb", 10 * 1024 ** 2),
+    ("1.5GB", int(1.5 * 1024 ** 3)),
+    ("512KB", 512 * 1024),
+    ("100B", 100),
+    ("2048", 2048),
+    (4096, 4096)
+])
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+@pytest.mark.parametrize("value", ["", "MB", "10TB", "ten MB"])
+def test_parse_size_rejects_garbage(value):
+    with pytest.raises(ValueError):
+        parse_size(value)
@@ -0,0 +1,35 @@
+"""
+Tests for token merging coverage of the UNet
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+diffusers = pytest.importorskip("diffusers")
+
+from src.core.token_merging import TokenMerging
+
+@pytest.fixture(scope="module")
+def unet():
+    # Miniature SDXL layout: no attention at full resolution, deeper transformers further down
+    return diffusers.UNet2DConditionModel(
+        sample_size=32,
+        block_out_channels=(32, 64, 64),
+        layers_per_block=2,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "CrossAttnUpBlock2D", "UpBlock2D"),
+        transformer_layers_per_block=(1, 2, 3),
+        cross_attention_dim=32,
+        attention_head_dim=(2, 4, 8),
+        norm_num_groups=8
+    )
+
+def test_full_resolution_only_merges_nothing_on_sdxl(unet):
+    assert TokenMerging.merging_blocks(unet, 1) == 0
+
+def test_merging_blocks_by_level(unet):
+    # 2x: two down and three up attentions of two layers each
+    assert TokenMerging.merging_blocks(unet, 2) == 10
+    # 4x adds the deepest down, mid and up attentions of three layers each
+    assert TokenMerging.merging_blocks(unet, 4) == 28
+    assert TokenMerging.merging_blocks(unet, 8) == 28